@@ -1,51 +1,119 @@
-import logging
-import logging.config
+import os
+import time
+import importlib
+import threading
+import click
 from flask import Flask
 from app.config import Config
-from app.extensions import limiter, scheduler
-from app.utils import cleanup_old_files
+from app.extensions import limiter
+from app.utils import run_cleanup_sweep
+from app.meta_index import ensure_index, rebuild_index, dedup_stats
+from app.usage import eviction_policy, usage_stats
+from app.compression import available
+from app.metrics import init_metrics
+from app.logs import init_logging
+from app.secret_store import open_secret_store, purge_expired_secrets
+from app.storage import Storage, register_storage, s3_options, ensure_layout, migrate_layout
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    if not app.config.get('META_INDEX_PATH'):
+        app.config['META_INDEX_PATH'] = os.path.join(app.config['UPLOAD_FOLDER'], '.index.sqlite3')
+    if not app.config.get('CLEANUP_LOCK_PATH'):
+        app.config['CLEANUP_LOCK_PATH'] = os.path.join(app.config['UPLOAD_FOLDER'], '.cleanup.lock')
+    if not app.config.get('RATELIMIT_STORAGE_URI'):
+        app.config['RATELIMIT_STORAGE_URI'] = 'sqlite:///' + os.path.join(app.config['UPLOAD_FOLDER'], '.ratelimit.sqlite3')
+    if not app.config.get('SECRETS_STORAGE_URI'):
+        app.config['SECRETS_STORAGE_URI'] = 'sqlite:///' + os.path.join(app.config['UPLOAD_FOLDER'], '.secrets.sqlite3')
 
-    # Configure Logging
-    logging.config.dictConfig({
-        'version': 1,
-        'formatters': {
-            'default': {
-                'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
-            }
-        },
-        'handlers': {
-            'console': {
-                'class': 'logging.StreamHandler',
-                'stream': 'ext://sys.stdout',
-                'formatter': 'default'
-            }
-        },
-        'root': {
-            'level': 'INFO',
-            'handlers': ['console']
-        }
-    })
+    # Configure Logging (see app/logs.py)
+    init_logging(app)
+
+    if app.config.get('STORAGE_COMPRESSION') == 'zstd' and not available('zstd'):
+        app.logger.warning("STORAGE_COMPRESSION=zstd but the zstandard package is missing; using gzip")
+        app.config['STORAGE_COMPRESSION'] = 'gzip'
+
+    storage = register_storage(Storage(app.config['UPLOAD_FOLDER'], app.config['STORAGE_BACKEND'], s3_options(app.config)))
+    app.extensions['storage'] = storage
+    ensure_layout(app.config['UPLOAD_FOLDER'])
+    ensure_index(app.config['UPLOAD_FOLDER'], app.config['META_INDEX_PATH'])
 
     # Initialize Extensions
+    secret_store = open_secret_store(app.config['SECRETS_STORAGE_URI'], app.config['SECRETS_MAX_BYTES'])
+    app.extensions['secret_store'] = secret_store
     limiter.init_app(app)
+    init_metrics(app, limiter)
     
-    # Scheduler needs explicit start, but we should clear existing jobs if re-init (rare in this pattern)
-    if not scheduler.running:
-        scheduler.start()
-    
-    # Re-add job to ensure it's registered
-    # Note: APScheduler persistence is memory-only here, so restarting app restarts schedule
-    if not scheduler.get_jobs():
-        scheduler.add_job(
-            func=cleanup_old_files, 
-            trigger="interval", 
-            hours=1, 
-            args=[app.config['UPLOAD_FOLDER']]
-        )
+    sweep_args = [
+        app.config['UPLOAD_FOLDER'],
+        app.config['META_INDEX_PATH'],
+        app.config['CLEANUP_LOCK_PATH'],
+        app.config['CLEANUP_BATCH_SIZE'],
+        app.config['CLEANUP_TIME_BUDGET_SECONDS'],
+        eviction_policy(app.config),
+    ]
+
+    # The scheduler thread is started in the process that serves requests, never here:
+    # create_app may run in a gunicorn --preload master, and threads don't survive fork.
+    # gunicorn.conf.py starts it as each worker boots, other servers on the first request.
+    app.extensions['sweep_args'] = sweep_args
+    if app.config['CLEANUP_SCHEDULER'] == 'leader':
+        @app.before_request
+        def ensure_scheduler():
+            start_scheduler(app)
+
+    @app.cli.command('cleanup')
+    @click.option('--loop', is_flag=True, help='Keep sweeping every CLEANUP_INTERVAL_SECONDS.')
+    def cleanup_command(loop):
+        """Remove expired uploads (for use with CLEANUP_SCHEDULER=off)."""
+        while True:
+            stats = run_cleanup_sweep(*sweep_args)
+            purge_expired_secrets(secret_store)
+            if stats is None:
+                click.echo("Another process holds the cleanup lock, skipping.")
+            else:
+                click.echo(f"Removed {stats['removed']} expired uploads, evicted {stats['evicted']} in {stats['duration']:.3f}s")
+            if not loop:
+                break
+            time.sleep(app.config['CLEANUP_INTERVAL_SECONDS'])
+
+    @app.cli.command('rebuild-index')
+    def rebuild_index_command():
+        """Import existing .meta files into the metadata index."""
+        count = rebuild_index(app.config['UPLOAD_FOLDER'], app.config['META_INDEX_PATH'])
+        click.echo(f"Indexed {count} uploads into {app.config['META_INDEX_PATH']}")
+
+    @app.cli.command('migrate-layout')
+    @click.option('--limit', type=int, default=None, help='Move at most this many uploads per run.')
+    def migrate_layout_command(limit):
+        """Move uploads from the flat layout into hashed shard directories (safe while serving)."""
+        moved, skipped, done = migrate_layout(app.config['UPLOAD_FOLDER'], limit)
+        click.echo(f"Moved {moved} uploads, skipped {skipped} with uploads in progress")
+        click.echo("Layout is sharded." if done else "Not finished yet, run again.")
+
+    @app.cli.command('dedup-stats')
+    def dedup_stats_command():
+        """Report how much storage content deduplication saves."""
+        stats = dedup_stats(app.config['META_INDEX_PATH'])
+        click.echo(f"Links: {stats['links']}, unique blobs: {stats['blobs']}")
+        click.echo(f"Logical: {stats['logical_bytes']} bytes, stored: {stats['stored_bytes']} bytes")
+        click.echo(f"Saved: {stats['bytes_saved']} bytes (dedup ratio {stats['dedup_ratio']:.2f}x)")
+
+    @app.cli.command('usage')
+    @click.option('--top', type=int, default=10, help='Number of clients to list.')
+    def usage_command(top):
+        """Report storage level and upload bytes per client (see app/usage.py)."""
+        stats = usage_stats(app.config['UPLOAD_FOLDER'], app.config['META_INDEX_PATH'],
+                            app.config['STORAGE_MAX_BYTES'], top)
+        click.echo(f"Storage level: {stats['level']:.1%} (evict above {app.config['STORAGE_EVICT_WATERMARK']:.0%}, "
+                   f"refuse above {app.config['STORAGE_REJECT_WATERMARK']:.0%})")
+        click.echo(f"Filesystem: {stats['fs_free']} of {stats['fs_size']} bytes available")
+        limit = f" of {stats['max_bytes']}" if stats['max_bytes'] else ''
+        click.echo(f"Accounted: {stats['bytes']}{limit} bytes in {stats['files']} files, {stats['clients']} clients")
+        for client, used, files in stats['top_clients']:
+            click.echo(f"  {client:<40} {used:>14} bytes  {files:>6} files")
 
     # Register Blueprints
     from app.routes.misc import misc_bp
@@ -63,3 +131,50 @@ def create_app(config_class=Config):
     )
 
     return app
+
+_scheduler_lock = threading.Lock()
+
+def start_scheduler(app):
+    # Once per process; a no-op with CLEANUP_SCHEDULER=off
+    if app.config['CLEANUP_SCHEDULER'] != 'leader':
+        return None
+    running = app.extensions.get('scheduler')
+    if running and running[0] == os.getpid():
+        return running[1]
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    with _scheduler_lock:
+        running = app.extensions.get('scheduler')
+        if running and running[0] == os.getpid():
+            return running[1]
+        # Every worker ticks, but only the flock holder actually sweeps (see is_cleanup_leader)
+        # Note: APScheduler persistence is memory-only here, so restarting app restarts schedule
+        scheduler = BackgroundScheduler()
+        scheduler.start()
+        scheduler.add_job(
+            func=run_cleanup_sweep,
+            trigger="interval",
+            seconds=app.config['CLEANUP_INTERVAL_SECONDS'],
+            args=app.extensions['sweep_args']
+        )
+        # Not leader-only: a memory:// store lives in each worker
+        scheduler.add_job(
+            func=purge_expired_secrets,
+            trigger="interval",
+            seconds=app.config['CLEANUP_INTERVAL_SECONDS'],
+            args=[app.extensions['secret_store']]
+        )
+        app.extensions['scheduler'] = (os.getpid(), scheduler)
+        return scheduler
+
+# Imported on first use by the few requests that need them (/qr, /pretty, /secret, the
+# scheduler), so workers boot without them. A --preload master imports them up front
+# instead (see gunicorn.conf.py): loaded once before fork they are shared by all workers.
+LAZY_MODULES = (
+    'qrcode', 'qrcode.image.pil', 'PIL.PngImagePlugin', 'yaml', 'xml.dom.minidom',
+    'cryptography.fernet', 'apscheduler.schedulers.background',
+)
+
+def preload_modules():
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
@@ -0,0 +1,163 @@
+import os
+import time
+import tarfile
+import zipfile
+import posixpath
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, File, Field, Epilogue
+
+# Multi-file uploads and archive downloads.
+#
+# A multi-file upload (multipart form or an extracted tar) is one upload id holding every
+# entry as an ordinary file of its own: <id>/<filename> plus <filename>.meta, with the
+# entry's path inside the upload recorded in the .meta as 'path'. Each entry is a link
+# like any other (dedup, compression, storage backend, download budget).
+# /<id>.zip and /<id>.tar stream all of an upload's entries as one archive, generated
+# while it is sent: memory use doesn't depend on the archive size.
+
+MAX_FILENAME_BYTES = 200  # leaves room for ".meta" and cache prefixes within NAME_MAX
+
+def entry_path(name):
+    # Normalised relative path of an archive/form entry, or None if it can't be stored safely
+    parts = []
+    for part in name.replace('\\', '/').split('/'):
+        if part in ('', '.'):
+            continue
+        if part == '..' or '\0' in part:
+            return None
+        parts.append(part)
+    return '/'.join(parts) or None
+
+def entry_filename(path, taken):
+    # Flat name the entry is stored and linked under (<id>/<filename>): its base name, made
+    # unique within the upload and kept clear of the dotfiles and .meta files next to it
+    base = posixpath.basename(path)
+    if base.startswith('.'):
+        base = '_' + base[1:]
+    if base.endswith('.meta'):
+        base += '_'
+    stem, ext = os.path.splitext(base)
+    while len(f"{stem}{ext}".encode()) > MAX_FILENAME_BYTES:
+        stem, ext = (stem[:-1], ext) if stem else ('', ext[:-1])
+    filename = f"{stem}{ext}"
+    n = 2
+    while filename in taken:
+        filename = f"{stem}-{n}{ext}"
+        n += 1
+    taken.add(filename)
+    return filename
+
+def iter_tar_entries(stream):
+    # (name, reader, size) of each regular file of a tar read sequentially from stream
+    # (plain, gzip, bzip2 or xz). Directories, links and devices are skipped.
+    with tarfile.open(fileobj=stream, mode='r|*') as tar:
+        for member in tar:
+            if member.isfile():
+                yield member.name, tar.extractfile(member), member.size
+            else:
+                yield None, None, None  # counted against the entry limit all the same
+            tar.members.clear()  # stream mode would otherwise remember every header
+
+class _PartReader:
+    # Body of one multipart part, read as the decoder produces it
+    def __init__(self, next_event):
+        self._next_event = next_event
+        self.done = False
+
+    def read(self, n=-1):
+        while not self.done:
+            event = self._next_event()
+            self.done = not event.more_data
+            if event.data:
+                return event.data
+        return b''
+
+def iter_form_files(stream, boundary, chunk_size=64 * 1024):
+    # (filename, reader, None) of each file part of a multipart/form-data body, parsed
+    # incrementally so no part is ever held in memory or spooled to a temp file.
+    # Plain form fields are skipped.
+    decoder = MultipartDecoder(boundary, max_form_memory_size=16 * chunk_size)
+
+    def next_event():
+        while True:
+            event = decoder.next_event()
+            if event is not NEED_DATA:
+                return event
+            decoder.receive_data(stream.read(chunk_size) or None)
+
+    while True:
+        event = next_event()
+        if isinstance(event, Epilogue):
+            return
+        if isinstance(event, (File, Field)):
+            part = _PartReader(next_event)
+            if isinstance(event, File) and event.filename:
+                yield event.filename, part, None
+            while part.read():
+                pass  # whatever the consumer left of the part
+
+class _Sink:
+    # Write-only file collecting what zipfile produces until the response generator takes it
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+def _copy(f, size, chunk_size):
+    # Exactly size bytes of f (zero-filled if it falls short), then closes it
+    with f:
+        left = size
+        while left:
+            data = f.read(min(chunk_size, left))
+            if not data:
+                break
+            left -= len(data)
+            yield data
+    while left:
+        yield bytes(min(chunk_size, left))
+        left -= min(chunk_size, left)
+
+def stream_zip(members, chunk_size=64 * 1024):
+    # Zip of (path, size, reader) members. Stored, not deflated: the CPU goes to sending,
+    # and zipfile writes to an unseekable sink with data descriptors and zip64 as needed.
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, size, f in members:
+            info = zipfile.ZipInfo(path, time.localtime()[:6])
+            info.file_size = size
+            info.external_attr = 0o644 << 16
+            with archive.open(info, 'w') as out:
+                for data in _copy(f, size, chunk_size):
+                    out.write(data)
+                    yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+def stream_tar(members, chunk_size=64 * 1024):
+    # POSIX (pax) tar of (path, size, reader) members, written block by block
+    total = 0
+    now = time.time()
+    for path, size, f in members:
+        info = tarfile.TarInfo(path)
+        info.size = size
+        info.mtime = now
+        info.mode = 0o644
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        yield header
+        yield from _copy(f, size, chunk_size)
+        padding = -size % tarfile.BLOCKSIZE
+        yield bytes(padding)
+        total += len(header) + size + padding
+    # End-of-archive marker, padded to a whole record like tarfile does
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(total + end) % tarfile.RECORDSIZE
+    yield bytes(end)
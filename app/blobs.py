@@ -0,0 +1,56 @@
+import os
+import logging
+from contextlib import contextmanager
+from app.cooperative import flock_exclusive
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed store for upload bodies. Each unique body is kept once at
+# <UPLOAD_FOLDER>/.blobs/<sha[:2]>/<sha>, and every link (<id>/<filename>) is a hard link
+# to it, so serve_file, X-Accel and the TTL/download metadata keep working on the link
+# path unchanged. The inode link count is the reference count: a blob whose st_nlink
+# drops to 1 (only the store entry left) is garbage.
+
+BLOB_DIR = '.blobs'
+
+@contextmanager
+def _store_lock(upload_folder):
+    # Serialises link/release so a blob can't be collected while a new link is made to it
+    fd = os.open(os.path.join(upload_folder, BLOB_DIR), os.O_RDONLY)
+    try:
+        flock_exclusive(fd)
+        yield
+    finally:
+        os.close(fd)
+
+def blob_key(digest, encoding=None):
+    # Compressed and raw copies of the same body are different files on disk
+    return f"{digest}.{encoding}" if encoding else digest
+
+def blob_path(upload_folder, digest):
+    return os.path.join(upload_folder, BLOB_DIR, digest[:2], digest)
+
+def link_blob(upload_folder, file_path, digest):
+    # Called with a freshly written upload at file_path. Returns True if an identical
+    # blob already existed and file_path now shares it, False if file_path became the blob.
+    path = blob_path(upload_folder, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _store_lock(upload_folder):
+        if os.path.exists(path):
+            tmp_link = file_path + '.dedup'
+            os.link(path, tmp_link)
+            os.replace(tmp_link, file_path)
+            return True
+        os.link(file_path, path)
+        return False
+
+def release_blob(upload_folder, digest):
+    # Drop the store entry once no link references it any more
+    path = blob_path(upload_folder, digest)
+    try:
+        with _store_lock(upload_folder):
+            if os.stat(path).st_nlink <= 1:
+                os.unlink(path)
+                logger.info(f"Blob released: {digest}")
+    except FileNotFoundError:
+        pass
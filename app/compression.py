@@ -0,0 +1,59 @@
+import os
+import gzip
+import importlib.util
+
+# Transparent compressed storage. Text-like uploads can be written to disk gzip- or
+# zstd-compressed; the encoding is recorded in the upload's .meta and everything that
+# reads the body (downloads, viewer, /pretty) goes through open_decoded() / decode_stream().
+
+ENCODINGS = ('gzip', 'zstd')
+
+# Extensions worth compressing (the code viewer's text types)
+COMPRESSIBLE_EXTS = {
+    '.txt', '.py', '.js', '.html', '.css', '.json', '.yaml', '.yml',
+    '.sh', '.md', '.go', '.rs', '.c', '.cpp', '.h', '.java', '.rb',
+    '.php', '.sql', '.xml', '.log', '.ini', '.conf', '.csv', '.tsv',
+}
+
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+def available(encoding):
+    # zstd storage is optional (gzip is always there); checked without importing it
+    return encoding == 'gzip' or (encoding == 'zstd' and importlib.util.find_spec('zstandard') is not None)
+
+def _zstandard():
+    import zstandard  # loaded by the first zstd body rather than at boot
+    return zstandard
+
+def choose_encoding(config, filename, size=None):
+    # Storage encoding for a new upload, or None to store it as sent
+    encoding = config.get('STORAGE_COMPRESSION', 'off')
+    if encoding not in ENCODINGS:
+        return None
+    if os.path.splitext(filename)[1].lower() not in COMPRESSIBLE_EXTS:
+        return None
+    if size is not None and size < config.get('COMPRESS_MIN_BYTES', 1024):
+        return None
+    return encoding
+
+def open_encoder(f, encoding, level=None):
+    # Writable wrapper compressing into f; closing it finishes the stream but leaves f open
+    level = level or DEFAULT_LEVELS[encoding]
+    if encoding == 'gzip':
+        # mtime=0 keeps the output deterministic, so identical bodies still deduplicate
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=level, mtime=0)
+    return _zstandard().ZstdCompressor(level=level).stream_writer(f, closefd=False)
+
+def open_decoded(file_path, encoding=None):
+    # Binary reader of the original bytes. Supports forward seek (by decompressing up to it).
+    return decode_stream(open(file_path, 'rb'), encoding)
+
+def decode_stream(f, encoding=None):
+    # Same over an open binary stream (e.g. an object fetched from S3); closing the reader closes f
+    if encoding == 'gzip':
+        reader = gzip.GzipFile(fileobj=f, mode='rb')
+        reader.myfileobj = f  # closed along with the reader, as gzip.open() does with its own file
+        return reader
+    if encoding == 'zstd':
+        return _zstandard().ZstdDecompressor().stream_reader(f, closefd=True)
+    return f
@@ -4,7 +4,92 @@ class Config:
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
     # Assuming app/ is the base, uploads is at root/uploads (../uploads) relative to app/
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.abspath(os.path.join(BASE_DIR, '../uploads'))
+    # SQLite index of upload expiry/download metadata; defaults to <UPLOAD_FOLDER>/.index.sqlite3
+    META_INDEX_PATH = os.environ.get('META_INDEX_PATH')
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50 MB
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # bytes read from request.stream per write
+    # Resumable uploads (/upload/...): chunks of up to MAX_CONTENT_LENGTH each
+    CHUNKED_MAX_SIZE = int(os.environ.get('CHUNKED_MAX_SIZE', 2 * 1024 * 1024 * 1024))  # 2 GB per file
+    CHUNKED_MAX_CHUNKS = 10000
+    CHUNKED_SESSION_SECONDS = 86400  # unfinished sessions are removed by the cleanup job after this
+    # Multi-file uploads (POST / multipart, PUT with X-Extract: tar), each entry stored as its own file.
+    # nginx/conf.d/app.conf lets request bodies this large through on those two routes only.
+    ARCHIVE_MAX_SIZE = int(os.environ.get('ARCHIVE_MAX_SIZE', 2 * 1024 * 1024 * 1024))  # 2 GB per upload, all entries
+    ARCHIVE_MAX_ENTRIES = 1000  # members of an uploaded tar (directories included) or files of a form
+    # Where published upload bodies go: 'local' (the upload directory) or 's3' (see app/storage.py).
+    # Upload directories themselves always stay local, sharded as <UPLOAD_FOLDER>/<xx>/<yy>/<id>.
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_ENDPOINT = os.environ.get('S3_ENDPOINT', 'https://s3.amazonaws.com')  # or e.g. http://minio:9000
+    S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY')
+    S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY')
+    # Store identical upload bodies once (hard links into <UPLOAD_FOLDER>/.blobs; local backend only)
+    DEDUP_UPLOADS = os.environ.get('DEDUP_UPLOADS', 'true').lower() == 'true'
+    # Store text uploads (see app/compression.py) compressed on disk: 'off', 'gzip' or 'zstd'
+    STORAGE_COMPRESSION = os.environ.get('STORAGE_COMPRESSION', 'off')
+    COMPRESSION_LEVEL = None  # None: gzip 6 / zstd 3
+    COMPRESS_MIN_BYTES = 1024  # smaller bodies are stored as sent
+    # Admission control and eviction (see app/usage.py). Levels are fractions of the store's
+    # capacity: the filesystem of UPLOAD_FOLDER as df counts it, or STORAGE_MAX_BYTES of
+    # accounted upload bytes if that is set and fuller.
+    STORAGE_MAX_BYTES = int(os.environ.get('STORAGE_MAX_BYTES', 0))  # 0: the filesystem alone
+    STORAGE_EVICT_WATERMARK = float(os.environ.get('STORAGE_EVICT_WATERMARK', 0.85))  # above it uploads closest to expiry are evicted...
+    STORAGE_EVICT_TARGET = float(os.environ.get('STORAGE_EVICT_TARGET', 0.75))  # ...until it is back down to this
+    STORAGE_REJECT_WATERMARK = float(os.environ.get('STORAGE_REJECT_WATERMARK', 0.95))  # uploads that would pass it get a 507
+    STORAGE_EVICT_BATCH = 200  # uploads evicted per run at most
+    # Bytes of live uploads per client address (IPv6: per /64); more gets a 429. 0: no quota
+    CLIENT_QUOTA_BYTES = int(os.environ.get('CLIENT_QUOTA_BYTES', 1024 * 1024 * 1024))
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change'
+    # Protected links: werkzeug hash method (e.g. 'pbkdf2:sha256:600000'); existing hashes keep their own
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = 2  # hashing threads per web worker
+    PASSWORD_HASH_QUEUE = 8  # attempts waiting beyond that get a 503
+    PASSWORD_ACCESS_SECONDS = 900  # lifetime of the access cookie issued after a correct password
     MAX_TTL_SECONDS = 604800  # 7 days
     MAX_DOWNLOADS = 100
+    QR_CACHE_SIZE = 256  # rendered QR PNGs kept per worker (LRU)
+    QR_DISK_CACHE = True  # also keep the PNG next to the upload, shared by all workers
+    PRETTY_WORKERS = 2  # formatter processes per web worker
+    PRETTY_TIMEOUT_SECONDS = 10  # per document
+    PRETTY_MAX_MEMORY_MB = 512  # address-space cap of each formatter process
+    PRETTY_STREAM_JSON_BYTES = 1024 * 1024  # larger JSON is re-indented without parsing into objects
+    VIEWER_PAGE_BYTES = 256 * 1024  # code viewer renders this much, then fetches further pages
+    VIEWER_SESSION_SECONDS = 900  # how long a viewer may keep fetching pages of a consumed file
+    # 'stream': Flask streams the file via wsgi.file_wrapper (sendfile under gunicorn)
+    # 'accel': Flask only runs the checks, nginx sends the bytes via X-Accel-Redirect
+    DOWNLOAD_MODE = os.environ.get('DOWNLOAD_MODE', 'stream')
+    ACCEL_REDIRECT_PREFIX = '/_accel/'  # must match the internal location in nginx/conf.d/app.conf
+    ACCEL_GRACE_SECONDS = 300  # how long a consumed file stays on disk for nginx to finish sending
+    # A counted range response sets a download session cookie: within this many seconds its
+    # holder may fetch up to one more body's worth of ranges (seeking, resuming) without using
+    # up another download; 0: every response counts
+    RANGE_SESSION_SECONDS = 300
+    RANGE_MAX_PARTS = 16  # larger multi-range requests are answered with the whole file
+    # 'leader': one gunicorn worker per host (flock on CLEANUP_LOCK_PATH) runs the sweep
+    # 'off': no in-process scheduler; run `flask cleanup --loop` as a sidecar/cron instead
+    CLEANUP_SCHEDULER = os.environ.get('CLEANUP_SCHEDULER', 'leader')
+    CLEANUP_LOCK_PATH = os.environ.get('CLEANUP_LOCK_PATH')  # defaults to <UPLOAD_FOLDER>/.cleanup.lock
+    CLEANUP_INTERVAL_SECONDS = int(os.environ.get('CLEANUP_INTERVAL_SECONDS', 300))
+    CLEANUP_BATCH_SIZE = 500
+    CLEANUP_TIME_BUDGET_SECONDS = 30
+    # 'text' or 'json' (one object per line with request id, path and elapsed time; see app/logs.py)
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    # Queue records for a writer thread instead of writing to stdout inside the request
+    LOG_ASYNC = os.environ.get('LOG_ASYNC', 'true').lower() == 'true'
+    LOG_QUEUE_SIZE = 10000  # records; beyond half of it info lines are sampled, then dropped
+    LOG_PRESSURE_SAMPLE = 10  # 1 in N info lines kept while the queue is over half full
+    LOG_REQUESTS = os.environ.get('LOG_REQUESTS', 'false').lower() == 'true'  # one line per request
+    # /metrics and per-request instrumentation (aggregated across workers via PROMETHEUS_MULTIPROC_DIR)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    # /secret storage: sqlite:///<UPLOAD_FOLDER>/.secrets.sqlite3 by default (set in create_app),
+    # "memory://" keeps secrets in the worker process (single-worker deployments only)
+    SECRETS_STORAGE_URI = os.environ.get('SECRETS_STORAGE_URI')
+    SECRETS_MAX_BYTES = 64 * 1024 * 1024  # oldest secrets are evicted beyond this
+    SECRET_MAX_BYTES = 64 * 1024  # per secret
+    # Shared across workers by default: sqlite:///<UPLOAD_FOLDER>/.ratelimit.sqlite3 (set in create_app).
+    # "memory://" gives per-process counters; any limits storage URI (redis://...) also works.
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI')
+    RATELIMIT_STRATEGY = os.environ.get('RATELIMIT_STRATEGY', 'fixed-window')  # or 'sliding-window-counter'
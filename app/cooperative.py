@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import fcntl
+import sqlite3
+import _queue
+import _thread
+import threading
+
+# Helpers that keep blocking calls from stalling a gevent worker (GUNICORN_WORKER_CLASS=gevent,
+# see gunicorn.conf.py). Under the sync worker they behave like the plain calls.
+
+def _monkey():
+    # gevent's monkey module if something loaded it (gunicorn's gevent worker, or
+    # gunicorn.conf.py before preloading), else None: gevent itself is never imported here
+    return sys.modules.get('gevent.monkey')
+
+_cooperative = False
+
+def is_cooperative():
+    # True once gevent has monkey-patched this process (done by gunicorn's gevent worker).
+    # Patching is never undone, so once seen it is remembered.
+    global _cooperative
+    if not _cooperative:
+        monkey = _monkey()
+        _cooperative = monkey is not None and monkey.is_module_patched('time')
+    return _cooperative
+
+def thread_local():
+    # Storage local to the OS thread. Under gevent threading.local() is per greenlet, which
+    # would give every request its own SQLite connection (and a WAL checkpoint on close).
+    monkey = _monkey()
+    if monkey is None:
+        return _thread._local()
+    return monkey.get_original('_thread', '_local')()
+
+_sqlite = thread_local()
+
+def sqlite_connection(path, pragmas=(), setup=None, timeout=5):
+    # One autocommit connection per database, OS thread and process: a connection opened
+    # before a fork (gunicorn --preload) must not be used by the workers. pragmas (e.g.
+    # 'journal_mode=WAL') and setup(conn), creating the schema, run once per new connection.
+    conns = getattr(_sqlite, 'conns', None)
+    if conns is None or _sqlite.pid != os.getpid():
+        conns = _sqlite.conns = {}
+        _sqlite.pid = os.getpid()
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        for pragma in pragmas:
+            conn.execute(f'PRAGMA {pragma}')
+        if setup:
+            setup(conn)
+        conns[path] = conn
+    return conn
+
+def _original(module, name, default):
+    monkey = _monkey()
+    if monkey is None:
+        return default
+    return monkey.get_original(module, name)
+
+def start_os_thread(target, *args):
+    # A real OS thread even under gevent, for work that blocks in C (e.g. writing to a full
+    # pipe) and would otherwise stall the hub. It may only share os_queue()/os_lock()
+    # objects with greenlets: gevent's patched primitives can't be waited on across threads.
+    return _original('_thread', 'start_new_thread', _thread.start_new_thread)(target, args)
+
+def os_queue():
+    # Unbounded FIFO usable between greenlets and start_os_thread threads (never patched)
+    return _queue.SimpleQueue()
+
+def os_lock(reentrant=False):
+    if reentrant:
+        return _original('_thread', 'RLock', _thread.RLock)()
+    return _original('_thread', 'allocate_lock', _thread.allocate_lock)()
+
+class PerProcess:
+    # A value built on first use in each process, never inherited across a fork (e.g. a
+    # worker pool created before gunicorn forks). reset() drops it; the next get() rebuilds.
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None  # (pid, value)
+        self._lock = threading.Lock()
+
+    def get(self, *args):
+        with self._lock:
+            if self._value is None or self._value[0] != os.getpid():
+                self._value = (os.getpid(), self._factory(*args))
+            return self._value[1]
+
+    def reset(self):
+        self._value = None
+
+def thread_executor(max_workers):
+    # A pool of real OS threads. Under gevent, concurrent.futures would get patched threads
+    # (greenlets on the hub), so CPU-bound work there would still block the whole worker.
+    if is_cooperative():
+        from gevent.threadpool import ThreadPoolExecutor
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+def flock_exclusive(fd):
+    # A blocking flock would stall every greenlet of the worker, and deadlock outright if
+    # the holder is another greenlet of the same process; poll with a short sleep instead
+    if not is_cooperative():
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+def yield_now():
+    # Let other greenlets run during long disk-bound loops (no-op without gevent)
+    if is_cooperative():
+        time.sleep(0)
@@ -1,11 +1,9 @@
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from apscheduler.schedulers.background import BackgroundScheduler
+import app.ratelimit_storage  # registers the sqlite:// limiter storage scheme
 
+# Storage comes from RATELIMIT_STORAGE_URI (see Config), shared across workers by default
 limiter = Limiter(
     key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    default_limits=["200 per day", "50 per hour"]
 )
-
-scheduler = BackgroundScheduler()
@@ -0,0 +1,205 @@
+import os
+import re
+import sys
+import copy
+import json
+import time
+import uuid
+import logging
+from datetime import datetime, timezone
+from flask import g, request, has_request_context
+from app.cooperative import start_os_thread, os_queue, os_lock
+from app.metrics import LOG_DROPPED
+
+# Log output, configured by create_app.
+#
+# LOG_FORMAT: 'text' (the classic one-line format) or 'json' (one object per line, with the
+# request id, method, path, client and elapsed time of the request that logged it).
+# LOG_ASYNC (default): the logging call only queues the record; a writer thread (a real OS
+# thread, also under gevent) formats and writes it, so a slow stdout (a backed-up pipe to
+# the Docker log driver / promtail) never holds up a request. The queue is bounded:
+#   - above half of LOG_QUEUE_SIZE, only 1 in LOG_PRESSURE_SAMPLE info/debug records is kept
+#   - above 90% info/debug records are dropped; warnings and errors use the rest
+#   - when it is full everything new is dropped
+# Drops are counted in cupload_log_dropped_total and reported in the log once it drains.
+
+REQUEST_ID_RE = re.compile(r'[A-Za-z0-9._-]{1,64}')
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+# Request fields captured when the record is created (the writer has no request context)
+REQUEST_FIELDS = ('request_id', 'method', 'path', 'remote_addr', 'duration_ms', 'status')
+
+def request_fields():
+    if not has_request_context():
+        return {}
+    fields = {
+        'request_id': g.get('request_id'),
+        'method': request.method,
+        'path': request.path,
+        'remote_addr': request.remote_addr,
+    }
+    start = g.get('request_start')
+    if start is not None:
+        fields['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    return fields
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key in REQUEST_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextFilter(logging.Filter):
+    # Synchronous mode: attach the request fields while still in the request
+    def filter(self, record):
+        record.__dict__.update(request_fields())
+        return True
+
+def _write(queue, target, done):
+    try:
+        while True:
+            record = queue.get()
+            if record is None:
+                break
+            target.handle(record)
+    finally:
+        done.release()
+
+class AsyncHandler(logging.Handler):
+    # Queues records for target, which is only ever used from the writer thread. The thread
+    # is started on first use in each process: a --preload master's wouldn't survive fork.
+    def __init__(self, target, capacity=10000, sample=10, flush_timeout=2):
+        super().__init__()
+        target.lock = os_lock(reentrant=True)
+        self.target = target
+        self.capacity = capacity
+        self.sample = max(1, sample)
+        self.flush_timeout = flush_timeout
+        self._pid = None
+        self._queue = None
+        self._done = None
+        self._start_lock = os_lock()
+        self._seen = 0
+        self.dropped = {}  # (level, reason) -> records not written since the last report
+
+    def _start(self):
+        # Threads and greenlets may all log for the first time at once: one starts the writer,
+        # and _pid is set last so nobody uses the queue before it is in place
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = os_queue()
+            self._done = os_lock()
+            self._done.acquire()
+            self.dropped = {}
+            start_os_thread(_write, self._queue, self.target, self._done)
+            self._pid = os.getpid()
+
+    def _admit(self, record):
+        depth = self._queue.qsize()
+        if depth < self.capacity // 2:
+            return None
+        if depth >= self.capacity:
+            return 'full'
+        if record.levelno >= logging.WARNING:
+            return None
+        if depth >= self.capacity * 9 // 10:
+            return 'shed'
+        self._seen += 1
+        return None if self._seen % self.sample == 0 else 'sampled'
+
+    def prepare(self, record):
+        # A self-contained copy: message rendered and exception formatted now, so the writer
+        # needs neither the arguments nor the traceback's frames
+        record = copy.copy(record)
+        record.__dict__.update(request_fields())
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            if self._pid != os.getpid():
+                self._start()
+            reason = self._admit(record)
+            if reason:
+                key = (record.levelname, reason)
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+                LOG_DROPPED.labels(record.levelname, reason).inc()
+                return
+            if self.dropped and self._queue.qsize() < self.capacity // 2:
+                self._report_drops()
+            self._queue.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def _report_drops(self):
+        counts = ', '.join(f"{count} {level.lower()} ({reason})" for (level, reason), count in sorted(self.dropped.items()))
+        self.dropped = {}
+        notice = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                   f"Log output fell behind, dropped records: {counts}", None, None)
+        self._queue.put(notice)
+
+    def flush(self):
+        pass  # the writer flushes the target after every record
+
+    def close(self):
+        # Called by logging.shutdown at exit: let the writer finish what is queued
+        if self._pid == os.getpid():
+            self._queue.put(None)
+            self._done.acquire(timeout=self.flush_timeout)
+            self._pid = None
+        self.target.close()
+        super().close()
+
+def init_logging(app):
+    config = app.config
+    target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(JsonFormatter() if config.get('LOG_FORMAT') == 'json' else logging.Formatter(TEXT_FORMAT))
+    if config.get('LOG_ASYNC', True):
+        handler = AsyncHandler(target, config.get('LOG_QUEUE_SIZE', 10000), config.get('LOG_PRESSURE_SAMPLE', 10))
+    else:
+        handler = target
+        handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    app.extensions['log_handler'] = handler
+
+    @app.before_request
+    def start_request_log():
+        g.request_start = time.perf_counter()
+        # nginx passes its $request_id, so both logs can be joined
+        incoming = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming if REQUEST_ID_RE.fullmatch(incoming) else uuid.uuid4().hex
+
+    @app.after_request
+    def finish_request_log(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        if config.get('LOG_REQUESTS'):
+            logging.getLogger('app.requests').info(
+                f"{request.method} {request.path} {response.status_code}", extra={'status': response.status_code})
+        return response
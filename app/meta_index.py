@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from app.cooperative import sqlite_connection
+from app.blobs import blob_key
+from app.storage import upload_dir, iter_upload_ids
+
+logger = logging.getLogger(__name__)
+
+# SQLite mirror of the per-upload .meta files, so the cleanup job can find expired
+# uploads with an indexed range query instead of listing and parsing the whole tree.
+# `id` is the upload id (e.g. "ab12cd34", or "secrets/<id>" for legacy secrets); its
+# directory is found with storage.upload_dir().
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    expiry_time REAL NOT NULL,
+    remaining_downloads INTEGER,
+    password_hash TEXT,
+    sha256 TEXT,
+    size INTEGER,
+    encoding TEXT,
+    stored_size INTEGER,
+    client TEXT,
+    PRIMARY KEY (id, filename)
+);
+CREATE INDEX IF NOT EXISTS uploads_expiry ON uploads (expiry_time);
+"""
+
+# Usage accounting (see app/usage.py): bytes on disk (stored_size, else size) and files per
+# client address, plus the whole store under client ''. Triggers keep it in step with every
+# row inserted or deleted (INSERT OR REPLACE fires both, with recursive_triggers on), so
+# reading it is a primary-key lookup. Rows are never updated in size or client.
+USAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    client TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS usage_insert AFTER INSERT ON uploads BEGIN
+    INSERT INTO usage SELECT '', COALESCE(NEW.stored_size, NEW.size, 0), 1 WHERE 1
+        ON CONFLICT (client) DO UPDATE SET bytes = bytes + excluded.bytes, files = files + 1;
+    INSERT INTO usage SELECT NEW.client, COALESCE(NEW.stored_size, NEW.size, 0), 1 WHERE NEW.client IS NOT NULL
+        ON CONFLICT (client) DO UPDATE SET bytes = bytes + excluded.bytes, files = files + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS usage_delete AFTER DELETE ON uploads BEGIN
+    UPDATE usage SET bytes = bytes - COALESCE(OLD.stored_size, OLD.size, 0), files = files - 1
+        WHERE client = '' OR client = OLD.client;
+    DELETE FROM usage WHERE client = OLD.client AND files <= 0;
+END;
+"""
+
+# Columns added after the first release of the index; ALTERed into older databases
+MIGRATIONS = [
+    'ALTER TABLE uploads ADD COLUMN sha256 TEXT',
+    'ALTER TABLE uploads ADD COLUMN size INTEGER',
+    'ALTER TABLE uploads ADD COLUMN encoding TEXT',
+    'ALTER TABLE uploads ADD COLUMN stored_size INTEGER',
+    'ALTER TABLE uploads ADD COLUMN client TEXT',
+]
+
+# Uploads without a .meta (e.g. /pretty) keep the old "delete after 24h" rule
+DEFAULT_EXPIRY_SECONDS = 86400
+
+def get_db(index_path):
+    # One connection per thread (the scheduler sweeps from its own thread) and per process
+    return sqlite_connection(index_path, ('journal_mode=WAL', 'synchronous=NORMAL'), _setup, timeout=30)
+
+def _setup(conn):
+    conn.executescript(SCHEMA)
+    for statement in MIGRATIONS:
+        try:
+            conn.execute(statement)
+        except sqlite3.OperationalError:
+            pass  # column already exists
+    conn.execute('PRAGMA recursive_triggers=ON')
+    conn.executescript(USAGE_SCHEMA)
+    if conn.execute("SELECT 1 FROM usage WHERE client = ''").fetchone() is None:
+        _rebuild_usage(conn)
+
+def _rebuild_usage(conn):
+    # Totals for rows indexed before the usage table existed (and for a new, empty index)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM usage')
+        conn.execute(
+            "INSERT INTO usage SELECT '', COALESCE(SUM(COALESCE(stored_size, size, 0)), 0), COUNT(*) FROM uploads"
+        )
+        conn.execute(
+            'INSERT INTO usage SELECT client, SUM(COALESCE(stored_size, size, 0)), COUNT(*) FROM uploads '
+            'WHERE client IS NOT NULL GROUP BY client'
+        )
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+def index_upload(index_path, upload_id, filename, meta_data):
+    get_db(index_path).execute(
+        'INSERT OR REPLACE INTO uploads '
+        '(id, filename, expiry_time, remaining_downloads, password_hash, sha256, size, encoding, stored_size, client) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (upload_id, filename,
+         meta_data.get('expiry_time', time.time() + DEFAULT_EXPIRY_SECONDS),
+         meta_data.get('remaining_downloads'),
+         meta_data.get('password_hash'),
+         meta_data.get('sha256'),
+         meta_data.get('size'),
+         meta_data.get('encoding'),
+         meta_data.get('stored_size'),
+         meta_data.get('client'))
+    )
+
+def index_update(index_path, upload_id, filename, meta_data):
+    get_db(index_path).execute(
+        'UPDATE uploads SET expiry_time = ?, remaining_downloads = ? WHERE id = ? AND filename = ?',
+        (meta_data.get('expiry_time', time.time() + DEFAULT_EXPIRY_SECONDS),
+         meta_data.get('remaining_downloads'), upload_id, filename)
+    )
+
+def index_remove(index_path, upload_id):
+    get_db(index_path).execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+
+def index_remove_file(index_path, upload_id, filename):
+    # One entry of a multi-file upload (see app/archives.py)
+    get_db(index_path).execute('DELETE FROM uploads WHERE id = ? AND filename = ?', (upload_id, filename))
+
+def expired_rows(index_path, now, limit, after=None):
+    # (expiry_time, id) of expired files, soonest first. after: the last row of the previous
+    # batch, so a sweep moves past ids it failed to remove instead of getting them again.
+    if after is None:
+        rows = get_db(index_path).execute(
+            'SELECT expiry_time, id FROM uploads WHERE expiry_time < ? ORDER BY expiry_time, id LIMIT ?',
+            (now, limit))
+    else:
+        rows = get_db(index_path).execute(
+            'SELECT expiry_time, id FROM uploads WHERE expiry_time < ? AND expiry_time >= ? '
+            'AND (expiry_time, id) > (?, ?) ORDER BY expiry_time, id LIMIT ?',
+            (now, after[0], after[0], after[1], limit))
+    return rows.fetchall()
+
+def file_expiries(index_path, upload_id):
+    # {filename: expiry_time} of an upload's files
+    return dict(get_db(index_path).execute(
+        'SELECT filename, expiry_time FROM uploads WHERE id = ?', (upload_id,)
+    ))
+
+def usage_of(index_path, client=''):
+    # (bytes, files) accounted to a client, or to the whole store
+    row = get_db(index_path).execute('SELECT bytes, files FROM usage WHERE client = ?', (client,)).fetchone()
+    return tuple(row) if row else (0, 0)
+
+def top_clients(index_path, limit=10):
+    # (number of clients holding uploads, [(client, bytes, files)] of the largest)
+    conn = get_db(index_path)
+    count, = conn.execute("SELECT COUNT(*) FROM usage WHERE client != ''").fetchone()
+    rows = conn.execute(
+        "SELECT client, bytes, files FROM usage WHERE client != '' ORDER BY bytes DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return count, rows
+
+def eviction_candidates(index_path, limit):
+    # Ids of fully stored uploads, soonest to expire first. Uploads with a file still being
+    # written (no size yet: in flight, or an unfinished chunked session) are left alone.
+    rows = get_db(index_path).execute(
+        'SELECT id FROM uploads AS u WHERE size IS NOT NULL AND NOT EXISTS '
+        '(SELECT 1 FROM uploads WHERE id = u.id AND size IS NULL) ORDER BY expiry_time LIMIT ?', (limit,)
+    )
+    return list(dict.fromkeys(row[0] for row in rows))
+
+def upload_digests(index_path, upload_id):
+    # Blob store keys of an upload's files
+    return [blob_key(digest, encoding) for digest, encoding in get_db(index_path).execute(
+        'SELECT sha256, encoding FROM uploads WHERE id = ? AND sha256 IS NOT NULL', (upload_id,)
+    )]
+
+def dedup_stats(index_path):
+    # Logical bytes (what links reference) vs. stored bytes (one copy per blob, after compression)
+    conn = get_db(index_path)
+    links, logical = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads WHERE sha256 IS NOT NULL'
+    ).fetchone()
+    blobs, stored = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM '
+        '(SELECT MAX(COALESCE(stored_size, size)) AS size FROM uploads '
+        'WHERE sha256 IS NOT NULL GROUP BY sha256, encoding)'
+    ).fetchone()
+    return {
+        'links': links,
+        'blobs': blobs,
+        'logical_bytes': logical,
+        'stored_bytes': stored,
+        'bytes_saved': logical - stored,
+        'dedup_ratio': logical / stored if stored else 1.0,
+    }
+
+def store_stats(index_path):
+    # Current store size for /metrics; stored bytes count each blob once, after compression
+    conn = get_db(index_path)
+    uploads, files, logical = conn.execute(
+        'SELECT COUNT(DISTINCT id), COUNT(*), COALESCE(SUM(size), 0) FROM uploads'
+    ).fetchone()
+    blob_bytes, = conn.execute(
+        'SELECT COALESCE(SUM(size), 0) FROM '
+        '(SELECT MAX(COALESCE(stored_size, size)) AS size FROM uploads '
+        'WHERE sha256 IS NOT NULL GROUP BY sha256, encoding)'
+    ).fetchone()
+    other_bytes, = conn.execute(
+        'SELECT COALESCE(SUM(COALESCE(stored_size, size)), 0) FROM uploads WHERE sha256 IS NULL'
+    ).fetchone()
+    return {
+        'uploads': uploads,
+        'files': files,
+        'logical_bytes': logical,
+        'stored_bytes': blob_bytes + other_bytes,
+    }
+
+def _index_dir(conn, upload_folder, upload_id):
+    dir_path = upload_dir(upload_folder, upload_id)
+    names = os.listdir(dir_path)
+    metas = [n for n in names if n.endswith('.meta')]
+    if metas:
+        for meta_name in metas:
+            with open(os.path.join(dir_path, meta_name), 'r') as f:
+                meta = json.load(f)
+            filename = meta_name[:-len('.meta')]
+            conn.execute(
+                'INSERT OR REPLACE INTO uploads '
+                '(id, filename, expiry_time, remaining_downloads, password_hash, sha256, size, encoding, stored_size, client) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (upload_id, filename,
+                 meta.get('expiry_time', os.path.getmtime(dir_path) + DEFAULT_EXPIRY_SECONDS),
+                 meta.get('remaining_downloads'), meta.get('password_hash'),
+                 meta.get('sha256'), meta.get('size'), meta.get('encoding'), meta.get('stored_size'),
+                 meta.get('client'))
+            )
+    else:
+        expiry = os.path.getmtime(dir_path) + DEFAULT_EXPIRY_SECONDS
+        for filename in names or ['']:
+            conn.execute(
+                'INSERT OR REPLACE INTO uploads (id, filename, expiry_time) VALUES (?, ?, ?)',
+                (upload_id, filename, expiry)
+            )
+
+def ensure_index(upload_folder, index_path):
+    # Uploads from before the index (or a lost index file) are invisible to the indexed sweep
+    # and would never expire: an empty index next to existing uploads is reported
+    if get_db(index_path).execute('SELECT 1 FROM uploads LIMIT 1').fetchone():
+        return True
+    if next(iter_upload_ids(upload_folder), None) is not None:
+        logger.warning(f"{upload_folder} has uploads missing from the index at {index_path}; "
+                       f"run `flask rebuild-index` or they will not expire")
+        return False
+    return True
+
+def rebuild_index(upload_folder, index_path):
+    # One-time import of existing .meta files (safe to re-run; rows are replaced)
+    conn = get_db(index_path)
+    count = 0
+    conn.execute('BEGIN')
+    try:
+        for upload_id in iter_upload_ids(upload_folder):
+            try:
+                _index_dir(conn, upload_folder, upload_id)
+                count += 1
+            except Exception as e:
+                logger.error(f"Index rebuild: skipped {upload_id}: {e}")
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    logger.info(f"Index rebuild completed: {count} uploads indexed into {index_path}")
+    return count
@@ -0,0 +1,94 @@
+import os
+import time
+from flask import request, g, Response
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from app.meta_index import store_stats
+
+# Prometheus instrumentation, exposed on /metrics.
+# Under gunicorn PROMETHEUS_MULTIPROC_DIR must be set in the environment (the Dockerfile does,
+# gunicorn.conf.py empties it on start): each worker then keeps its samples in mmap'd files
+# there and /metrics sums all of them, whichever worker answers the scrape.
+# Without it (flask run, bench) the counters are simply per process.
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'cupload_request_duration_seconds', 'Time until the response is returned (body streaming excluded)',
+    ['blueprint', 'endpoint', 'method'], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter('cupload_requests_total', 'Requests by endpoint and status', ['endpoint', 'method', 'status'])
+UPLOAD_BYTES = Counter('cupload_upload_bytes_total', 'Bytes of accepted upload bodies', ['endpoint'])
+SERVED_BYTES = Counter('cupload_served_bytes_total', 'Bytes of file bodies handed out by serve_file', ['mode'])
+FILE_HITS = Counter('cupload_file_hits_total', 'serve_file responses by kind', ['kind'])
+PASSWORD_SECONDS = Histogram(
+    'cupload_password_seconds', 'Password hashing (upload) and verification (download) time',
+    ['op'], buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+SWEEP_SECONDS = Histogram(
+    'cupload_cleanup_sweep_seconds', 'Duration of cleanup sweeps run by the leader',
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60),
+)
+SWEEP_REMOVED = Counter('cupload_cleanup_removed_total', 'Uploads removed by the cleanup job')
+UPLOADS_REFUSED = Counter('cupload_uploads_refused_total', 'Uploads refused by admission control', ['reason'])
+EVICTED = Counter('cupload_evicted_total', 'Uploads evicted before their expiry to free space')
+LOG_DROPPED = Counter('cupload_log_dropped_total', 'Log records not written because output fell behind', ['level', 'reason'])
+
+class StoreCollector:
+    # Store size and usage, read from the metadata index and statvfs at scrape time (no directory walk)
+    def __init__(self, index_path, upload_folder, max_bytes=0):
+        self.index_path = index_path
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+
+    def collect(self):
+        from app.usage import usage_stats
+        stats = store_stats(self.index_path)
+        yield GaugeMetricFamily('cupload_store_uploads', 'Upload directories currently stored', value=stats['uploads'])
+        yield GaugeMetricFamily('cupload_store_files', 'Files currently stored', value=stats['files'])
+        yield GaugeMetricFamily('cupload_store_logical_bytes', 'Size of stored files as uploaded', value=stats['logical_bytes'])
+        yield GaugeMetricFamily('cupload_store_disk_bytes', 'Bytes on disk after dedup and compression', value=stats['stored_bytes'])
+        usage = usage_stats(self.upload_folder, self.index_path, self.max_bytes, top=1)
+        top = usage['top_clients'][0][1] if usage['top_clients'] else 0
+        yield GaugeMetricFamily('cupload_storage_level', 'Fraction of the store capacity in use (admission and eviction watermarks apply to it)', value=usage['level'])
+        yield GaugeMetricFamily('cupload_storage_fs_size_bytes', 'Size of the UPLOAD_FOLDER filesystem (used + available)', value=usage['fs_size'])
+        yield GaugeMetricFamily('cupload_storage_fs_free_bytes', 'Space available on the UPLOAD_FOLDER filesystem', value=usage['fs_free'])
+        yield GaugeMetricFamily('cupload_usage_bytes', 'Upload bytes accounted against STORAGE_MAX_BYTES and client quotas', value=usage['bytes'])
+        yield GaugeMetricFamily('cupload_usage_clients', 'Client addresses holding uploads', value=usage['clients'])
+        yield GaugeMetricFamily('cupload_usage_top_client_bytes', 'Bytes held by the largest client', value=top)
+
+def render_metrics(index_path, upload_folder, max_bytes=0):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    store = CollectorRegistry(auto_describe=False)
+    store.register(StoreCollector(index_path, upload_folder, max_bytes))
+    return generate_latest(registry) + generate_latest(store)
+
+def init_metrics(app, limiter):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(request.blueprint or '', endpoint, request.method).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+        return response
+
+    @limiter.exempt
+    def metrics():
+        metrics_text = render_metrics(app.config['META_INDEX_PATH'], app.config['UPLOAD_FOLDER'],
+                                      app.config.get('STORAGE_MAX_BYTES', 0))
+        return Response(metrics_text, mimetype=CONTENT_TYPE_LATEST)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.cooperative import thread_executor, PerProcess
+from app.metrics import PASSWORD_SECONDS
+
+# Password hashing for protected links. The KDF is deliberately slow, so it runs in a small
+# per-worker thread pool (hashlib releases the GIL, and under gevent the waiting greenlet
+# yields) behind an admission cap: a flood of attempts gets 503s instead of queueing up
+# and starving downloads. A successful verify earns a signed access cookie for the link,
+# so repeat fetches of a multi-download file skip the KDF.
+
+ACCESS_COOKIE = 'link_access'
+
+class PasswordBusy(Exception):
+    pass
+
+def _start_pool(max_workers, max_queued):
+    # The executor and its admission semaphore
+    return thread_executor(max_workers), threading.BoundedSemaphore(max_workers + max_queued)
+
+_pool = PerProcess(_start_pool)
+
+def get_executor(max_workers, max_queued):
+    return _pool.get(max_workers, max_queued)
+
+def _timed(op, fn, *args):
+    with PASSWORD_SECONDS.labels(op).time():
+        return fn(*args)
+
+def _run(config, op, fn, *args):
+    workers = config.get('PASSWORD_HASH_WORKERS', 2)
+    executor, slots = get_executor(workers, config.get('PASSWORD_HASH_QUEUE', 8))
+    if not slots.acquire(blocking=False):
+        raise PasswordBusy()
+    try:
+        return executor.submit(_timed, op, fn, *args).result()
+    finally:
+        slots.release()
+
+def hash_password(password, config):
+    method = config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    return _run(config, 'hash', generate_password_hash, password, method, config.get('PASSWORD_SALT_LENGTH', 16))
+
+def verify_password(password_hash, password, config):
+    # Parameters come from the stored hash, so old links keep working after a config change
+    return _run(config, 'verify', check_password_hash, password_hash, password)
+
+def _serializer(config):
+    return URLSafeTimedSerializer(config['SECRET_KEY'], salt='link-access')
+
+def _fingerprint(password_hash):
+    # Binds the token to this upload: a reused id with a new password gets a new hash
+    return hashlib.sha256(password_hash.encode()).hexdigest()[:16]
+
+def access_token(random_id, filename, password_hash, config):
+    return _serializer(config).dumps([random_id, filename, _fingerprint(password_hash)])
+
+def check_access_token(token, random_id, filename, password_hash, config):
+    if not token:
+        return False
+    try:
+        data = _serializer(config).loads(token, max_age=config.get('PASSWORD_ACCESS_SECONDS', 900))
+    except BadSignature:
+        return False
+    return data == [random_id, filename, _fingerprint(password_hash)]
@@ -0,0 +1,200 @@
+import io
+import os
+import re
+import json
+import fcntl
+import signal
+import resource
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from app.utils import lock_upload, read_meta
+from app.cooperative import PerProcess
+from app.compression import open_decoded
+
+# /pretty formatting runs once per upload, in a small process pool, and the result is
+# cached next to the upload (.<filename>.pretty, or .<filename>.pretty-error if it failed).
+# Pool processes run with an address-space cap and every job with a wall-clock alarm, so a
+# pathological document fails on its own instead of pinning a web worker.
+
+class PrettyError(Exception):
+    pass
+
+def pretty_path(file_path):
+    dir_path, filename = os.path.split(file_path)
+    return os.path.join(dir_path, f".{filename}.pretty")
+
+def error_path(file_path):
+    return pretty_path(file_path) + '-error'
+
+# Streaming JSON re-indenter: tokenises chunk by chunk and never builds the object tree
+_JSON_TOKEN = re.compile(r'\s+|"(?:[^"\\]|\\.)*"|[{}\[\],:]|[^\s{}\[\],:"]+')
+_CLOSERS = {'}': '{', ']': '['}
+
+def stream_json_pretty(fin, fout, indent=4, chunk_size=256 * 1024):
+    stack = []
+    just_opened = False
+    carry = ''
+    while True:
+        chunk = fin.read(chunk_size)
+        data = carry + chunk
+        carry = ''
+        out = []
+        pos = 0
+        while pos < len(data):
+            m = _JSON_TOKEN.match(data, pos)
+            # A string or scalar running into the end of the chunk may continue in the next one
+            if chunk and (m is None or m.end() == len(data)) and not data[pos].isspace():
+                carry = data[pos:]
+                break
+            if m is None:
+                raise ValueError(f"Invalid JSON near: {data[pos:pos + 20]!r}")
+            token = m.group()
+            pos = m.end()
+            if token[0].isspace():
+                continue
+            if just_opened:
+                just_opened = False
+                if token in _CLOSERS:
+                    if stack.pop() != _CLOSERS[token]:
+                        raise ValueError(f"Mismatched {token!r}")
+                    out.append(token)
+                    continue
+                out.append('\n' + ' ' * (indent * len(stack)))
+            if token in '{[':
+                out.append(token)
+                stack.append(token)
+                just_opened = True
+            elif token in _CLOSERS:
+                if not stack or stack.pop() != _CLOSERS[token]:
+                    raise ValueError(f"Mismatched {token!r}")
+                out.append('\n' + ' ' * (indent * len(stack)) + token)
+            elif token == ',':
+                out.append(',\n' + ' ' * (indent * len(stack)))
+            elif token == ':':
+                out.append(': ')
+            else:
+                out.append(token)
+        fout.write(''.join(out))
+        if not chunk:
+            break
+    if stack or carry:
+        raise ValueError("Unexpected end of JSON document")
+
+def format_file(file_path, out, stream_json_bytes):
+    ext = os.path.splitext(file_path)[1].lower()
+    meta = read_meta(file_path + '.meta')
+    size = meta.get('size') or os.path.getsize(file_path)
+    # Read through the storage layer: the body may be stored compressed
+    with io.TextIOWrapper(open_decoded(file_path, meta.get('encoding')), encoding='utf-8') as fin:
+        if ext == '.json' and size > stream_json_bytes:
+            stream_json_pretty(fin, out)
+            return
+        raw_content = fin.read()
+    if ext == '.json':
+        parsed = json.loads(raw_content)
+        out.write(json.dumps(parsed, indent=4))
+    elif ext in ['.yaml', '.yml']:
+        import yaml  # parsers load in the formatter processes that need them
+        parsed = yaml.safe_load(raw_content)
+        out.write(yaml.dump(parsed, sort_keys=False, indent=4))
+    elif ext == '.xml':
+        import xml.dom.minidom
+        dom = xml.dom.minidom.parseString(raw_content)
+        out.write('\n'.join([line for line in dom.toprettyxml().split('\n') if line.strip()]))
+    else:
+        raise PrettyError("Unsupported file format")
+
+def _on_alarm(signum, frame):
+    raise TimeoutError("formatting took too long")
+
+def _init_worker(max_memory_bytes):
+    if max_memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+    signal.signal(signal.SIGALRM, _on_alarm)
+
+@contextmanager
+def _render_lock(file_path):
+    # Held for the whole render, so it is a file of its own: the upload directory lock
+    # (downloads, cleanup) is only taken to check for and publish the result
+    fd = os.open(pretty_path(file_path) + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def _rendered(file_path):
+    return os.path.exists(pretty_path(file_path)) or os.path.exists(error_path(file_path))
+
+def render_pretty(file_path, timeout, stream_json_bytes):
+    # Runs in a pool process. The render lock makes concurrent requests for the same file
+    # wait for one render instead of each doing their own.
+    dir_path = os.path.dirname(file_path)
+    try:
+        with _render_lock(file_path):
+            with lock_upload(dir_path):
+                if _rendered(file_path):
+                    return
+            fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.pretty-')
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            error = None
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as out:
+                    format_file(file_path, out, stream_json_bytes)
+            except BaseException as e:
+                error = 'document too large to format' if isinstance(e, MemoryError) else str(e)
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            with lock_upload(dir_path):
+                if error is None:
+                    os.replace(tmp_path, pretty_path(file_path))
+                    return
+                os.unlink(tmp_path)
+                with open(error_path(file_path), 'w') as f:
+                    f.write(error)
+    except FileNotFoundError:
+        pass  # the upload was removed meanwhile
+
+def _start_pool(max_workers, max_memory_bytes):
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('forkserver'),
+        initializer=_init_worker,
+        initargs=(max_memory_bytes,),
+    )
+
+_pool = PerProcess(_start_pool)
+
+def get_executor(max_workers, max_memory_bytes):
+    return _pool.get(max_workers, max_memory_bytes)
+
+def submit_pretty(file_path, config):
+    executor = get_executor(config.get('PRETTY_WORKERS', 2), config.get('PRETTY_MAX_MEMORY_MB', 512) * 1024 * 1024)
+    args = (file_path, config.get('PRETTY_TIMEOUT_SECONDS', 10), config.get('PRETTY_STREAM_JSON_BYTES', 1024 * 1024))
+    try:
+        return executor.submit(render_pretty, *args)
+    except BrokenProcessPool:
+        # A pool process died (e.g. killed by the OOM killer); start a fresh pool
+        _pool.reset()
+        return submit_pretty(file_path, config)
+
+def get_pretty(file_path, config):
+    # Returns the formatted text, rendering it in the pool on first use
+    out_path = pretty_path(file_path)
+    if not os.path.exists(out_path) and not os.path.exists(error_path(file_path)):
+        future = submit_pretty(file_path, config)
+        try:
+            future.result(timeout=config.get('PRETTY_TIMEOUT_SECONDS', 10) + 5)
+        except FutureTimeout:
+            raise PrettyError("formatting timed out")
+        except BrokenProcessPool:
+            _pool.reset()
+            raise PrettyError("formatter crashed")
+    if os.path.exists(out_path):
+        with open(out_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    with open(error_path(file_path), 'r') as f:
+        raise PrettyError(f.read())
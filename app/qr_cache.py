@@ -0,0 +1,69 @@
+import io
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Rendered QR PNGs, keyed by the upload's file path. The PNG for a given URL never
+# changes, so it is rendered once and then served from a bounded in-process LRU, with an
+# optional copy on disk next to the upload (removed together with the upload directory).
+
+_cache = OrderedDict()  # file_path -> png bytes
+_lock = threading.Lock()
+
+def qr_etag(url):
+    # Derived from the URL alone, so If-None-Match can be answered without rendering
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+def render_qr_png(url):
+    import qrcode  # pulls in PIL; loaded by the first QR request rather than at boot
+    img = qrcode.make(url)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+def disk_cache_path(file_path):
+    dir_path, filename = os.path.split(file_path)
+    return os.path.join(dir_path, f".{filename}.qr.png")
+
+def get_qr_png(file_path, url, max_entries=256, disk_cache=True):
+    with _lock:
+        entry = _cache.get(file_path)
+        if entry is not None:
+            _cache.move_to_end(file_path)
+            return entry
+
+    png = None
+    disk_path = disk_cache_path(file_path)
+    if disk_cache and os.path.exists(disk_path):
+        with open(disk_path, 'rb') as f:
+            png = f.read()
+    if png is None:
+        png = render_qr_png(url)
+        if disk_cache:
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix='.qr-')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(png)
+                os.replace(tmp_path, disk_path)
+            except OSError:
+                pass  # upload removed meanwhile; the in-process copy is still fine
+
+    with _lock:
+        _cache[file_path] = png
+        _cache.move_to_end(file_path)
+        while len(_cache) > max_entries:
+            _cache.popitem(last=False)
+    return png
+
+def evict_qr(file_path):
+    with _lock:
+        _cache.pop(file_path, None)
+
+def evict_upload(dir_path):
+    # Drop every cached QR under an upload directory that is being removed
+    prefix = dir_path.rstrip(os.sep) + os.sep
+    with _lock:
+        for key in [k for k in _cache if k.startswith(prefix)]:
+            del _cache[key]
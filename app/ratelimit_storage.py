@@ -0,0 +1,130 @@
+import time
+import sqlite3
+from math import floor
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport, TimestampedSlidingWindow
+from app.cooperative import sqlite_connection
+
+# Rate-limit counters shared by every gunicorn worker on the host, without an external
+# service: one SQLite file (WAL, no fsync) that all processes update with single-statement
+# upserts. Registered with `limits` under the sqlite:// scheme, e.g.
+#   RATELIMIT_STORAGE_URI = "sqlite:////uploads/.ratelimit.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL,
+    expiry REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Drop expired keys every N increments instead of on a timer thread
+PURGE_EVERY = 1000
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        # sqlite:////abs/path -> /abs/path, sqlite:///rel/path -> rel/path
+        self.path = uri[len("sqlite:///"):] if uri else ".ratelimit.sqlite3"
+        self._incr_count = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    @property
+    def _conn(self):
+        return sqlite_connection(self.path, ('journal_mode=WAL', 'synchronous=OFF'),
+                                 lambda conn: conn.executescript(SCHEMA))
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        self._incr_count += 1
+        if self._incr_count % PURGE_EVERY == 0:
+            self._conn.execute('DELETE FROM counters WHERE expiry <= ?', (now,))
+        # A key whose window has passed restarts at `amount` with a fresh expiry
+        row = self._conn.execute(
+            'INSERT INTO counters (key, value, expiry) VALUES (?1, ?2, ?3 + ?4) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            'value = CASE WHEN expiry <= ?3 THEN ?2 ELSE value + ?2 END, '
+            'expiry = CASE WHEN expiry <= ?3 THEN ?3 + ?4 ELSE expiry END '
+            'RETURNING value',
+            (key, amount, now, expiry)
+        ).fetchone()
+        return row[0]
+
+    def decr(self, key, amount=1):
+        row = self._conn.execute(
+            'UPDATE counters SET value = MAX(value - ?, 0) WHERE key = ? AND expiry > ? RETURNING value',
+            (amount, key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, key):
+        row = self._conn.execute(
+            'SELECT value FROM counters WHERE key = ? AND expiry > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._conn.execute(
+            'SELECT expiry FROM counters WHERE key = ? AND expiry > ?', (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def clear(self, key):
+        self._conn.execute('DELETE FROM counters WHERE key = ?', (key,))
+
+    def check(self):
+        try:
+            self._conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._conn.execute('DELETE FROM counters').rowcount
+
+    # Sliding window counter: same weighted two-window scheme as limits' MemoryStorage
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count, previous_ttl, current_count, _ = self._get_sliding_window_info(
+            previous_key, current_key, expiry, now
+        )
+        weighted_count = previous_count * previous_ttl / expiry + current_count
+        if floor(weighted_count) + amount > limit:
+            return False
+        current_count = self.incr(current_key, 2 * expiry, amount=amount)
+        weighted_count = previous_count * previous_ttl / expiry + current_count
+        if floor(weighted_count) > limit:
+            # Another worker won the race for the last slot
+            self.decr(current_key, amount)
+            return False
+        return True
+
+    def _get_sliding_window_info(self, previous_key, current_key, expiry, now):
+        previous_count = self.get(previous_key)
+        current_count = self.get(current_key)
+        if previous_count == 0:
+            previous_ttl = 0.0
+        else:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        return self._get_sliding_window_info(previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
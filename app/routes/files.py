@@ -1,33 +1,114 @@
-from flask import Blueprint, request, abort, render_template, make_response, current_app
+from flask import Blueprint, request, abort, render_template, make_response, current_app, url_for, jsonify, after_this_request
+from werkzeug.exceptions import HTTPException
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.wsgi import wrap_file, FileWrapper
+from werkzeug.http import is_resource_modified
+from urllib.parse import quote
+from datetime import datetime, timezone
 import os
 import uuid
-import json
 import shutil
 import time
-from werkzeug.security import generate_password_hash, check_password_hash
+import tarfile
+import posixpath
 from app.extensions import limiter
-from app.utils import parse_ttl, update_meta_cleanup
+from app.utils import parse_ttl, update_meta_cleanup, reserve_download, in_download_session, session_key, write_meta, save_stream, remove_upload, remove_entry, UploadTooLarge, InsufficientStorage, ClosingFile, RangeFile, ChunkReader, lock_upload, looks_binary, read_text_page, read_meta, body_stored
+from app.meta_index import index_upload
+from app.blobs import link_blob, blob_key
+from app.compression import choose_encoding
+from app.storage import upload_dir, get_storage, StorageError
+from app.archives import entry_path, entry_filename, iter_tar_entries, iter_form_files, stream_zip, stream_tar
+from app.metrics import UPLOAD_BYTES, SERVED_BYTES, FILE_HITS
+from app.usage import admit_upload, client_headroom, client_key, quota_exceeded, insufficient_storage
+from app.passwords import hash_password, verify_password, access_token, check_access_token, PasswordBusy, ACCESS_COOKIE
 
 files_bp = Blueprint('files', __name__)
 
+@files_bp.errorhandler(PasswordBusy)
+def password_busy(e):
+    # Uploads with X-Password while the hashing pool is saturated (see app/passwords.py)
+    current_app.logger.warning(f"Password hashing queue full, rejected {request.path} from {request.remote_addr}")
+    return "Server busy, try again.\n", 503, {'Retry-After': '1'}
+
+@files_bp.app_errorhandler(InsufficientStorage)
+def storage_full(e):
+    # The disk filled up under an upload that passed admission (see app/usage.py)
+    return insufficient_storage()
+
+def _chunk_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='viewer-chunk')
+
 @files_bp.route('/<filename>', methods=['PUT'])
 @limiter.limit("10 per minute")
 def upload_file(filename):
     max_size = current_app.config['MAX_CONTENT_LENGTH']
     upload_folder = current_app.config['UPLOAD_FOLDER']
 
+    # tar c dir | curl -T - -H "X-Extract: tar" https://qurl.sh/dir (may be chunked, no Content-Length)
+    extract = request.headers.get('X-Extract')
+    if extract:
+        if extract.lower() != 'tar':
+            return "Unsupported X-Extract (only tar is supported).\n", 400
+        return _upload_archive(filename)
+
     content_length = request.content_length
     if content_length is None:
         return "Missing Content-Length header.\n", 411  # Length Required
     if content_length > max_size:
         return "File too large. Max allowed size is 50MB.\n", 413  # Payload Too Large
+    refused = admit_upload(content_length)
+    if refused:
+        return refused
 
     random_id = str(uuid.uuid4())[:8]
-    dir_path = os.path.join(upload_folder, random_id)
+    meta_data = _link_meta(random_id, filename)
+    dir_path = upload_dir(upload_folder, random_id)
     os.makedirs(dir_path, exist_ok=True)
     file_path = os.path.join(dir_path, filename)
 
-    # Check for password header
+    ttl_str = request.headers.get('X-TTL')
+    remaining_downloads = meta_data['remaining_downloads']
+
+    # Meta goes in first so cleanup_old_files honours the TTL of an in-flight upload;
+    # the file itself only appears under its real name once fully written.
+    meta_path = file_path + '.meta'
+    write_meta(meta_path, meta_data)
+    index_path = current_app.config['META_INDEX_PATH']
+    index_upload(index_path, random_id, filename, meta_data)
+
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    encoding = choose_encoding(current_app.config, filename, content_length)
+    try:
+        tmp_path, size, checksum = save_stream(request.stream, dir_path, max_size, chunk_size,
+                                               encoding, current_app.config.get('COMPRESSION_LEVEL'))
+    except UploadTooLarge:
+        remove_upload(upload_folder, random_id, index_path)
+        return "File too large. Max allowed size is 50MB.\n", 413
+    except Exception:
+        remove_upload(upload_folder, random_id, index_path)
+        raise
+
+    if size != content_length:
+        remove_upload(upload_folder, random_id, index_path)
+        current_app.logger.warning(f"Incomplete upload: {random_id}/{filename} ({size}/{content_length} bytes) from {request.remote_addr}")
+        return "Upload incomplete.\n", 400
+
+    try:
+        details = _publish_upload(random_id, filename, tmp_path, size, checksum, encoding, meta_data)
+    except StorageError as e:
+        remove_upload(upload_folder, random_id, index_path)
+        current_app.logger.error(f"Storing {random_id}/{filename} failed: {e}")
+        return "Storage unavailable, try again later.\n", 503
+    except Exception:
+        remove_upload(upload_folder, random_id, index_path)
+        raise
+
+    current_app.logger.info(f"File uploaded: {random_id}/{filename} (Size: {size} bytes{details}, SHA256: {checksum}, TTL: {ttl_str}, Limit: {remaining_downloads}) from {request.remote_addr}")
+        
+    return _upload_message(random_id, filename)
+
+def _link_meta(random_id, filename):
+    # TTL, download limit and password of a new link, from the upload's request headers
     password = request.headers.get('X-Password')
     
     # Check for TTL and Downloads
@@ -48,52 +129,341 @@ def upload_file(filename):
 
     meta_data = {
         'expiry_time': expiry_time,
-        'remaining_downloads': remaining_downloads
+        'remaining_downloads': remaining_downloads,
+        'client': client_key(request.remote_addr),  # usage accounting (see app/usage.py)
     }
 
     if password:
-        meta_data['password_hash'] = generate_password_hash(password)
+        meta_data['password_hash'] = hash_password(password, current_app.config)
+    return meta_data
 
-    meta_path = file_path + '.meta'
-    with open(meta_path, 'w') as f:
-        f.write(json.dumps(meta_data))
+def _publish_upload(random_id, filename, tmp_path, size, checksum, encoding, meta_data):
+    # Publish a fully written body as <id>/<filename> in the default backend. Returns extra log details.
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    index_path = current_app.config['META_INDEX_PATH']
+    file_path = os.path.join(upload_dir(upload_folder, random_id), filename)
+    backend = get_storage(upload_folder).default
 
-    with open(file_path, 'wb') as f:
-        f.write(request.data)
-        
-    current_app.logger.info(f"File uploaded: {random_id}/{filename} (Size: {content_length} bytes, TTL: {ttl_str}, Limit: {remaining_downloads}) from {request.remote_addr}")
-        
+    meta_data['sha256'] = checksum
+    meta_data['size'] = size
+    meta_data['uploaded_at'] = int(time.time())  # Last-Modified of downloads
+    details = ''
+    if encoding:
+        meta_data['encoding'] = encoding
+        meta_data['stored_size'] = os.path.getsize(tmp_path)
+        details = f", stored {meta_data['stored_size']} bytes {encoding}"
+
+    if backend.remote:
+        # The object goes up first; the .meta naming its backend is what publishes the link
+        backend.put(random_id, filename, tmp_path)
+        meta_data['backend'] = backend.name
+        write_meta(file_path + '.meta', meta_data)
+        index_upload(index_path, random_id, filename, meta_data)
+        UPLOAD_BYTES.labels(request.endpoint).inc(size)
+        return details + f", in {backend.name}"
+
+    # Record the digest before the link becomes visible, so whoever deletes it can release the blob
+    write_meta(file_path + '.meta', meta_data)
+    index_upload(index_path, random_id, filename, meta_data)
+
+    if current_app.config.get('DEDUP_UPLOADS'):
+        if link_blob(upload_folder, tmp_path, blob_key(checksum, encoding)):
+            details += ', deduplicated'
+    backend.put(random_id, filename, tmp_path)
+    UPLOAD_BYTES.labels(request.endpoint).inc(size)
+    return details
+
+def _grant_access(random_id, filename, password_hash, path=None):
+    # Scoped to the link, so the viewer's ?raw=true media and further downloads pass too
+    token = access_token(random_id, filename, password_hash, current_app.config)
+
+    @after_this_request
+    def set_access_cookie(response):
+        response.set_cookie(ACCESS_COOKIE, token, max_age=current_app.config.get('PASSWORD_ACCESS_SECONDS', 900),
+                            path=path or f"{request.script_root}/{random_id}/", secure=request.is_secure,
+                            httponly=True, samesite='Lax')
+        return response
+
+def _password_gate(random_id, filename, password_hash, path=None):
+    # None if the request may proceed (access cookie, or a correct password POSTed),
+    # else the password page to return. path: where the access cookie applies.
+    if check_access_token(request.cookies.get(ACCESS_COOKIE), random_id, filename, password_hash, current_app.config):
+        return None
+    if request.method != 'POST':
+        return render_template('password.html')
+    password_input = request.form.get('password')
+    valid = False
+    if password_input:
+        try:
+            valid = verify_password(password_hash, password_input, current_app.config)
+        except PasswordBusy:
+            current_app.logger.warning(f"Password check queue full, rejected {random_id}/{filename} from {request.remote_addr}")
+            return render_template('password.html', error="Server busy, try again"), 503, {'Retry-After': '1'}
+    if not valid:
+        current_app.logger.warning(f"Failed password attempt for {random_id}/{filename} from {request.remote_addr}")
+        return render_template('password.html', error="Invalid Password"), 401
+    _grant_access(random_id, filename, password_hash, path)
+    return None
+
+@files_bp.route('/', methods=['POST'])
+@limiter.limit("10 per minute")
+def upload_files():
+    # Several files in one link: curl -F file=@a.txt -F file=@b.png https://qurl.sh
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return "Expected a multipart/form-data upload (curl -F file=@name https://qurl.sh).\n", 400
+    max_size = current_app.config.get('ARCHIVE_MAX_SIZE', 2 * 1024 * 1024 * 1024)
+    if (request.content_length or 0) > max_size:
+        return f"Upload too large. Max allowed size is {max_size // (1024 * 1024)}MB.\n", 413
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    return _store_entries('files', iter_form_files(request.stream, boundary.encode(), chunk_size))
+
+def _upload_archive(label):
+    max_size = current_app.config.get('ARCHIVE_MAX_SIZE', 2 * 1024 * 1024 * 1024)
+    if (request.content_length or 0) > max_size:
+        return f"Upload too large. Max allowed size is {max_size // (1024 * 1024)}MB.\n", 413
+    return _store_entries(label, iter_tar_entries(request.stream))
+
+def _store_entries(label, entries):
+    # Store each (name, reader, size) of a multi-file upload as its own link under one new id
+    # (see app/archives.py). Entries are read one after the other straight off the request.
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    index_path = current_app.config['META_INDEX_PATH']
+    max_size = current_app.config.get('ARCHIVE_MAX_SIZE', 2 * 1024 * 1024 * 1024)
+    max_entries = current_app.config.get('ARCHIVE_MAX_ENTRIES', 1000)
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    refused = admit_upload(request.content_length or 0)
+    if refused:
+        return refused
+    # The total may not be known up front: the client's quota also caps what is read
+    headroom = client_headroom()
+    budget = max_size if headroom is None else min(max_size, headroom)
+
+    random_id = str(uuid.uuid4())[:8]
+    # One set of link settings (and one password hash) for every entry
+    template = _link_meta(random_id, label)
+    dir_path = upload_dir(upload_folder, random_id)
+    os.makedirs(dir_path, exist_ok=True)
+
+    stored = []
+    taken, paths = set(), set()
+    total = count = 0
+    try:
+        for name, reader, size in entries:
+            count += 1
+            if count > max_entries:
+                remove_upload(upload_folder, random_id, index_path)
+                return f"Too many files. Max {max_entries} per upload.\n", 413
+            if reader is None:
+                continue  # not a regular file
+            path = entry_path(name)
+            if path is None:
+                current_app.logger.warning(f"Skipped unsafe entry {name!r} in {random_id} from {request.remote_addr}")
+                continue
+            filename = entry_filename(path, taken)
+            if path in paths:
+                path = posixpath.join(posixpath.dirname(path), filename)
+            paths.add(path)
+
+            # Recreated if the upload's earlier entries were all downloaded (and removed) meanwhile
+            os.makedirs(dir_path, exist_ok=True)
+            meta_data = dict(template, path=path)
+            write_meta(os.path.join(dir_path, filename + '.meta'), meta_data)
+            index_upload(index_path, random_id, filename, meta_data)
+
+            encoding = choose_encoding(current_app.config, filename, size)
+            tmp_path, size, checksum = save_stream(reader, dir_path, budget - total, chunk_size,
+                                                   encoding, current_app.config.get('COMPRESSION_LEVEL'))
+            total += size
+            _publish_upload(random_id, filename, tmp_path, size, checksum, encoding, meta_data)
+            stored.append(filename)
+    except UploadTooLarge:
+        remove_upload(upload_folder, random_id, index_path)
+        if budget < max_size:
+            return quota_exceeded()
+        return f"Upload too large. Max allowed size is {max_size // (1024 * 1024)}MB.\n", 413
+    except (tarfile.TarError, EOFError, ValueError) as e:
+        remove_upload(upload_folder, random_id, index_path)
+        current_app.logger.warning(f"Rejected multi-file upload {random_id} from {request.remote_addr}: {e}")
+        return "Invalid or truncated upload.\n", 400
+    except StorageError as e:
+        remove_upload(upload_folder, random_id, index_path)
+        current_app.logger.error(f"Storing {random_id} failed: {e}")
+        return "Storage unavailable, try again later.\n", 503
+    except Exception:
+        remove_upload(upload_folder, random_id, index_path)
+        raise
+
+    if not stored:
+        remove_upload(upload_folder, random_id, index_path)
+        return "No files in upload.\n", 400
+
+    current_app.logger.info(f"Files uploaded: {random_id} ({len(stored)} files, {total} bytes, TTL: {request.headers.get('X-TTL')}, Limit: {template['remaining_downloads']}) from {request.remote_addr}")
+
+    return _entries_message(random_id, stored, total)
+
+def _entries_message(random_id, filenames, total, listed=20):
+    lines = [f"Uploaded {len(filenames)} files ({total} bytes):"]
+    lines += [f"https://qurl.sh/{random_id}/{filename}" for filename in filenames[:listed]]
+    if len(filenames) > listed:
+        lines.append(f"... and {len(filenames) - listed} more")
+    lines.append(f"Download all: https://qurl.sh/{random_id}.zip (or .tar)")
+    lines.append(f"Try wget http://qurl.sh/{random_id}.tar -O - | tar x")
+    return '\n'.join(lines) + '\n'
+
+def _upload_message(random_id, filename):
     return f"You can download your file at https://qurl.sh/{random_id}/{filename}\nQR Code: https://qurl.sh/qr/{random_id}/{filename}\nTry wget http://qurl.sh/{random_id}/{filename}\n"
 
+MEDIA_TYPES = {
+    '.pdf': 'application/pdf', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+    '.gif': 'image/gif', '.svg': 'image/svg+xml', '.webp': 'image/webp',
+}
+
+# Random token of a range download session (see reserve_download), scoped to the link
+SESSION_COOKIE = 'download_session'
+
+def _download_session(meta):
+    # Clients send the cookies of every link they hold a session for under the same name
+    sessions = meta.get('range_sessions', {})
+    for token in request.cookies.getlist(SESSION_COOKIE):
+        if session_key(token) in sessions:
+            return session_key(token)
+    return None
+
+def _set_session_cookie(response, token, random_id, filename):
+    response.set_cookie(SESSION_COOKIE, token, max_age=current_app.config.get('RANGE_SESSION_SECONDS', 300),
+                        path=f"{request.script_root}/{quote(random_id)}/{quote(filename)}", secure=request.is_secure,
+                        httponly=True, samesite='Lax')
+
+def _validators(meta_data, file_path, backend):
+    # (ETag, Last-Modified) of the original body. Uploads from before uploaded_at was
+    # recorded fall back to the file's mtime.
+    uploaded_at = meta_data.get('uploaded_at')
+    if uploaded_at is None and not backend.remote:
+        try:
+            uploaded_at = os.path.getmtime(file_path)
+        except FileNotFoundError:
+            pass
+    last_modified = datetime.fromtimestamp(int(uploaded_at), timezone.utc) if uploaded_at is not None else None
+    return meta_data.get('sha256'), last_modified
+
+def _requested_ranges(etag, last_modified, size):
+    # Byte ranges [(start, stop)] asked for by a GET, sorted and merged. None: send the whole
+    # body (no or unparsable Range, too many parts, If-Range no longer matching); []: no
+    # range is satisfiable.
+    byte_range = request.range
+    if request.method != 'GET' or byte_range is None or byte_range.units != 'bytes' or size is None:
+        return None
+    if len(byte_range.ranges) > current_app.config.get('RANGE_MAX_PARTS', 16):
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and if_range.date != last_modified:
+        return None
+
+    ranges = []
+    for start, stop in byte_range.ranges:
+        if start < 0:  # suffix: the last -start bytes
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+def _byteranges(storage, random_id, filename, meta_data, first, ranges, size, content_type):
+    # multipart/byteranges body: (boundary, length, chunks). first is the body opened at the
+    # first range; each further part is opened at its own offset.
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    boundary = uuid.uuid4().hex
+    heads = [f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n".encode()
+             for start, stop in ranges]
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    length = sum(len(head) + stop - start for head, (start, stop) in zip(heads, ranges)) + 2 * (len(ranges) - 1) + len(tail)
+
+    def chunks():
+        f = first
+        try:
+            for i, (head, (start, stop)) in enumerate(zip(heads, ranges)):
+                if i:
+                    f.close()
+                    f = storage.open_body(random_id, filename, meta_data, offset=start)
+                    yield b'\r\n'
+                yield head
+                left = stop - start
+                while left:
+                    data = f.read(min(chunk_size, left))
+                    if not data:
+                        raise OSError(f"{random_id}/{filename} ended before byte {stop}")
+                    left -= len(data)
+                    yield data
+            yield tail
+        finally:
+            f.close()
+
+    return boundary, length, chunks()
+
+def _file_headers(response, filename, ext, is_raw, etag, last_modified):
+    # Headers shared by every raw response of a file (200, 206, 304, HEAD)
+    # Only force download for generic files, not media we want to view raw
+    if is_raw and ext not in MEDIA_TYPES:
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    elif not is_raw:
+        # Standard curl/wget behavior
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # One-time content: never kept by browsers or proxies. A client that still has the body
+    # from before can revalidate with its ETag (a 304 uses no download).
+    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+    response.headers['Pragma'] = 'no-cache'
+
 @files_bp.route('/<random_id>/<filename>', methods=['GET', 'POST'])
 def serve_file(random_id, filename):
     upload_folder = current_app.config['UPLOAD_FOLDER']
-    dir_path = os.path.join(upload_folder, random_id)
+    dir_path = upload_dir(upload_folder, random_id)
     file_path = os.path.join(dir_path, filename)
     meta_path = file_path + '.meta'
+    index_path = current_app.config['META_INDEX_PATH']
+    storage = get_storage(upload_folder)
 
-    if os.path.exists(file_path):
-        # Start matching Metadata Logic
-        meta_data = {}
-        if os.path.exists(meta_path):
-            with open(meta_path, 'r') as f:
-                meta_data = json.load(f)
+    # Start matching Metadata Logic
+    meta_data = read_meta(meta_path)
+    if body_stored(file_path, meta_data):
 
         # Check Expiry
         if 'expiry_time' in meta_data and time.time() > meta_data['expiry_time']:
-            shutil.rmtree(dir_path, ignore_errors=True)
+            remove_entry(upload_folder, random_id, filename, index_path)
             current_app.logger.info(f"File Expired (during access): {random_id}/{filename}")
             abort(404)
 
-        # Check Password Protection
-        if 'password_hash' in meta_data:
-            if request.method == 'POST':
-                password_input = request.form.get('password')
-                if not password_input or not check_password_hash(meta_data['password_hash'], password_input):
-                    current_app.logger.warning(f"Failed password attempt for {random_id}/{filename} from {request.remote_addr}")
-                    return render_template('password.html', error="Invalid Password"), 401
-            else:
-                return render_template('password.html')
+        # Budget already spent (last transfer in flight or awaiting deferred deletion), unless
+        # this is a range request continuing the download this client started
+        session = _download_session(meta_data)
+        if meta_data.get('remaining_downloads', 1) <= 0 and not (request.range and in_download_session(meta_data, session)):
+            abort(404)
+
+        # Storage encoding of the body (None: stored as uploaded) and where it is kept
+        encoding = meta_data.get('encoding')
+        backend = storage.backend(meta_data)
+
+        # Check Password Protection (a valid access cookie from an earlier unlock skips the hash)
+        password_hash = meta_data.get('password_hash')
+        if password_hash:
+            denied = _password_gate(random_id, filename, password_hash)
+            if denied:
+                return denied
 
         try:
             # Code/Media Viewer Logic
@@ -114,7 +484,7 @@ def serve_file(random_id, filename):
             
             supported_exts = code_exts + image_exts + pdf_exts
             
-            if not is_cli and not is_raw and ext in supported_exts:
+            if not is_cli and not is_raw and ext in supported_exts and request.method != 'HEAD':
                 # Use raw=true in template for media src
                 
                 # Determine Type
@@ -128,10 +498,20 @@ def serve_file(random_id, filename):
                 file_content = ""
                 lang = "none"
                 
+                next_offset = None
+                chunk_url = None
                 if file_type == 'code':
+                    # Only the first page is rendered; the page fetches the rest from view_chunk
                     try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            file_content = f.read()
+                        body = storage.open_body(random_id, filename, meta_data)
+                    except FileNotFoundError:
+                        abort(404)
+                    with body:
+                        binary = looks_binary(body)
+                    if not binary:
+                        page_bytes = current_app.config.get('VIEWER_PAGE_BYTES', 256 * 1024)
+                        with storage.open_body(random_id, filename, meta_data) as body:
+                            file_content, next_offset = read_text_page(body, 0, page_bytes)
                         
                         lang_map = {
                             '.py': 'python', '.js': 'javascript', '.sh': 'bash', 
@@ -141,64 +521,475 @@ def serve_file(random_id, filename):
                             '.java': 'java', '.c': 'c', '.cpp': 'cpp'
                         }
                         lang = lang_map.get(ext, 'none')
-                    except UnicodeDecodeError:
-                        # Fallback if binary detected in text ext
-                        pass
                 
                 # Trigger cleanup (count as view) mechanism logic:
                 if file_type == 'code':
-                    update_meta_cleanup(file_path, dir_path, meta_path)
+                    if reserve_download(file_path, dir_path, meta_path, index_path) is None:
+                        abort(404)
+                    # More pages to come: keep the file around for the viewing session
+                    grace = 0
+                    if next_offset is not None:
+                        grace = current_app.config.get('VIEWER_SESSION_SECONDS', 900)
+                        token = _chunk_serializer().dumps(f"{random_id}/{filename}")
+                        chunk_url = url_for('files.view_chunk', random_id=random_id, filename=filename, token=token)
+                    update_meta_cleanup(file_path, dir_path, meta_path, grace=grace, index_path=index_path)
                     
+                FILE_HITS.labels('viewer').inc()
                 current_app.logger.info(f"Viewer accessed: {random_id}/{filename} ({file_type}) by {request.remote_addr}")
 
                 return render_template('viewer.html', 
                                      filename=filename, 
                                      content=file_content, 
                                      language=lang,
-                                     file_type=file_type)
+                                     file_type=file_type,
+                                     next_offset=next_offset,
+                                     chunk_url=chunk_url)
 
             # Default File Serving (or ?raw=true)
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
+            # Compressed uploads go out as stored when the client accepts that encoding,
+            # otherwise they are decompressed on the fly. They are always sent from here:
+            # nginx would serve the internal location without our Content-Encoding.
+            # Remote bodies are always streamed through here too.
+            # Byte ranges always refer to the original bytes (the identity encoding).
+            content_type = MEDIA_TYPES.get(ext, 'application/octet-stream')
+            size = meta_data.get('size')
+            if size is None and not backend.remote and not encoding:
+                size = os.path.getsize(file_path)
+            etag, last_modified = _validators(meta_data, file_path, backend)
+            ranges = _requested_ranges(etag, last_modified, size)
+            send_encoded = bool(encoding) and ranges is None and request.accept_encodings.quality(encoding) > 0
+            if etag and send_encoded:
+                etag = f"{etag}-{encoding}"  # each representation has its own tag
+            accel = current_app.config.get('DOWNLOAD_MODE') == 'accel' and not encoding and not backend.remote
 
-            response = make_response(file_data)
-            
-            # Set correct MIME for media
-            if ext == '.pdf':
-                response.headers['Content-Type'] = 'application/pdf'
-            elif ext in ['.jpg', '.jpeg']:
-                response.headers['Content-Type'] = 'image/jpeg'
-            elif ext == '.png':
-                response.headers['Content-Type'] = 'image/png'
-            elif ext == '.gif':
-                response.headers['Content-Type'] = 'image/gif'
-            elif ext == '.svg':
-                response.headers['Content-Type'] = 'image/svg+xml'
-            elif ext == '.webp':
-                response.headers['Content-Type'] = 'image/webp'
-            else:
-                response.headers['Content-Type'] = 'application/octet-stream'
-                
-            # Only force download for generic files, not media we want to view raw
-            if is_raw and ext not in image_exts and ext not in pdf_exts:
-                 response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-            elif not is_raw:
-                 # Standard curl/wget behavior
-                 response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+            if request.method == 'HEAD' or (request.method == 'GET' and not is_resource_modified(request.environ, etag, last_modified=last_modified)):
+                # Headers only, or the client already has this body: no download is used
+                status = 200 if request.method == 'HEAD' else 304
+                response = make_response('', status)
+                _file_headers(response, filename, ext, is_raw, etag, last_modified)
+                if status == 200:
+                    response.headers['Content-Type'] = content_type
+                    response.content_length = meta_data.get('stored_size') if send_encoded else size
+                    if send_encoded:
+                        response.headers['Content-Encoding'] = encoding
+                if encoding:
+                    response.vary.add('Accept-Encoding')
+                FILE_HITS.labels('head' if status == 200 else 'not_modified').inc()
+                return response
+            if ranges == []:
+                return "Requested range not satisfiable.\n", 416, {'Content-Range': f'bytes */{size}'}
 
-            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
+            # A counted range response opens a download session: for RANGE_SESSION_SECONDS the
+            # client holding its cookie may fetch up to one more body's worth of ranges of it
+            # (seeking in a viewer, `curl -C -`, download managers) without using a download.
+            # Whether the last byte got out can't be known (sendfile reports nothing back), so a
+            # file spent by a range response stays that long; a whole body goes at once.
+            window = current_app.config.get('RANGE_SESSION_SECONDS', 300)
+            nbytes = sum(stop - start for start, stop in ranges) if ranges else None
+
+            # Runs once the WSGI server closes the response, i.e. after the last byte.
+            # In accel mode nginx is still sending, so deletion is deferred by a grace period.
+            grace = max(current_app.config.get('ACCEL_GRACE_SECONDS', 300) if accel else 0, window if ranges else 0)
 
-            @response.call_on_close
             def update_or_delete():
-                update_meta_cleanup(file_path, dir_path, meta_path)
-            
-            current_app.logger.info(f"File served: {random_id}/{filename} to {request.remote_addr} (Raw/Download)")
+                update_meta_cleanup(file_path, dir_path, meta_path, grace=grace, index_path=index_path)
+
+            if accel:
+                reserved = reserve_download(file_path, dir_path, meta_path, index_path, session, window, nbytes, size)
+                if reserved is None:
+                    abort(404)
+                # Checks are done; nginx moves the bytes from its internal location (and answers
+                # the Range itself)
+                response = make_response('')
+                prefix = current_app.config.get('ACCEL_REDIRECT_PREFIX', '/_accel/')
+                response.headers['X-Accel-Redirect'] = prefix + quote(f"{os.path.relpath(dir_path, upload_folder)}/{filename}")
+                response.headers['Content-Type'] = content_type
+                response.call_on_close(update_or_delete)
+            else:
+                # Stream from disk; gunicorn hands wsgi.file_wrapper to sendfile().
+                # direct_passthrough skips call_on_close, so the hook rides on the file's close().
+                # Open before reserving so a concurrent last download deleting the file can't race us
+                decode = encoding and not send_encoded
+                offset = ranges[0][0] if ranges else 0
+                try:
+                    f = storage.open_body(random_id, filename, meta_data, offset=offset, decode=decode)
+                except FileNotFoundError:
+                    abort(404)
+                reserved = reserve_download(file_path, dir_path, meta_path, index_path, session, window, nbytes, size)
+                if reserved is None:
+                    f.close()
+                    abort(404)
+                if ranges and len(ranges) > 1:
+                    boundary, length, chunks = _byteranges(storage, random_id, filename, meta_data, f, ranges, size, content_type)
+
+                    def settle():
+                        f.close()  # if the body was never iterated
+                        update_or_delete()
+
+                    response = current_app.response_class(chunks, status=206)
+                    response.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+                    response.content_length = length
+                    response.call_on_close(settle)
+                else:
+                    if ranges:
+                        start, stop = ranges[0]
+                        f = RangeFile(f, stop - start)
+                    f = ClosingFile(f, update_or_delete)
+                    if decode or backend.remote:
+                        # Plain iteration: a wsgi.file_wrapper would sendfile() the compressed bytes
+                        # (or try to, on a remote stream)
+                        body = FileWrapper(f, current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024))
+                        length = meta_data.get('stored_size') if send_encoded else size
+                    else:
+                        # sendfile() starts at the file's position and stops at Content-Length
+                        body = wrap_file(request.environ, f)
+                        length = os.fstat(f.fileno()).st_size
+                    response = current_app.response_class(body, status=206 if ranges else 200, direct_passthrough=True)
+                    response.headers['Content-Type'] = content_type
+                    if ranges:
+                        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+                        length = stop - start
+                    response.content_length = length
+                    if send_encoded:
+                        response.headers['Content-Encoding'] = encoding
+            if encoding:
+                response.vary.add('Accept-Encoding')
+            _file_headers(response, filename, ext, is_raw, etag, last_modified)
+            if reserved[1]:
+                _set_session_cookie(response, reserved[1], random_id, filename)
+
+            sent = sum(stop - start for start, stop in ranges) if ranges else size
+            FILE_HITS.labels('range' if ranges else 'raw').inc()
+            SERVED_BYTES.labels('accel' if accel else 'stream').inc(
+                (sent or 0) if accel else response.content_length or 0)
+
+            parts = ''
+            if ranges:
+                parts = f", bytes {ranges[0][0]}-{ranges[0][1] - 1}/{size}" if len(ranges) == 1 else f", {len(ranges)} ranges"
+            current_app.logger.info(f"File served: {random_id}/{filename} to {request.remote_addr} (Raw/Download{', X-Accel' if accel else ''}{f', {encoding}' if send_encoded else ''}{parts})")
 
             return response
+        except HTTPException:
+            raise
         except Exception as e:
             current_app.logger.error(f"Error serving {random_id}/{filename}: {e}")
             abort(500, f"Error serving file: {e}")
     else:
         current_app.logger.warning(f"File not found: {random_id}/{filename} requested by {request.remote_addr}")
         abort(404)
+
+def _archive_entries(dir_path):
+    # [(filename, meta)] of an upload's downloadable files, in path order
+    try:
+        names = os.listdir(dir_path)
+    except FileNotFoundError:
+        return []
+    now = time.time()
+    entries = []
+    for name in names:
+        if name.startswith('.') or not name.endswith('.meta'):
+            continue
+        filename = name[:-len('.meta')]
+        try:
+            meta_data = read_meta(os.path.join(dir_path, name))
+        except FileNotFoundError:
+            continue  # removed meanwhile
+        if 'session' in meta_data or now > meta_data.get('expiry_time', float('inf')):
+            continue
+        if meta_data.get('remaining_downloads', 1) <= 0 or not body_stored(os.path.join(dir_path, filename), meta_data):
+            continue
+        entries.append((filename, meta_data))
+    return sorted(entries, key=lambda entry: entry[1].get('path', entry[0]))
+
+@files_bp.route('/<random_id>.<any(zip, tar):fmt>', methods=['GET', 'POST'])
+def download_archive(random_id, fmt):
+    # Every file of an upload as one zip/tar, generated while it is sent. Each file included
+    # uses one of its own downloads, exactly as if it had been fetched by itself.
+    if random_id.startswith('.'):
+        abort(404)
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    index_path = current_app.config['META_INDEX_PATH']
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    dir_path = upload_dir(upload_folder, random_id)
+    storage = get_storage(upload_folder)
+
+    entries = _archive_entries(dir_path)
+    if not entries:
+        abort(404)
+
+    # A multi-file upload's entries share one password
+    password_hash = entries[0][1].get('password_hash')
+    if password_hash:
+        denied = _password_gate(random_id, '', password_hash, path=request.path)
+        if denied:
+            return denied
+    entries = [(filename, meta_data) for filename, meta_data in entries if meta_data.get('password_hash') == password_hash]
+
+    # Bodies are opened and downloads reserved one entry at a time as the archive is written
+    served = []
+
+    def members():
+        for filename, meta_data in entries:
+            file_path = os.path.join(dir_path, filename)
+            try:
+                f = storage.open_body(random_id, filename, meta_data)
+            except (FileNotFoundError, StorageError):
+                continue  # gone meanwhile
+            if reserve_download(file_path, dir_path, file_path + '.meta', index_path) is None:
+                f.close()
+                continue
+            size = meta_data.get('size')
+            if size is None:
+                size = os.fstat(f.fileno()).st_size
+            served.append((file_path, size))
+            yield meta_data.get('path', filename), size, f
+
+    logger = current_app.logger
+    remote_addr = request.remote_addr
+
+    def settle():
+        for file_path, _ in served:
+            update_meta_cleanup(file_path, dir_path, file_path + '.meta', index_path=index_path)
+        SERVED_BYTES.labels('archive').inc(sum(size for _, size in served))
+        logger.info(f"Archive served: {random_id}.{fmt} ({len(served)}/{len(entries)} files) to {remote_addr}")
+
+    stream = stream_zip if fmt == 'zip' else stream_tar
+    response = current_app.response_class(stream(members(), chunk_size),
+                                          mimetype='application/zip' if fmt == 'zip' else 'application/x-tar')
+    response.call_on_close(settle)
+    response.headers['Content-Disposition'] = f'attachment; filename="{random_id}.{fmt}"'
+    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+    response.headers['Pragma'] = 'no-cache'
+    FILE_HITS.labels('archive').inc()
+    return response
+
+@files_bp.route('/<random_id>/<filename>/chunk', methods=['GET'])
+@limiter.exempt
+def view_chunk(random_id, filename):
+    # Further pages for the code viewer. Authorised by the token issued with the first
+    # page (the view was already counted), not by the download budget.
+    try:
+        target = _chunk_serializer().loads(request.args.get('token', ''),
+                                           max_age=current_app.config.get('VIEWER_SESSION_SECONDS', 900))
+    except BadSignature:
+        abort(403)
+    if target != f"{random_id}/{filename}":
+        abort(403)
+
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    file_path = os.path.join(upload_dir(upload_folder, random_id), filename)
+    meta_data = read_meta(file_path + '.meta')
+    if offset < 0 or not body_stored(file_path, meta_data):
+        abort(404)
+
+    page_bytes = current_app.config.get('VIEWER_PAGE_BYTES', 256 * 1024)
+    try:
+        body = get_storage(upload_folder).open_body(random_id, filename, meta_data, offset)
+    except FileNotFoundError:
+        abort(404)
+    with body:
+        text, next_offset = read_text_page(body, offset, page_bytes)
+    response = make_response(text)
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    if next_offset is not None:
+        response.headers['X-Next-Offset'] = str(next_offset)
+    return response
+
+# Resumable uploads: POST /upload/<filename> opens a session, chunks are PUT to
+# /upload/<id>/<n> (in any order, in parallel, re-sent as needed), GET /upload/<id> lists
+# what arrived and POST /upload/<id>/complete assembles them into the usual /<id>/<filename>.
+# Until then the upload's .meta carries a 'session' entry and a short expiry, so an
+# abandoned session is removed by the cleanup job like any expired upload.
+CHUNKS_DIR = '.chunks'
+
+def _upload_session(random_id):
+    # (dir_path, filename, meta_data) of an unfinished chunked upload, or 404
+    if random_id.startswith('.'):
+        abort(404)
+    dir_path = upload_dir(current_app.config['UPLOAD_FOLDER'], random_id)
+    try:
+        names = os.listdir(dir_path)
+    except FileNotFoundError:
+        abort(404)
+    for name in names:
+        if name.endswith('.meta'):
+            meta_data = read_meta(os.path.join(dir_path, name))
+            if 'session' in meta_data and time.time() <= meta_data['expiry_time']:
+                return dir_path, name[:-len('.meta')], meta_data
+    abort(404)
+
+def _list_chunks(chunks_dir):
+    # [(index, size, sha256, path)] sorted by index; chunk files are named <index>.<sha256>
+    chunks = []
+    for name in os.listdir(chunks_dir):
+        if name.startswith('.'):
+            continue  # chunk still being written
+        index, checksum = name.split('.', 1)
+        path = os.path.join(chunks_dir, name)
+        chunks.append((int(index), os.path.getsize(path), checksum, path))
+    return sorted(chunks)
+
+@files_bp.route('/upload/<filename>', methods=['POST'])
+@limiter.limit("10 per minute")
+def create_upload_session(filename):
+    refused = admit_upload(0)
+    if refused:
+        return refused
+    random_id = str(uuid.uuid4())[:8]
+    # The link's TTL starts once the upload is completed
+    meta_data = _link_meta(random_id, filename)
+    dir_path = upload_dir(current_app.config['UPLOAD_FOLDER'], random_id)
+    os.makedirs(os.path.join(dir_path, CHUNKS_DIR))
+
+    session_seconds = current_app.config.get('CHUNKED_SESSION_SECONDS', 86400)
+    meta_data['session'] = {'ttl_seconds': parse_ttl(request.headers.get('X-TTL'))}
+    meta_data['expiry_time'] = time.time() + session_seconds
+    write_meta(os.path.join(dir_path, filename + '.meta'), meta_data)
+    index_upload(current_app.config['META_INDEX_PATH'], random_id, filename, meta_data)
+
+    current_app.logger.info(f"Upload session created: {random_id}/{filename} from {request.remote_addr}")
+
+    max_chunk_mb = current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    response = make_response(
+        f"Upload session: {random_id}\n"
+        f"PUT chunks (max {max_chunk_mb}MB each, numbered from 0) to https://qurl.sh/upload/{random_id}/<n>\n"
+        f"Check progress: https://qurl.sh/upload/{random_id}\n"
+        f"Finish: curl -X POST https://qurl.sh/upload/{random_id}/complete\n"
+        f"Unfinished sessions are deleted after {session_seconds // 3600}h.\n", 201
+    )
+    response.headers['X-Upload-Id'] = random_id
+    return response
+
+@files_bp.route('/upload/<random_id>/<int:index>', methods=['PUT'])
+@limiter.limit("1000 per hour")
+def upload_chunk(random_id, index):
+    dir_path, filename, meta_data = _upload_session(random_id)
+    chunks_dir = os.path.join(dir_path, CHUNKS_DIR)
+    max_chunk = current_app.config['MAX_CONTENT_LENGTH']
+    max_total = current_app.config.get('CHUNKED_MAX_SIZE', 2 * 1024 * 1024 * 1024)
+
+    if index >= current_app.config.get('CHUNKED_MAX_CHUNKS', 10000):
+        return "Chunk number out of range.\n", 400
+    content_length = request.content_length
+    if content_length is None:
+        return "Missing Content-Length header.\n", 411
+    if content_length > max_chunk:
+        return f"Chunk too large. Max allowed size is {max_chunk // (1024 * 1024)}MB.\n", 413
+    received = sum(size for i, size, _, _ in _list_chunks(chunks_dir) if i != index)
+    if received + content_length > max_total:
+        return f"File too large. Max allowed size is {max_total // (1024 * 1024)}MB.\n", 413
+    # Chunks are accounted once the upload completes; until then they count towards the quota here
+    refused = admit_upload(content_length, pending=received)
+    if refused:
+        return refused
+
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    try:
+        tmp_path, size, checksum = save_stream(request.stream, chunks_dir, max_chunk, chunk_size)
+    except UploadTooLarge:
+        return f"Chunk too large. Max allowed size is {max_chunk // (1024 * 1024)}MB.\n", 413
+
+    expected = request.headers.get('X-Chunk-SHA256')
+    error = None
+    if size != content_length:
+        error = "Chunk incomplete.\n"
+    elif expected and expected.lower() != checksum:
+        error = "Chunk checksum mismatch.\n"
+    if error:
+        os.unlink(tmp_path)
+        current_app.logger.warning(f"Rejected chunk {index} of {random_id}/{filename} ({size}/{content_length} bytes): {error.strip()}")
+        return error, 400
+
+    # Swap in under the upload lock so a concurrent complete sees either the old or the new chunk
+    with lock_upload(dir_path):
+        if not os.path.isdir(chunks_dir):
+            abort(404)  # completed or expired meanwhile
+        for i, _, _, path in _list_chunks(chunks_dir):
+            if i == index:
+                os.unlink(path)
+        os.replace(tmp_path, os.path.join(chunks_dir, f"{index:06d}.{checksum}"))
+
+    return f"{checksum}\n", 201
+
+@files_bp.route('/upload/<random_id>', methods=['GET'])
+@limiter.limit("60 per minute")
+def upload_status(random_id):
+    dir_path, filename, meta_data = _upload_session(random_id)
+    chunks = _list_chunks(os.path.join(dir_path, CHUNKS_DIR))
+    return jsonify({
+        'id': random_id,
+        'filename': filename,
+        'chunks': [{'index': i, 'size': size, 'sha256': checksum} for i, size, checksum, _ in chunks],
+        'received_bytes': sum(size for _, size, _, _ in chunks),
+        'expires_at': meta_data['expiry_time'],
+    })
+
+@files_bp.route('/upload/<random_id>/complete', methods=['POST'])
+@limiter.limit("10 per minute")
+def complete_upload(random_id):
+    dir_path, filename, meta_data = _upload_session(random_id)
+    chunks_dir = os.path.join(dir_path, CHUNKS_DIR)
+    meta_path = os.path.join(dir_path, filename + '.meta')
+
+    with lock_upload(dir_path):
+        meta_data = read_meta(meta_path)
+        if 'session' not in meta_data:
+            abort(404)  # completed by a concurrent request
+
+        chunks = _list_chunks(chunks_dir)
+        try:
+            count = int(request.headers.get('X-Chunks') or len(chunks))
+        except ValueError:
+            return "Invalid X-Chunks header.\n", 400
+        indexes = [i for i, _, _, _ in chunks]
+        missing = sorted(set(range(max(count, indexes[-1] + 1 if indexes else 0))) - set(indexes))
+        if not chunks:
+            return "No chunks uploaded.\n", 400
+        if missing:
+            return f"Missing chunks: {', '.join(map(str, missing))}\n", 400
+        if len(chunks) != count:
+            return f"Expected {count} chunks, found {len(chunks)}.\n", 400
+
+        # Stream the chunks into one file (compressed if configured), hashing the whole body
+        max_total = current_app.config.get('CHUNKED_MAX_SIZE', 2 * 1024 * 1024 * 1024)
+        total = sum(size for _, size, _, _ in chunks)
+        # The chunks are joined into a new file before they are removed
+        refused = admit_upload(total)
+        if refused:
+            return refused
+        encoding = choose_encoding(current_app.config, filename, total)
+        reader = ChunkReader([path for _, _, _, path in chunks])
+        try:
+            tmp_path, size, checksum = save_stream(reader, dir_path, max_total,
+                                                   current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024),
+                                                   encoding, current_app.config.get('COMPRESSION_LEVEL'))
+        except UploadTooLarge:
+            return f"File too large. Max allowed size is {max_total // (1024 * 1024)}MB.\n", 413
+        finally:
+            reader.close()
+
+        expected = request.headers.get('X-SHA256')
+        if expected and expected.lower() != checksum:
+            os.unlink(tmp_path)
+            return "Checksum mismatch.\n", 400
+
+        session = meta_data.pop('session')
+        meta_data['expiry_time'] = time.time() + session['ttl_seconds']
+        try:
+            details = _publish_upload(random_id, filename, tmp_path, size, checksum, encoding, meta_data)
+        except StorageError as e:
+            # The session's .meta is untouched: the chunks stay and complete can be retried
+            os.unlink(tmp_path)
+            current_app.logger.error(f"Storing {random_id}/{filename} failed: {e}")
+            return "Storage unavailable, try again later.\n", 503
+        shutil.rmtree(chunks_dir, ignore_errors=True)
+
+    current_app.logger.info(f"File uploaded: {random_id}/{filename} (Size: {size} bytes in {len(chunks)} chunks{details}, SHA256: {checksum}, TTL: {session['ttl_seconds']}s, Limit: {meta_data['remaining_downloads']}) from {request.remote_addr}")
+
+    return _upload_message(random_id, filename)
@@ -1,13 +1,17 @@
 from flask import Blueprint, request, render_template, make_response, abort, current_app
-import qrcode
-import io
 import os
+import time
 import uuid
-import json
-import yaml
-import xml.dom.minidom
 from app.extensions import limiter
 from app.config import Config
+from app.meta_index import index_upload
+from app.qr_cache import get_qr_png, qr_etag, evict_qr
+from app.utils import read_meta, save_stream, write_meta, body_stored
+from app.storage import upload_dir
+from app.compression import choose_encoding
+from app.metrics import UPLOAD_BYTES
+from app.usage import admit_upload, client_key
+from app.pretty import get_pretty, submit_pretty
 
 misc_bp = Blueprint('misc', __name__)
 
@@ -30,10 +34,34 @@ Upload:
   curl -T file.txt -H "X-TTL: 1h" https://qurl.sh
   curl -T file.txt -H "X-Downloads: 5" https://qurl.sh
 
+Large files (resumable, chunks of up to 50MB, sent in parallel):
+  curl -X POST https://qurl.sh/upload/big.iso          # prints <id>
+  split -b 50M -d -a 4 big.iso part.
+  for p in part.*; do curl -T $p https://qurl.sh/upload/<id>/$((10#${p#part.})) & done; wait
+  curl https://qurl.sh/upload/<id>                     # received chunks (resend missing ones)
+  curl -X POST https://qurl.sh/upload/<id>/complete
+
+Several files (or a directory) in one link:
+  curl -F file=@a.txt -F file=@b.png https://qurl.sh
+  tar c mydir | curl -T - -H "X-Extract: tar" https://qurl.sh/mydir
+
 Download:
   wget https://qurl.sh/<id>/file.txt
   curl -O https://qurl.sh/<id>/file.txt
 
+  # Resumable: ask for a range and keep the session cookie; resuming within 5 minutes
+  # uses no extra download
+  curl -r 0- -c jar -O https://qurl.sh/<id>/file.txt
+  curl -C - -b jar -O https://qurl.sh/<id>/file.txt
+
+  # Password protected (the cookie skips the password for 15 minutes)
+  curl -d password=secret -c jar -O https://qurl.sh/<id>/file.txt
+  curl -b jar -O https://qurl.sh/<id>/file.txt
+
+  # Every file of a link as one archive (counts as a download of each)
+  curl -O https://qurl.sh/<id>.zip
+  curl https://qurl.sh/<id>.tar | tar x
+
 QR Code (View on phone):
   https://qurl.sh/qr/<id>/file.txt
 
@@ -42,8 +70,9 @@ Pretty Print (JSON/YAML/XML):
 
 Encrypted Secrets:
   echo "secret" | curl -d @- https://qurl.sh/secret
+  echo "secret" | curl -d @- -H "X-TTL: 1h" https://qurl.sh/secret   # unread secrets expire (default 24h, max 64KB)
 
-Note: Files auto-delete after the first download. Max 50MB.
+Note: Files auto-delete after the first download. Max 50MB (2GB resumable or several files).
 """
     return render_template('index.html')
 
@@ -51,26 +80,40 @@ Note: Files auto-delete after the first download. Max 50MB.
 def get_qr(random_id, filename):
     # Verify file exists first (but don't delete it)
     upload_folder = current_app.config['UPLOAD_FOLDER']
-    dir_path = os.path.join(upload_folder, random_id)
+    dir_path = upload_dir(upload_folder, random_id)
     file_path = os.path.join(dir_path, filename)
     
-    if not os.path.exists(file_path):
+    if not body_stored(file_path):
+        evict_qr(file_path)
         abort(404)
-        
-    # Generate QR Code
+
+    # Expired but not yet swept, or used up and only kept for its deletion grace: treat as
+    # gone. Read on every request, the cached PNG can't tell (and other workers change it).
+    meta_data = read_meta(file_path + '.meta')
+    expiry_time = meta_data.get('expiry_time')
+    if (expiry_time and time.time() > expiry_time) or meta_data.get('remaining_downloads', 1) <= 0:
+        evict_qr(file_path)
+        abort(404)
+
     url = f"https://qurl.sh/{random_id}/{filename}"
-    img = qrcode.make(url)
-    
-    # Save to buffer
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-    
-    return make_response(buf.getvalue(), {'Content-Type': 'image/png'})
+    etag = qr_etag(url)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        png = get_qr_png(file_path, url, current_app.config.get('QR_CACHE_SIZE', 256),
+                         current_app.config.get('QR_DISK_CACHE', True))
+        response = make_response(png, {'Content-Type': 'image/png'})
+    response.set_etag(etag)
+    # Always revalidate: the link can expire or be used up at any time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @misc_bp.route('/pretty', methods=['POST'])
 @limiter.limit("10 per minute")
 def upload_pretty_file():
+    refused = admit_upload(request.content_length or 0)
+    if refused:
+        return refused
     if 'file' not in request.files:
         return "No file uploaded", 400
     uploaded_file = request.files['file']
@@ -84,39 +127,43 @@ def upload_pretty_file():
 
     random_id = str(uuid.uuid4())[:8]
     upload_folder = current_app.config['UPLOAD_FOLDER']
-    dir_path = os.path.join(upload_folder, random_id)
+    # Always local: the formatter pool reads it from disk
+    dir_path = upload_dir(upload_folder, random_id)
     os.makedirs(dir_path, exist_ok=True)
     file_path = os.path.join(dir_path, uploaded_file.filename)
-    uploaded_file.save(file_path)
+    encoding = choose_encoding(current_app.config, uploaded_file.filename)
+    meta_data = {}
+    if encoding:
+        # The .meta only records how the body is stored
+        tmp_path, size, _ = save_stream(uploaded_file.stream, dir_path, current_app.config['MAX_CONTENT_LENGTH'],
+                                        current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024),
+                                        encoding, current_app.config.get('COMPRESSION_LEVEL'))
+        meta_data = {'encoding': encoding, 'size': size, 'stored_size': os.path.getsize(tmp_path)}
+        write_meta(file_path + '.meta', meta_data)
+        os.replace(tmp_path, file_path)
+    else:
+        uploaded_file.save(file_path)
+        size = os.path.getsize(file_path)
+    UPLOAD_BYTES.labels(request.endpoint).inc(size)
+    # No expiry in the meta for pretty uploads: the index applies the default 24h expiry
+    index_upload(current_app.config['META_INDEX_PATH'], random_id, uploaded_file.filename,
+                 dict(meta_data, size=size, client=client_key(request.remote_addr)))
+    # Start formatting now so the first view usually finds it cached
+    submit_pretty(file_path, current_app.config)
 
     return f"You can access your pretty-printed file at https://qurl.sh/pretty/{random_id}/{uploaded_file.filename}\n"
 
 @misc_bp.route('/pretty/<random_id>/<filename>', methods=['GET'])
 def render_pretty_file(random_id, filename):
     upload_folder = current_app.config['UPLOAD_FOLDER']
-    dir_path = os.path.join(upload_folder, random_id)
+    dir_path = upload_dir(upload_folder, random_id)
     file_path = os.path.join(dir_path, filename)
 
     if not os.path.exists(file_path):
         abort(404)
 
-    ext = os.path.splitext(filename)[1].lower()
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            raw_content = f.read()
-
-        if ext == '.json':
-            parsed = json.loads(raw_content)
-            content = json.dumps(parsed, indent=4)
-        elif ext in ['.yaml', '.yml']:
-            parsed = yaml.safe_load(raw_content)
-            content = yaml.dump(parsed, sort_keys=False, indent=4)
-        elif ext == '.xml':
-            dom = xml.dom.minidom.parseString(raw_content)
-            content = '\n'.join([line for line in dom.toprettyxml().split('\n') if line.strip()])
-        else:
-            return "Unsupported file format", 415
-
+        content = get_pretty(file_path, current_app.config)
         return render_template('pretty.html', content=content, filename=filename)
     except Exception as e:
         return f"Error parsing file: {e}", 500
@@ -1,24 +1,35 @@
 from flask import Blueprint, request, make_response, abort, current_app
+from werkzeug.exceptions import HTTPException
 import os
+import time
 import uuid
 import shutil
-from cryptography.fernet import Fernet
 from app.extensions import limiter
+from app.meta_index import index_remove
+from app.secret_store import key_check
+from app.utils import parse_ttl
+from app.storage import upload_dir
+from app.metrics import UPLOAD_BYTES
 
 secrets_bp = Blueprint('secrets', __name__)
 
 @secrets_bp.route('/secret', methods=['POST'])
 @limiter.limit("10 per minute")
 def create_secret():
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-
     # Read raw text or form data
+    max_size = current_app.config.get('SECRET_MAX_BYTES', 64 * 1024)
+    if request.content_length and request.content_length > max_size:
+        return f"Secret too large. Max allowed size is {max_size // 1024}KB.\n", 413
     data = request.get_data()
     if not data:
         return "No content provided\n", 400
+    if len(data) > max_size:
+        return f"Secret too large. Max allowed size is {max_size // 1024}KB.\n", 413
         
     # Generate Key and encryption suite
     # We use Fernet (AES-128 CBC + HMAC) for simplicity and safety
+    # (cryptography is imported on first use, most workers never see a /secret request)
+    from cryptography.fernet import Fernet
     key = Fernet.generate_key() 
     f = Fernet(key)
     
@@ -27,12 +38,12 @@ def create_secret():
     
     # Store
     random_id = str(uuid.uuid4())[:12] # Longer ID for secrets
-    dir_path = os.path.join(upload_folder, 'secrets', random_id)
-    os.makedirs(dir_path, exist_ok=True)
-    file_path = os.path.join(dir_path, 'secret.enc')
-    
-    with open(file_path, 'wb') as file:
-        file.write(token)
+    expiry = time.time() + parse_ttl(request.headers.get('X-TTL'))
+    store = current_app.extensions['secret_store']
+    evicted = store.put(random_id, token, key_check(key.decode('utf-8')), expiry)
+    if evicted:
+        current_app.logger.warning(f"Secrets store full: evicted {evicted} oldest secrets")
+    UPLOAD_BYTES.labels(request.endpoint).inc(len(data))
     
     current_app.logger.info(f"Secret created: {random_id} from {request.remote_addr}")
     
@@ -45,34 +56,56 @@ def create_secret():
 @secrets_bp.route('/secret/<random_id>/<key>', methods=['GET'])
 def get_secret(random_id, key):
     try:
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        dir_path = os.path.join(upload_folder, 'secrets', random_id)
-        file_path = os.path.join(dir_path, 'secret.enc')
-        
-        if not os.path.exists(file_path):
+        store = current_app.extensions['secret_store']
+        # Atomic get-and-delete: a second reader (even a concurrent one) finds nothing
+        token = store.take(random_id, key_check(key))
+        if token is None:
+            token = _take_legacy_secret(random_id, key)
+        if token is None:
+            if store.exists(random_id):
+                current_app.logger.warning(f"Secret decryption failed: {random_id} from {request.remote_addr}")
+                return "Invalid Key or Corrupt Data", 400
             current_app.logger.warning(f"Secret not found (404): {random_id} from {request.remote_addr}")
             abort(404)
-            
+
         # Decrypt
+        from cryptography.fernet import Fernet
         try:
             f = Fernet(key.encode('utf-8'))
-            with open(file_path, 'rb') as file:
-                token = file.read()
             secret_data = f.decrypt(token)
         except Exception:
             current_app.logger.warning(f"Secret decryption failed: {random_id} from {request.remote_addr}")
             return "Invalid Key or Corrupt Data", 400
-            
-        # BURN IT
-        try:
-             shutil.rmtree(dir_path)
-             current_app.logger.info(f"Secret burned: {random_id} (Accessed by {request.remote_addr})")
-        except Exception as e:
-            current_app.logger.error(f"Failed to burn secret {random_id}: {e}")
-            pass
-            
+
+        current_app.logger.info(f"Secret burned: {random_id} (Accessed by {request.remote_addr})")
         return make_response(secret_data, {'Content-Type': 'text/plain'})
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         current_app.logger.error(f"Secret error {random_id}: {e}")
         abort(404)
+
+def _take_legacy_secret(random_id, key):
+    # Secrets created before the store were files under UPLOAD_FOLDER/secrets/<id>/ (expired
+    # via the metadata index). A wrong key leaves them alone; otherwise renaming the directory
+    # claims the secret atomically and it is burned as before.
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    dir_path = upload_dir(upload_folder, f"secrets/{random_id}")
+    from cryptography.fernet import Fernet
+    try:
+        with open(os.path.join(dir_path, 'secret.enc'), 'rb') as file:
+            token = file.read()
+        Fernet(key.encode('utf-8')).decrypt(token)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        return token
+    claimed = dir_path + '.burning'
+    try:
+        os.rename(dir_path, claimed)
+    except OSError:
+        return None
+    shutil.rmtree(claimed, ignore_errors=True)
+    index_remove(current_app.config['META_INDEX_PATH'], f"secrets/{random_id}")
+    return token
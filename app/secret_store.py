@@ -0,0 +1,146 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from app.cooperative import sqlite_connection
+
+# Storage for /secret: small Fernet tokens with an expiry, burned atomically on first read.
+# Chosen by SECRETS_STORAGE_URI (see Config):
+#   sqlite:////uploads/.secrets.sqlite3  one file shared by all workers on the host (default)
+#   memory://                            a dict per process; only for a single worker
+# Both hold at most SECRETS_MAX_BYTES of tokens and drop the oldest secrets beyond that.
+# Only a hash of the decryption key is stored: it lets a wrong key fail without burning
+# the secret, while the key itself never leaves the link.
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS secrets (
+    id TEXT PRIMARY KEY,
+    token BLOB NOT NULL,
+    key_check TEXT NOT NULL,
+    created REAL NOT NULL,
+    expiry REAL NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS secrets_expiry ON secrets (expiry);
+CREATE INDEX IF NOT EXISTS secrets_created ON secrets (created);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO usage (id, bytes) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS secrets_added AFTER INSERT ON secrets
+BEGIN UPDATE usage SET bytes = bytes + NEW.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS secrets_removed AFTER DELETE ON secrets
+BEGIN UPDATE usage SET bytes = bytes - OLD.size WHERE id = 0; END;
+"""
+
+def key_check(key):
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+class MemorySecretStore:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._secrets = OrderedDict()  # id -> (token, key_check, expiry), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, secret_id, token, check, expiry):
+        evicted = 0
+        with self._lock:
+            self._secrets[secret_id] = (token, check, expiry)
+            self._bytes += len(token)
+            while self._bytes > self.max_bytes and len(self._secrets) > 1:
+                old_token = self._secrets.popitem(last=False)[1][0]
+                self._bytes -= len(old_token)
+                evicted += 1
+        return evicted
+
+    def take(self, secret_id, check):
+        # Returns the token and forgets it, or None (unknown, expired or wrong key)
+        with self._lock:
+            entry = self._secrets.get(secret_id)
+            if entry is None or entry[1] != check or entry[2] <= time.time():
+                return None
+            del self._secrets[secret_id]
+            self._bytes -= len(entry[0])
+            return entry[0]
+
+    def exists(self, secret_id):
+        entry = self._secrets.get(secret_id)
+        return entry is not None and entry[2] > time.time()
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [secret_id for secret_id, entry in self._secrets.items() if entry[2] <= now]
+            for secret_id in expired:
+                self._bytes -= len(self._secrets.pop(secret_id)[0])
+        return len(expired)
+
+    def stats(self):
+        return {'secrets': len(self._secrets), 'bytes': self._bytes}
+
+class SQLiteSecretStore:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @property
+    def _conn(self):
+        # secure_delete: overwrite burned tokens instead of leaving them in free pages
+        return sqlite_connection(self.path, ('journal_mode=WAL', 'synchronous=NORMAL', 'secure_delete=ON'),
+                                 lambda conn: conn.executescript(SCHEMA))
+
+    def put(self, secret_id, token, check, expiry):
+        conn = self._conn
+        conn.execute(
+            'INSERT INTO secrets (id, token, key_check, created, expiry, size) VALUES (?, ?, ?, ?, ?, ?)',
+            (secret_id, token, check, time.time(), expiry, len(token))
+        )
+        if conn.execute('SELECT bytes FROM usage WHERE id = 0').fetchone()[0] <= self.max_bytes:
+            return 0
+        # Keep the newest secrets that fit in the cap
+        return conn.execute(
+            'DELETE FROM secrets WHERE id IN ('
+            ' SELECT id FROM (SELECT id, SUM(size) OVER (ORDER BY created DESC, id) AS total FROM secrets)'
+            ' WHERE total > ? AND id != ?)',
+            (self.max_bytes, secret_id)
+        ).rowcount
+
+    def take(self, secret_id, check):
+        # Single statement: of two concurrent readers exactly one gets the token
+        row = self._conn.execute(
+            'DELETE FROM secrets WHERE id = ? AND key_check = ? AND expiry > ? RETURNING token',
+            (secret_id, check, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def exists(self, secret_id):
+        return self._conn.execute(
+            'SELECT 1 FROM secrets WHERE id = ? AND expiry > ?', (secret_id, time.time())
+        ).fetchone() is not None
+
+    def purge_expired(self):
+        return self._conn.execute('DELETE FROM secrets WHERE expiry <= ?', (time.time(),)).rowcount
+
+    def stats(self):
+        count = self._conn.execute('SELECT COUNT(*) FROM secrets').fetchone()[0]
+        size = self._conn.execute('SELECT bytes FROM usage WHERE id = 0').fetchone()[0]
+        return {'secrets': count, 'bytes': size}
+
+def open_secret_store(uri, max_bytes):
+    if uri.startswith('memory://'):
+        return MemorySecretStore(max_bytes)
+    if uri.startswith('sqlite:///'):
+        return SQLiteSecretStore(uri[len('sqlite:///'):], max_bytes)
+    raise ValueError(f"Unsupported SECRETS_STORAGE_URI: {uri}")
+
+def purge_expired_secrets(store):
+    # Scheduler entry point (every worker: a memory store is per process)
+    removed = store.purge_expired()
+    if removed:
+        logger.info(f"Secrets purge: removed {removed} expired secrets")
+    return removed
@@ -0,0 +1,333 @@
+import io
+import os
+import time
+import hmac
+import errno
+import hashlib
+import logging
+import http.client
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, quote
+from app.compression import decode_stream
+from app.cooperative import flock_exclusive
+
+logger = logging.getLogger(__name__)
+
+# Where uploads live.
+#
+# Layout: an upload's directory (.meta, lock, caches, chunked sessions and, with the local
+# backend, the body) is <UPLOAD_FOLDER>/<h[0:2]>/<h[2:4]>/<id> with h = sha1(id), so no
+# directory ever holds more than a few thousand entries. Stores created before this kept
+# <UPLOAD_FOLDER>/<id>; until `flask migrate-layout` has moved them (and written the
+# .layout marker) lookups fall back to the flat path. Legacy nested ids ("secrets/<id>")
+# always stay flat.
+#
+# Backends: published bodies go to STORAGE_BACKEND ('local' or 's3'). Each upload's .meta
+# records a remote backend, so changing the setting never strands existing uploads.
+
+LAYOUT_MARKER = '.layout'
+LAYOUT_RECHECK_SECONDS = 60  # how soon workers notice a finished migration
+
+def shard_prefix(upload_id):
+    digest = hashlib.sha1(upload_id.encode()).hexdigest()
+    return os.path.join(digest[0:2], digest[2:4])
+
+def upload_relpath(upload_id):
+    if '/' in upload_id:
+        return upload_id
+    return os.path.join(shard_prefix(upload_id), upload_id)
+
+def _is_shard_name(name):
+    return len(name) == 2 and all(c in '0123456789abcdef' for c in name)
+
+_layout_state = {}  # upload_folder -> (flat dirs may exist, checked at)
+
+def _flat_fallback(upload_folder):
+    state = _layout_state.get(upload_folder)
+    now = time.monotonic()
+    if state is None or (state[0] and now - state[1] > LAYOUT_RECHECK_SECONDS):
+        state = (not os.path.exists(os.path.join(upload_folder, LAYOUT_MARKER)), now)
+        _layout_state[upload_folder] = state
+    return state[0]
+
+def upload_dir(upload_folder, upload_id):
+    sharded = os.path.join(upload_folder, upload_relpath(upload_id))
+    if '/' in upload_id or not _flat_fallback(upload_folder) or os.path.isdir(sharded):
+        return sharded
+    flat = os.path.join(upload_folder, upload_id)
+    if os.path.isdir(flat):
+        return flat
+    return sharded
+
+def split_upload_dir(dir_path):
+    # Inverse of upload_dir: (upload_folder, upload_id) of an upload directory in either layout
+    parent, upload_id = os.path.split(dir_path.rstrip(os.sep))
+    prefix = shard_prefix(upload_id)
+    if parent.endswith(os.sep + prefix):
+        return parent[:-len(prefix) - 1], upload_id
+    return parent, upload_id
+
+def _flat_entries(upload_folder):
+    # Top-level upload directories still in the flat layout
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or entry.name == 'secrets' or _is_shard_name(entry.name):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield entry
+
+def iter_upload_ids(upload_folder):
+    # Every upload directory id, in both layouts (index rebuild, legacy cleanup scan)
+    with os.scandir(upload_folder) as top:
+        for entry in top:
+            if entry.name.startswith('.') or not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.name == 'secrets':
+                for name in os.listdir(entry.path):
+                    yield f"secrets/{name}"
+            elif _is_shard_name(entry.name):
+                for second in os.listdir(entry.path):
+                    yield from os.listdir(os.path.join(entry.path, second))
+            else:
+                yield entry.name
+
+def ensure_layout(upload_folder):
+    # A store without flat upload directories (e.g. a new one) is marked sharded right away
+    marker = os.path.join(upload_folder, LAYOUT_MARKER)
+    if os.path.exists(marker):
+        return True
+    if next(_flat_entries(upload_folder), None) is not None:
+        logger.warning(f"{upload_folder} has uploads in the flat layout; run `flask migrate-layout`")
+        return False
+    with open(marker, 'w') as f:
+        f.write('sharded\n')
+    return True
+
+def migrate_layout(upload_folder, limit=None):
+    # Moves flat <id> directories to their shard, online: each move is a rename under the
+    # upload's lock (the flock lock_upload takes), and lookups fall back to the flat path
+    # until the marker is written. Directories with an upload still being written are
+    # skipped and picked up by the next run. Returns (moved, skipped, done).
+    moved = skipped = 0
+    for entry in _flat_entries(upload_folder):
+        if limit and moved >= limit:
+            return moved, skipped, False
+        if any(name.startswith('.upload-') for name in os.listdir(entry.path)):
+            skipped += 1
+            continue
+        target = os.path.join(upload_folder, upload_relpath(entry.name))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd = os.open(entry.path, os.O_RDONLY)
+        try:
+            flock_exclusive(fd)
+            os.rename(entry.path, target)
+            moved += 1
+        except FileNotFoundError:
+            pass  # removed by cleanup meanwhile
+        finally:
+            os.close(fd)
+    done = not skipped
+    if done:
+        ensure_layout(upload_folder)
+    return moved, skipped, done
+
+class LocalBackend:
+    # Bodies stay in the upload directory: sendfile, X-Accel-Redirect and dedup apply
+    name = 'local'
+    remote = False
+
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+
+    def path(self, upload_id, filename):
+        return os.path.join(upload_dir(self.upload_folder, upload_id), filename)
+
+    def put(self, upload_id, filename, tmp_path):
+        os.replace(tmp_path, self.path(upload_id, filename))
+
+    def open(self, upload_id, filename, offset=0):
+        f = open(self.path(upload_id, filename), 'rb')
+        if offset:
+            f.seek(offset)
+        return f
+
+    def delete(self, upload_id, filename):
+        pass  # goes with the upload directory
+
+class StorageError(OSError):
+    pass
+
+class _ObjectStream(io.RawIOBase):
+    # Body of a GET, read straight off the connection; closing it drops the connection
+    def __init__(self, conn, response):
+        self._conn = conn
+        self._response = response
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._response.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            self._response.close()
+            self._conn.close()
+        super().close()
+
+class S3Backend:
+    # Any S3-compatible service (AWS, MinIO, Ceph RGW...), path-style requests signed with
+    # SigV4 using only the standard library. Keys reuse the hashed shard prefix, which also
+    # spreads objects over S3's per-prefix request partitions.
+    name = 's3'
+    remote = True
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region='us-east-1', prefix='', timeout=30):
+        url = urlsplit(endpoint)
+        self.https = url.scheme == 'https'
+        self.host = url.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def key(self, upload_id, filename):
+        return f"{self.prefix}{upload_relpath(upload_id)}/{filename}"
+
+    def _signing_key(self, date):
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return key
+
+    def _request(self, method, key, body=None, headers=None):
+        path = '/' + quote(self.bucket) + '/' + quote(key, safe='/~')
+        amz_date = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        headers = dict(headers or {}, **{
+            'Host': self.host,
+            'x-amz-date': amz_date,
+            'x-amz-content-sha256': 'UNSIGNED-PAYLOAD',
+        })
+        canonical = sorted((k.lower(), str(v).strip()) for k, v in headers.items())
+        signed_headers = ';'.join(k for k, _ in canonical)
+        canonical_request = '\n'.join([
+            method, path, '',
+            ''.join(f"{k}:{v}\n" for k, v in canonical),
+            signed_headers, 'UNSIGNED-PAYLOAD',
+        ])
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        signature = hmac.new(self._signing_key(amz_date[:8]), string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed_headers}, Signature={signature}")
+
+        conn_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = conn_class(self.host, timeout=self.timeout, blocksize=64 * 1024)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            return conn, conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            # Refused, DNS failure, timeout, dropped connection: the service is unavailable
+            conn.close()
+            raise StorageError(f"S3 {method} {key}: {e!r}") from e
+        except BaseException:
+            conn.close()
+            raise
+
+    def _call(self, method, key, ok, body=None, headers=None):
+        conn, response = self._request(method, key, body, headers)
+        try:
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise StorageError(f"S3 {method} {key}: {e!r}") from e
+        finally:
+            conn.close()
+        if response.status not in ok:
+            raise StorageError(f"S3 {method} {key}: HTTP {response.status} {payload[:200]!r}")
+        return response
+
+    def put(self, upload_id, filename, tmp_path):
+        # The body is streamed from disk; the temp file is removed once the object exists
+        with open(tmp_path, 'rb') as f:
+            self._call('PUT', self.key(upload_id, filename), (200,), body=f,
+                       headers={'Content-Length': str(os.fstat(f.fileno()).st_size)})
+        os.unlink(tmp_path)
+
+    def open(self, upload_id, filename, offset=0):
+        key = self.key(upload_id, filename)
+        conn, response = self._request('GET', key, headers={'Range': f'bytes={offset}-'} if offset else None)
+        if response.status in (200, 206):
+            # Buffered, so read(n) returns n bytes until EOF like a local file
+            return io.BufferedReader(_ObjectStream(conn, response), 64 * 1024)
+        conn.close()
+        if response.status == 404:
+            raise FileNotFoundError(errno.ENOENT, 'No such object', key)
+        if response.status == 416:
+            return io.BytesIO()  # offset at or past the end
+        raise StorageError(f"S3 GET {key}: HTTP {response.status}")
+
+    def delete(self, upload_id, filename):
+        self._call('DELETE', self.key(upload_id, filename), (200, 204, 404))
+
+class Storage:
+    def __init__(self, upload_folder, default='local', s3=None):
+        self.upload_folder = upload_folder
+        self.backends = {'local': LocalBackend(upload_folder)}
+        if s3:
+            self.backends['s3'] = S3Backend(**s3)
+        if default not in self.backends:
+            raise ValueError(f"STORAGE_BACKEND={default} is not configured")
+        self.default = self.backends[default]
+
+    @property
+    def has_remote(self):
+        return len(self.backends) > 1
+
+    def backend(self, meta=None):
+        # Backend holding an upload's body, from its .meta
+        name = (meta or {}).get('backend', 'local')
+        try:
+            return self.backends[name]
+        except KeyError:
+            raise StorageError(f"upload stored in unconfigured backend {name}")
+
+    def open_body(self, upload_id, filename, meta, offset=0, decode=True):
+        # Reader of the body from offset: the original bytes, or as stored with decode=False
+        backend = self.backend(meta)
+        encoding = meta.get('encoding') if decode else None
+        if not encoding:
+            return backend.open(upload_id, filename, offset)
+        f = decode_stream(backend.open(upload_id, filename), encoding)
+        if offset:
+            f.seek(offset)
+        return f
+
+_storages = {}  # upload_folder -> Storage, set up by create_app
+
+def register_storage(storage):
+    _storages[storage.upload_folder] = storage
+    return storage
+
+def get_storage(upload_folder):
+    # Also used outside requests (cleanup sweep, CLI); a folder nobody configured is local-only
+    storage = _storages.get(upload_folder)
+    if storage is None:
+        storage = register_storage(Storage(upload_folder))
+    return storage
+
+def s3_options(config):
+    # S3Backend arguments from the S3_* settings, or None if S3 isn't configured
+    if not config.get('S3_BUCKET'):
+        return None
+    return {
+        'endpoint': config['S3_ENDPOINT'],
+        'bucket': config['S3_BUCKET'],
+        'access_key': config['S3_ACCESS_KEY'],
+        'secret_key': config['S3_SECRET_KEY'],
+        'region': config.get('S3_REGION', 'us-east-1'),
+        'prefix': config.get('S3_PREFIX', ''),
+    }
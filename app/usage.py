@@ -0,0 +1,148 @@
+import os
+import fcntl
+import shutil
+import ipaddress
+import logging
+from flask import current_app, request
+from app.meta_index import usage_of, top_clients, eviction_candidates
+from app.metrics import UPLOADS_REFUSED, EVICTED
+from app.utils import remove_upload
+
+logger = logging.getLogger(__name__)
+
+# Disk-space admission control, per-client quotas and eviction under pressure.
+#
+# Usage is accounted incrementally in the metadata index (the usage table, kept up to date
+# by triggers on every published or removed file; see meta_index.USAGE_SCHEMA): bytes on
+# disk per client address and for the whole store. A file counts once it is published;
+# bodies shared through dedup count for every link, so the total over-states the disk.
+#
+# The storage level is the fuller of the UPLOAD_FOLDER filesystem (used / (used + available),
+# as df reports it) and the accounted bytes against STORAGE_MAX_BYTES. Before reading a body:
+#   - 429 if the client would hold more than CLIENT_QUOTA_BYTES of live uploads
+#   - above STORAGE_EVICT_WATERMARK the uploads closest to expiry are evicted until the level
+#     (counting the new upload) is back at STORAGE_EVICT_TARGET; the cleanup sweep does the
+#     same, so the store doesn't wait for expiries while it is under pressure
+#   - 507 if the upload would still take the level past STORAGE_REJECT_WATERMARK
+# Bodies of unknown length can't be checked up front: uploads running into a full disk get a
+# 507 as well (InsufficientStorage, see save_stream).
+
+EVICT_LOCK = '.evict.lock'
+
+def client_key(addr):
+    # Quota key of a client address. IPv6 hosts pick any address of their /64, so it counts as one.
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return addr
+    if ip.version == 6:
+        if ip.ipv4_mapped:
+            return str(ip.ipv4_mapped)
+        return str(ipaddress.ip_network(f"{ip}/64", strict=False))
+    return str(ip)
+
+def storage_level(upload_folder, index_path, max_bytes=0, extra=0):
+    # Fraction of the store's capacity in use once `extra` more bytes are written
+    disk = shutil.disk_usage(upload_folder)
+    level = (disk.used + extra) / ((disk.used + disk.free) or 1)
+    if max_bytes:
+        level = max(level, (usage_of(index_path)[0] + extra) / max_bytes)
+    return level
+
+def eviction_policy(config):
+    return {
+        'max_bytes': config.get('STORAGE_MAX_BYTES', 0),
+        'watermark': config.get('STORAGE_EVICT_WATERMARK', 0.85),
+        'target': config.get('STORAGE_EVICT_TARGET', 0.75),
+        'batch': config.get('STORAGE_EVICT_BATCH', 200),
+    }
+
+def evict_for_space(upload_folder, index_path, max_bytes=0, watermark=0.85, target=0.75, batch=200, extra=0):
+    # Above the watermark, removes whole uploads soonest to expire first until the level with
+    # `extra` more bytes is down to target (or batch uploads are gone). One evictor at a time
+    # per store: others return 0 right away. Returns the number of uploads evicted.
+    start = storage_level(upload_folder, index_path, max_bytes, extra)
+    if start < watermark:
+        return 0
+    fd = os.open(os.path.join(upload_folder, EVICT_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+        count = 0
+        level = start
+        for upload_id in eviction_candidates(index_path, batch):
+            level = storage_level(upload_folder, index_path, max_bytes, extra)
+            if level <= target:
+                break
+            try:
+                remove_upload(upload_folder, upload_id, index_path)
+            except Exception as e:
+                logger.error(f"Evicting {upload_id} failed: {e}")
+                continue
+            count += 1
+            EVICTED.inc()
+            logger.info(f"Evicted upload {upload_id} (storage at {level:.1%})")
+        else:
+            level = storage_level(upload_folder, index_path, max_bytes, extra)
+        if count:
+            logger.warning(f"Storage pressure: evicted {count} uploads, {start:.1%} -> {level:.1%}")
+        return count
+    finally:
+        os.close(fd)
+
+def client_headroom():
+    # Bytes the requesting client may still upload, None without a quota
+    quota = current_app.config.get('CLIENT_QUOTA_BYTES', 0)
+    if not quota:
+        return None
+    used, _ = usage_of(current_app.config['META_INDEX_PATH'], client_key(request.remote_addr))
+    return max(quota - used, 0)
+
+def quota_exceeded():
+    quota = current_app.config['CLIENT_QUOTA_BYTES']
+    UPLOADS_REFUSED.labels('quota').inc()
+    current_app.logger.warning(f"Upload quota reached by {request.remote_addr}: {request.method} {request.path}")
+    return (f"Upload quota reached: at most {quota // (1024 * 1024)}MB of live uploads per address.\n"
+            "Try again once earlier uploads are downloaded or expire.\n"), 429
+
+def insufficient_storage(level=None):
+    UPLOADS_REFUSED.labels('storage').inc()
+    details = f" (storage at {level:.1%})" if level is not None else ''
+    current_app.logger.warning(f"Refused upload from {request.remote_addr}{details}: {request.method} {request.path}")
+    return "Insufficient storage, try again later.\n", 507
+
+def admit_upload(nbytes, pending=0):
+    # Checks an upload before its body is read. nbytes: its declared size (0 if unknown);
+    # pending: bytes of it already on disk but not accounted yet (chunks of a resumable
+    # upload), which only count towards the quota. Returns None to go ahead, or the response.
+    config = current_app.config
+    upload_folder = config['UPLOAD_FOLDER']
+    index_path = config['META_INDEX_PATH']
+    headroom = client_headroom()
+    if headroom is not None and nbytes + pending > headroom:
+        return quota_exceeded()
+
+    policy = eviction_policy(config)
+    evict_for_space(upload_folder, index_path, extra=nbytes, **policy)
+    level = storage_level(upload_folder, index_path, policy['max_bytes'], nbytes)
+    if level > config.get('STORAGE_REJECT_WATERMARK', 0.95):
+        return insufficient_storage(level)
+    return None
+
+def usage_stats(upload_folder, index_path, max_bytes=0, top=10):
+    # Live view of the accounting for /metrics and `flask usage`
+    disk = shutil.disk_usage(upload_folder)
+    used, files = usage_of(index_path)
+    clients, largest = top_clients(index_path, top)
+    return {
+        'level': storage_level(upload_folder, index_path, max_bytes),
+        'fs_size': disk.used + disk.free,
+        'fs_free': disk.free,
+        'bytes': used,
+        'files': files,
+        'max_bytes': max_bytes,
+        'clients': clients,
+        'top_clients': largest,
+    }
@@ -1,9 +1,22 @@
 import os
 import time
 import json
+import errno
 import shutil
 import uuid
+import hashlib
+import secrets
+import tempfile
+import fcntl
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash
+from app.meta_index import index_update, index_remove, index_remove_file, expired_rows, file_expiries, upload_digests
+from app.blobs import release_blob, blob_key
+from app.qr_cache import evict_upload, evict_qr, disk_cache_path
+from app.compression import open_encoder
+from app.storage import upload_dir, split_upload_dir, iter_upload_ids, get_storage
+from app.cooperative import flock_exclusive, yield_now
+from app.metrics import SWEEP_SECONDS, SWEEP_REMOVED
 
 import logging
 
@@ -30,45 +43,401 @@ def parse_ttl(ttl_str):
     
     return min(result, max_ttl)
 
-def update_meta_cleanup(file_path, dir_path, meta_path):
+class UploadTooLarge(Exception):
+    pass
+
+class InsufficientStorage(Exception):
+    # The disk filled up while an upload was being written (507, see app/usage.py)
+    pass
+
+def write_meta(meta_path, meta_data):
+    # Write to a sibling temp file and rename so readers never see a partial .meta
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path), prefix='.meta-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(meta_data))
+        os.replace(tmp_path, meta_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def save_stream(stream, dir_path, max_size, chunk_size=64 * 1024, encoding=None, level=None):
+    # Stream the body into a hidden temp file in dir_path, hashing as we go. The caller
+    # renames it into place once it's accepted, so serve_file only ever sees a complete file.
+    # With an encoding the file is compressed on the way to disk; size and digest are
+    # always those of the original body. Returns (tmp_path, size, sha256 hexdigest).
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            out = open_encoder(f, encoding, level) if encoding else f
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(size)
+                digest.update(chunk)
+                out.write(chunk)
+            if out is not f:
+                out.close()
+    except BaseException as e:
+        os.unlink(tmp_path)
+        if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+            raise InsufficientStorage(size) from e
+        raise
+    return tmp_path, size, digest.hexdigest()
+
+def remove_upload(upload_folder, upload_id, index_path=None):
+    # Delete an upload directory, its index rows, remote bodies, and any blobs it was the last link to
+    dir_path = upload_dir(upload_folder, upload_id)
+    storage = get_storage(upload_folder)
+    metas = {}
+    if storage.has_remote or not index_path:
+        for name in os.listdir(dir_path) if os.path.isdir(dir_path) else []:
+            if name.endswith('.meta'):
+                metas[name[:-len('.meta')]] = read_meta(os.path.join(dir_path, name))
+    if index_path:
+        digests = upload_digests(index_path, upload_id)
+    else:
+        digests = [blob_key(meta['sha256'], meta.get('encoding')) for meta in metas.values() if meta.get('sha256')]
+    for filename, meta in metas.items():
+        backend = storage.backend(meta)
+        if backend.remote:
+            try:
+                backend.delete(upload_id, filename)
+            except OSError as e:
+                logger.error(f"Failed to delete {upload_id}/{filename} from {backend.name}: {e}")
+    shutil.rmtree(dir_path, ignore_errors=True)
+    evict_upload(dir_path)
+    if index_path:
+        index_remove(index_path, upload_id)
+    for digest in digests:
+        release_blob(upload_folder, digest)
+
+def remove_entry(upload_folder, upload_id, filename, index_path=None):
+    # Delete one file of an upload (its body, .meta, cached QR, index row and blob link),
+    # or the whole upload if it was the last one. Multi-file uploads (see app/archives.py)
+    # lose their entries one at a time as each runs out of downloads or expires.
+    dir_path = upload_dir(upload_folder, upload_id)
+    file_path = os.path.join(dir_path, filename)
+    try:
+        others = [name for name in os.listdir(dir_path) if name.endswith('.meta') and name != filename + '.meta']
+    except FileNotFoundError:
+        others = []
+    if not others:
+        remove_upload(upload_folder, upload_id, index_path)
+        return
+    meta = read_meta(file_path + '.meta')
+    backend = get_storage(upload_folder).backend(meta)
+    if backend.remote:
+        try:
+            backend.delete(upload_id, filename)
+        except OSError as e:
+            logger.error(f"Failed to delete {upload_id}/{filename} from {backend.name}: {e}")
+    for path in (file_path, file_path + '.meta', disk_cache_path(file_path)):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    evict_qr(file_path)
+    if index_path:
+        index_remove_file(index_path, upload_id, filename)
+    if meta.get('sha256'):
+        release_blob(upload_folder, blob_key(meta['sha256'], meta.get('encoding')))
+
+def body_stored(file_path, meta=None):
+    # True once an upload's body is published: in place locally, or recorded as remote in its .meta
+    if os.path.exists(file_path):
+        return True
+    if meta is None:
+        meta = read_meta(file_path + '.meta')
+    return meta.get('backend', 'local') != 'local'
+
+def looks_binary(f, sample_size=8192):
+    # Cheap sniff of the first few KB of an open body instead of decoding the whole file:
+    # NUL bytes or undecodable UTF-8 (ignoring a char cut at the sample edge) mean binary
+    sample = f.read(sample_size)
+    if b'\0' in sample:
+        return True
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        return e.start < len(sample) - 3
+    return False
+
+def read_text_page(f, offset, page_bytes):
+    # One viewer page from a body opened at offset (Storage.open_body): up to page_bytes,
+    # cut back to the last newline (or at least to a UTF-8 character boundary).
+    # Returns (text, next_offset or None at EOF). Offsets are into the original bytes.
+    chunk = f.read(page_bytes + 1)
+    if len(chunk) <= page_bytes:
+        return chunk.decode('utf-8', errors='replace'), None
+    cut = chunk.rfind(b'\n', 0, page_bytes) + 1
+    if cut == 0:
+        # No newline in the page: don't split a multi-byte character (continuation bytes are 10xxxxxx)
+        cut = page_bytes
+        while cut > 0 and (chunk[cut] & 0xC0) == 0x80:
+            cut -= 1
+        cut = cut or page_bytes
+    return chunk[:cut].decode('utf-8', errors='replace'), offset + cut
+
+class ChunkReader:
+    # Reads a list of files back to back as one stream (assembling chunked uploads)
+    def __init__(self, paths):
+        self._paths = list(paths)
+        self._f = None
+
+    def read(self, n=-1):
+        while self._f or self._paths:
+            if self._f is None:
+                self._f = open(self._paths.pop(0), 'rb')
+            yield_now()
+            data = self._f.read(n)
+            if data:
+                return data
+            self._f.close()
+            self._f = None
+        return b''
+
+    def close(self):
+        if self._f:
+            self._f.close()
+            self._f = None
+
+class ClosingFile:
+    # File proxy that runs a callback once closed. Lets a wsgi.file_wrapper response
+    # (which bypasses Response.call_on_close) still trigger post-transfer work.
+    def __init__(self, f, on_close):
+        self._f = f
+        self._on_close = on_close
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._f.close()
+        self._on_close()
+
+class RangeFile:
+    # At most `length` bytes of f from its current position. fileno() still works, so a
+    # wsgi.file_wrapper can sendfile() it (bounded by the response's Content-Length).
+    def __init__(self, f, length):
+        self._f = f
+        self._left = length
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n > self._left:
+            n = self._left
+        data = self._f.read(n) if n else b''
+        self._left -= len(data)
+        return data
+
+@contextmanager
+def lock_upload(dir_path):
+    # flock on the upload directory itself: serialises every .meta read-modify-write
+    # across gunicorn workers (the .meta inode changes on each rename, the dir's doesn't)
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        flock_exclusive(fd)
+        yield
+    finally:
+        os.close(fd)
+
+def read_meta(meta_path):
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+def reserve_download(file_path, dir_path, meta_path, index_path=None, session=None, window=0, nbytes=None, size=None):
+    # Atomically take one download from the budget before serving.
+    # A counted range request (nbytes = bytes it asks for) with window > 0 opens a download
+    # session: a random token whose key (session_key) is kept in the meta with an allowance
+    # of size bytes. For window seconds, range requests presenting that key are served
+    # against the allowance instead of the budget, even once it is spent (the file is kept
+    # that long, see update_meta_cleanup's grace), until one more body's worth has gone out.
+    # Returns (downloads left, new session token or None), or None if the link is used up or gone.
     try:
-        if os.path.exists(meta_path):
-            with open(meta_path, 'r') as f:
-                current_meta = json.load(f)
-            
+        with lock_upload(dir_path):
+            current_meta = read_meta(meta_path)
+            if not body_stored(file_path, current_meta):
+                return None
             remaining = current_meta.get('remaining_downloads', 1)
-            # Check if this is the last download
-            if remaining > 1:
-                current_meta['remaining_downloads'] = remaining - 1
-                with open(meta_path, 'w') as f:
-                    f.write(json.dumps(current_meta))
-            else:
-                shutil.rmtree(dir_path)
-                logger.info(f"File deleted (Limit reached): {dir_path}") 
-        else:
-             shutil.rmtree(dir_path)
-             logger.info(f"File deleted (Default/No meta): {dir_path}")
+            now = time.time()
+            # (sessions written before they carried an allowance were bare expiry times)
+            sessions = {key: value for key, value in current_meta.get('range_sessions', {}).items()
+                        if isinstance(value, list) and value[0] > now and value[1] > 0}
+            if nbytes is not None and session in sessions and nbytes <= sessions[session][1]:
+                sessions[session][1] -= nbytes
+                current_meta['range_sessions'] = sessions
+                write_meta(meta_path, current_meta)
+                return remaining, None
+            if remaining <= 0:
+                return None
+            current_meta['remaining_downloads'] = remaining - 1
+            token = None
+            if nbytes is not None and window:
+                token = secrets.token_urlsafe(16)
+                sessions[session_key(token)] = [now + window, size or 0]
+            if sessions or 'range_sessions' in current_meta:
+                current_meta['range_sessions'] = sessions
+            write_meta(meta_path, current_meta)
+            if index_path:
+                index_update(index_path, os.path.basename(dir_path), os.path.basename(file_path), current_meta)
+            return remaining - 1, token
+    except FileNotFoundError:
+        return None
+
+def session_key(token):
+    # What the meta keeps of a download session token
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+def in_download_session(meta, session):
+    # True if session holds an open download of this file with allowance left (see reserve_download)
+    until, left = meta.get('range_sessions', {}).get(session) or (0, 0)
+    return bool(session) and until > time.time() and left > 0
 
+def update_meta_cleanup(file_path, dir_path, meta_path, grace=0, index_path=None):
+    # Runs after a transfer. Downloads were already counted by reserve_download, so this
+    # only removes the upload once its budget is spent. Open file handles of transfers
+    # still in flight keep working after the unlink.
+    # grace > 0: the bytes are still being sent by someone else (nginx X-Accel-Redirect), or
+    # the client may still resume the download with range requests (RANGE_SESSION_SECONDS),
+    # so instead of deleting, pull the expiry in and let cleanup_old_files remove it.
+    upload_folder, upload_id = split_upload_dir(dir_path)
+    filename = os.path.basename(file_path)
+    try:
+        with lock_upload(dir_path):
+            current_meta = read_meta(meta_path)
+            if current_meta.get('remaining_downloads', 0) > 0:
+                return
+            if grace:
+                deadline = time.time() + grace
+                if current_meta.get('expiry_time', float('inf')) > deadline:
+                    current_meta['expiry_time'] = deadline
+                    write_meta(meta_path, current_meta)
+                    if index_path:
+                        index_update(index_path, upload_id, filename, current_meta)
+                    logger.info(f"File consumed (Limit reached, deletion deferred {grace}s): {dir_path}")
+            else:
+                remove_entry(upload_folder, upload_id, filename, index_path)
+                logger.info(f"File deleted (Limit reached): {file_path}")
+    except FileNotFoundError:
+        # Another worker finished the last download first and already removed it
+        pass
     except Exception as e:
         logger.error(f"Cleanup failed for {dir_path}: {e}")
 
-def cleanup_old_files(upload_folder):
+def cleanup_old_files(upload_folder, index_path=None, batch_size=500, time_budget=None):
+    if index_path:
+        return cleanup_indexed(upload_folder, index_path, batch_size, time_budget)
+    return cleanup_scan(upload_folder)
+
+def cleanup_indexed(upload_folder, index_path, batch_size=500, time_budget=None):
+    # Only touches uploads whose expiry has passed: an indexed range query, no directory scan.
+    # Works through expired ids in batches and stops early once time_budget (seconds) is spent;
+    # whatever is left, and whatever failed to be removed, is picked up by the next sweep.
+    deadline = time.monotonic() + time_budget if time_budget else None
+    count = 0
+    now = time.time()
+    last = None
+    while True:
+        batch = expired_rows(index_path, now, batch_size, last)
+        if batch:
+            last = batch[-1]
+        for upload_id in dict.fromkeys(upload_id for _, upload_id in batch):
+            try:
+                if _remove_expired(upload_folder, upload_id, index_path):
+                    count += 1
+                    logger.info(f"Cleanup job: Removed expired folder {upload_id}")
+            except Exception as e:
+                logger.error(f"Error cleaning {upload_id}: {e}")
+            yield_now()
+            if deadline and time.monotonic() > deadline:
+                return count
+        if len(batch) < batch_size:
+            return count
+
+def _remove_expired(upload_folder, upload_id, index_path):
+    # Removes the upload if all of its files have expired (True), else only the expired ones
+    now = time.time()
+    expiries = file_expiries(index_path, upload_id)
+    expired = [filename for filename, expiry in expiries.items() if expiry < now]
+    dir_path = upload_dir(upload_folder, upload_id)
+    if len(expired) == len(expiries) or not os.path.isdir(dir_path):
+        remove_upload(upload_folder, upload_id, index_path)
+        return True
+    with lock_upload(dir_path):
+        for filename in expired:
+            remove_entry(upload_folder, upload_id, filename, index_path)
+            logger.info(f"Cleanup job: Removed expired file {upload_id}/{filename}")
+    return False
+
+_leader = None  # (pid, fd) of the held cleanup lock
+
+def is_cleanup_leader(lock_path):
+    # Host-wide leader election between gunicorn workers: whoever holds the flock sweeps.
+    # The lock is kept for the life of the process and released by the kernel if it dies,
+    # letting another worker take over on its next tick.
+    global _leader
+    if _leader is not None and _leader[0] == os.getpid():
+        return True
+    # A forked child shares the parent's lock; it must win its own
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _leader = (os.getpid(), fd)
+    logger.info(f"Cleanup leader elected: pid {os.getpid()}")
+    return True
+
+def run_cleanup_sweep(upload_folder, index_path, lock_path, batch_size=500, time_budget=None, eviction=None):
+    # Scheduler entry point. Returns sweep stats, or None when another process is the leader.
+    # eviction: usage.eviction_policy(), to also relieve storage pressure after removing expired uploads
+    if not is_cleanup_leader(lock_path):
+        return None
+    start = time.monotonic()
+    removed = cleanup_old_files(upload_folder, index_path, batch_size, time_budget)
+    evicted = 0
+    if eviction and index_path:
+        from app.usage import evict_for_space
+        evicted = evict_for_space(upload_folder, index_path, **eviction)
+    duration = time.monotonic() - start
+    complete = not time_budget or duration < time_budget
+    SWEEP_SECONDS.observe(duration)
+    SWEEP_REMOVED.inc(removed)
+    logger.info(f"Cleanup sweep: removed {removed}{f', evicted {evicted}' if evicted else ''} in {duration:.3f}s{'' if complete else ' (time budget reached)'}")
+    return {'removed': removed, 'evicted': evicted, 'duration': duration, 'complete': complete}
+
+def cleanup_scan(upload_folder):
+    # Legacy full walk of UPLOAD_FOLDER, parsing every .meta
     now = time.time()
     count = 0
     
     if os.path.exists(upload_folder):
-        for folder_name in os.listdir(upload_folder):
-            folder_path = os.path.join(upload_folder, folder_name)
-            if os.path.isdir(folder_path):
-                # Check for meta file
+        for folder_name in iter_upload_ids(upload_folder):
+            folder_path = upload_dir(upload_folder, folder_name)
+            # secrets/ holds no .meta and only expires through the index (see app/secret_store.py)
+            if not folder_name.startswith('secrets/'):
+                # Check for meta files (a multi-file upload goes once its last file expires)
                 expiry_time = None
                 try:
                     for f_name in os.listdir(folder_path):
                         if f_name.endswith('.meta'):
                             with open(os.path.join(folder_path, f_name), 'r') as f:
                                 meta = json.load(f)
-                                expiry_time = meta.get('expiry_time')
-                            break
+                            if meta.get('expiry_time'):
+                                expiry_time = max(expiry_time or 0, meta['expiry_time'])
                     
                     should_delete = False
                     if expiry_time:
@@ -80,7 +449,7 @@ def cleanup_old_files(upload_folder):
                             should_delete = True
 
                     if should_delete:
-                        shutil.rmtree(folder_path)
+                        remove_upload(upload_folder, folder_name)
                         count += 1
                         logger.info(f"Cleanup job: Removed expired folder {folder_name}")
                 except Exception as e:
@@ -88,3 +457,4 @@ def cleanup_old_files(upload_folder):
     
     if count > 0:
         logger.info(f"Cleanup job completed: Removed {count} expired folders.")
+    return count
@@ -0,0 +1,154 @@
+"""Multi-file uploads and archive downloads: throughput and memory for archives larger than RAM.
+
+    python -m bench.archives                      # 12 entries of 1 GiB (12 GiB archives)
+    python -m bench.archives --entries 40 --entry-mb 256 --dir /srv/uploads-bench
+
+Runs in-process against create_app() on a throwaway UPLOAD_FOLDER. First round-trips a
+small upload (random entries, nested paths) through PUT with X-Extract: tar and POST /
+multipart, and checks the .zip and .tar downloads with zipfile/tarfile byte for byte.
+Then streams a generated tar of --entries identical entries into one link, chunked (no
+Content-Length; dedup keeps the disk cost at one entry), and downloads it as .zip and as .tar without buffering,
+reporting throughput and the process RSS (current and peak) after each phase.
+"""
+import argparse
+import io
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+
+from bench.common import temp_config, peak_rss_mb, rss_mb, BodyStream
+
+CURL = {'User-Agent': 'curl/8.5.0'}
+
+
+class TarStream:
+    # Readable uncompressed tar of `count` entries of `size` bytes, generated as it is read
+    def __init__(self, count, size, pattern=b'cupload '):
+        self._parts = self._generate(count, size, pattern)
+        self._buffer = b''
+        self._pos = 0
+
+    def _generate(self, count, size, pattern):
+        for i in range(count):
+            info = tarfile.TarInfo(f"data/part-{i:04d}.bin")
+            info.size = size
+            info.mtime = time.time()
+            yield info.tobuf(tarfile.PAX_FORMAT)
+            body = BodyStream(size, pattern)
+            while True:
+                data = body.read(1024 * 1024)
+                if not data:
+                    break
+                yield data
+            yield bytes(-size % tarfile.BLOCKSIZE)
+        yield bytes(2 * tarfile.BLOCKSIZE)
+
+    def read(self, n=-1):
+        # Slices of the current part where possible; copying the tail on every small read
+        # (tarfile reads 10 KB at a time) would dominate the run
+        while self._pos >= len(self._buffer):
+            part = next(self._parts, None)
+            if part is None:
+                return b''
+            self._buffer, self._pos = part, 0
+        if n < 0 or self._pos + n > len(self._buffer):
+            data = self._buffer[self._pos:]
+            self._buffer, self._pos = b'', 0
+            return data
+        data = self._buffer[self._pos:self._pos + n]
+        self._pos += n
+        return data
+
+
+def upload_id(response):
+    assert response.status_code == 200, response.data
+    return response.get_data(as_text=True).split('https://qurl.sh/')[1].split('/')[0]
+
+
+def drain(response):
+    # Bytes of a streamed response, read chunk by chunk like a client would
+    total = 0
+    for chunk in response.response:
+        total += len(chunk)
+    response.close()
+    return total
+
+
+def check_roundtrip(client):
+    files = {'a/readme.txt': b'hello\n' * 100, 'a/b/random.bin': os.urandom(300000), 'empty': b''}
+    tar_buf = io.BytesIO()
+    with tarfile.open(fileobj=tar_buf, mode='w:gz') as tar:
+        for path, data in files.items():
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    tar_id = upload_id(client.put('/dir', data=tar_buf.getvalue(),
+                                  headers=dict(CURL, **{'X-Extract': 'tar', 'X-Downloads': '2'})))
+    form = {'file': [(io.BytesIO(data), os.path.basename(path)) for path, data in files.items()]}
+    form_id = upload_id(client.post('/', data=form, content_type='multipart/form-data',
+                                    headers=dict(CURL, **{'X-Downloads': '2'})))
+    expected = {tar_id: files, form_id: {os.path.basename(path): data for path, data in files.items()}}
+
+    for random_id, wanted in expected.items():
+        with zipfile.ZipFile(io.BytesIO(client.get(f'/{random_id}.zip', headers=CURL).data)) as archive:
+            got = {name: archive.read(name) for name in archive.namelist()}
+        assert got == wanted, f"zip of {random_id}: {sorted(got)} != {sorted(wanted)}"
+        with tarfile.open(fileobj=io.BytesIO(client.get(f'/{random_id}.tar', headers=CURL).data)) as archive:
+            got = {m.name: archive.extractfile(m).read() for m in archive}
+        assert got == wanted, f"tar of {random_id}: {sorted(got)} != {sorted(wanted)}"
+        # Two downloads allowed: both archives used them up
+        assert client.get(f'/{random_id}.zip', headers=CURL).status_code == 404
+    print(f"round trip: tar and multipart uploads, .zip and .tar downloads match ({len(files)} files each)")
+
+
+def report(phase, seconds, nbytes):
+    rate = nbytes / seconds / (1024 * 1024) if seconds else 0
+    print(f"{phase:>14}  {nbytes / 2**30:>8.2f}  {seconds:>7.1f}  {rate:>7.0f}  {rss_mb():>8.1f}  {peak_rss_mb():>9.1f}")
+
+
+def main(argv):
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=12)
+    parser.add_argument('--entry-mb', type=int, default=1024)
+    parser.add_argument('--dir', help='parent directory for the test store (default: system temp)')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    total = args.entries * args.entry_mb * 1024 * 1024
+    folder = os.path.join(args.dir, f'cupload-bench-{os.getpid()}') if args.dir else None
+    overrides = {'UPLOAD_FOLDER': folder} if folder else {}
+    app = create_app(temp_config(CLEANUP_SCHEDULER='off', ARCHIVE_MAX_SIZE=total + 1, **overrides))
+    app.logger.setLevel(logging.WARNING)
+    client = app.test_client()
+    try:
+        check_roundtrip(client)
+
+        print(f"\n{args.entries} entries of {args.entry_mb} MiB; RSS in MB")
+        print(f"{'phase':>14}  {'GiB':>8}  {'seconds':>7}  {'MiB/s':>7}  {'RSS now':>8}  {'RSS peak':>9}")
+        report('start', 0, 0)
+        start = time.perf_counter()
+        # No Content-Length, read to the end: what gunicorn hands over for `tar c | curl -T -`
+        body = {'wsgi.input': TarStream(args.entries, args.entry_mb * 1024 * 1024), 'wsgi.input_terminated': True}
+        random_id = upload_id(client.put('/data', environ_overrides=body,
+                                         headers=dict(CURL, **{'X-Extract': 'tar', 'X-Downloads': '2'})))
+        report('upload (tar)', time.perf_counter() - start, total)
+
+        for fmt in ('zip', 'tar'):
+            start = time.perf_counter()
+            response = client.get(f'/{random_id}.{fmt}', headers=CURL, buffered=False)
+            assert response.status_code == 200, response.status_code
+            sent = drain(response)
+            report(f'download .{fmt}', time.perf_counter() - start, sent)
+            assert sent >= total, f".{fmt} came out at {sent} bytes"
+    finally:
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
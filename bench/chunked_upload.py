@@ -0,0 +1,89 @@
+"""Resumable upload check: parallel chunk PUTs, a dropped chunk, resume, complete.
+
+    python -m bench.chunked_upload 200 8
+
+Uploads a body of the given size (MB) in MAX_CONTENT_LENGTH chunks from N threads.
+One chunk is first sent truncated (as if the connection dropped) and one with a wrong
+X-Chunk-SHA256; both must be rejected, show up as missing, and be accepted on resend.
+Exits non-zero if the downloaded file differs from what was sent.
+"""
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import temp_config, peak_rss_mb, BodyStream
+
+SIZE_MB = 200
+THREADS = 8
+
+
+def main(argv):
+    from app import create_app
+    from app.storage import upload_dir
+
+    size_mb = int(argv[0]) if argv else SIZE_MB
+    threads = int(argv[1]) if len(argv) > 1 else THREADS
+    app = create_app(temp_config(CHUNKED_MAX_SIZE=4 * 1024 ** 3))
+    client = app.test_client()
+    chunk_bytes = app.config['MAX_CONTENT_LENGTH']
+    size = size_mb * 1024 * 1024
+    pattern = bytes(range(251))  # not a divisor of the chunk size, so chunks differ
+    count = -(-size // chunk_bytes)
+
+    def chunk(n):
+        stream = BodyStream(size, pattern)
+        stream.seek(n * chunk_bytes)
+        return stream.read(min(chunk_bytes, size - n * chunk_bytes))
+
+    resp = client.post('/upload/big.bin', headers={'X-Downloads': '2'})
+    upload_id = resp.headers['X-Upload-Id']
+
+    def put(n, body=None, headers=None):
+        body = chunk(n) if body is None else body
+        return client.put(f'/upload/{upload_id}/{n}', data=body, headers=headers or {}).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        statuses = list(pool.map(put, range(1, count - 1)))
+    assert all(s == 201 for s in statuses), statuses
+
+    # Chunk 0 drops mid-transfer (Content-Length says more than arrives), the last one is corrupted
+    short = chunk(0)
+    dropped = client.put(f'/upload/{upload_id}/0', input_stream=BodyStream(len(short) // 2, b'x'),
+                         environ_overrides={'CONTENT_LENGTH': str(len(short))}).status_code
+    corrupt = put(count - 1, headers={'X-Chunk-SHA256': '0' * 64})
+    missing = client.post(f'/upload/{upload_id}/complete', headers={'X-Chunks': str(count)})
+    print(f"dropped chunk -> {dropped}, bad checksum -> {corrupt}, early complete -> "
+          f"{missing.status_code} {missing.get_data(as_text=True).strip()}")
+
+    # Resume: ask what arrived, resend the rest with their checksums
+    present = {c['index'] for c in client.get(f'/upload/{upload_id}').get_json()['chunks']}
+    for n in sorted(set(range(count)) - present):
+        body = chunk(n)
+        assert put(n, body, {'X-Chunk-SHA256': hashlib.sha256(body).hexdigest()}) == 201
+
+    whole = hashlib.sha256()
+    stream = BodyStream(size, pattern)
+    for block in iter(lambda: stream.read(1024 * 1024), b''):
+        whole.update(block)
+    resp = client.post(f'/upload/{upload_id}/complete',
+                       headers={'X-Chunks': str(count), 'X-SHA256': whole.hexdigest()})
+    elapsed = time.perf_counter() - start
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+
+    link = f'/{upload_id}/big.bin'
+    download = hashlib.sha256()
+    for block in client.get(link, headers={'User-Agent': 'curl'}).response:
+        download.update(block)
+    leftovers = os.listdir(upload_dir(app.config['UPLOAD_FOLDER'], upload_id))
+    ok = download.hexdigest() == whole.hexdigest() and '.chunks' not in leftovers
+
+    print(f"{size_mb} MB in {count} chunks, {threads} threads: {elapsed:.2f}s "
+          f"({size_mb / elapsed:.0f} MB/s), peak RSS {peak_rss_mb():.0f} MB, download matches: {ok}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,63 @@
+"""Cleanup sweep cost: legacy directory scan vs. indexed expiry query.
+
+Populates N uploads (0.1% of them expired) and times one sweep of each kind.
+
+    python -m bench.cleanup_index 10000 100000 1000000
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from app.meta_index import rebuild_index
+from app.utils import cleanup_scan, cleanup_indexed
+
+SIZES = [10000, 100000, 1000000]
+EXPIRED_FRACTION = 0.001
+
+
+def populate(folder, n):
+    now = time.time()
+    step = int(1 / EXPIRED_FRACTION)
+    for i in range(n):
+        dir_path = os.path.join(folder, f"{i:08x}")
+        os.mkdir(dir_path)
+        expiry = now - 60 if i % step == 0 else now + 86400
+        with open(os.path.join(dir_path, 'f.txt.meta'), 'w') as f:
+            f.write(json.dumps({'expiry_time': expiry, 'remaining_downloads': 1}))
+        open(os.path.join(dir_path, 'f.txt'), 'w').close()
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    removed = fn(*args)
+    return time.perf_counter() - start, removed
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or SIZES
+    print(f"{'entries':>9}  {'expired':>7}  {'scan s':>8}  {'indexed s':>9}  {'speedup':>8}")
+    for n in sizes:
+        base = tempfile.mkdtemp(prefix='cupload-bench-')
+        try:
+            scan_dir = os.path.join(base, 'scan')
+            idx_dir = os.path.join(base, 'indexed')
+            os.mkdir(scan_dir)
+            os.mkdir(idx_dir)
+            populate(scan_dir, n)
+            populate(idx_dir, n)
+            index_path = os.path.join(idx_dir, '.index.sqlite3')
+            rebuild_index(idx_dir, index_path)
+
+            scan_s, removed = timed(cleanup_scan, scan_dir)
+            idx_s, idx_removed = timed(cleanup_indexed, idx_dir, index_path)
+            assert removed == idx_removed, (removed, idx_removed)
+            print(f"{n:>9}  {removed:>7}  {scan_s:>8.3f}  {idx_s:>9.4f}  {scan_s / idx_s:>7.0f}x")
+        finally:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+import os
+import resource
+import tempfile
+from app.config import Config
+
+
+def temp_config(**overrides):
+    # Config subclass pointed at a throwaway UPLOAD_FOLDER, rate limits and upload quotas off
+    attrs = {
+        'UPLOAD_FOLDER': tempfile.mkdtemp(prefix='cupload-bench-'),
+        'RATELIMIT_ENABLED': False,
+        'CLIENT_QUOTA_BYTES': 0,
+    }
+    attrs.update(overrides)
+    return type('BenchConfig', (Config,), attrs)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb():
+    # Current resident set size
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+def fd_count():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    # {p: value} by nearest rank; NaN without samples
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        if not ordered:
+            result[p] = float('nan')
+        else:
+            result[p] = ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+    return result
+
+
+class BodyStream:
+    # Seekable file-like body of `size` bytes repeating `pattern`, never held in memory
+    def __init__(self, size, pattern=b'\0'):
+        self.size = size
+        self.pattern = pattern
+        self.pos = 0
+
+    def read(self, n=-1):
+        remaining = self.size - self.pos
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        start = self.pos % len(self.pattern)
+        data = (self.pattern * (n // len(self.pattern) + 2))[start:start + n]
+        self.pos += n
+        return data
+
+    def readline(self, n=-1):
+        return self.read(n)
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self.pos, 2: self.size}[whence]
+        self.pos = max(0, min(self.size, base + offset))
+        return self.pos
+
+
+def link_path(upload_response):
+    # "/<id>/<filename>" from upload_file's response text
+    return '/' + upload_response.get_data(as_text=True).split('https://qurl.sh/')[1].split('\n')[0]
@@ -0,0 +1,75 @@
+"""Compressed storage: disk and bandwidth saved, and CPU spent per MB, by encoding.
+
+    python -m bench.compression 20
+
+Uploads a log-like text body of the given size (MB) under each STORAGE_COMPRESSION
+setting, then downloads it once with Accept-Encoding matching the stored encoding and
+once without (decompressed on the fly). CPU is process time, so it includes Flask.
+"""
+import os
+import sys
+import time
+
+from bench.common import temp_config, link_path
+
+SIZE_MB = 20
+ENCODINGS = ['off', 'gzip', 'zstd']
+
+
+def log_body(size_mb):
+    lines = []
+    total = 0
+    i = 0
+    while total < size_mb * 1024 * 1024:
+        line = (f"2026-10-17T12:{i // 60 % 60:02d}:{i % 60:02d}Z INFO app.routes.files: "
+                f"File served: {i * 7919 % 10 ** 8:08x}/report-{i % 13}.json to 10.0.{i % 251}.{i % 17} "
+                f"in {i * 31 % 997} ms\n").encode()
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b''.join(lines)
+
+
+def cpu(fn):
+    start = time.process_time()
+    result = fn()
+    return result, time.process_time() - start
+
+
+def main(argv):
+    from app import create_app
+    from app.compression import available
+    from app.storage import upload_dir
+
+    size_mb = int(argv[0]) if argv else SIZE_MB
+    body = log_body(size_mb)
+    mb = len(body) / (1024 * 1024)
+    print(f"body: {mb:.1f} MB of log lines")
+    print(f"{'encoding':>8}  {'stored MB':>9}  {'ratio':>6}  {'up CPU ms/MB':>12}  "
+          f"{'sent MB':>7}  {'down CPU ms/MB':>14}  {'decoded CPU ms/MB':>17}")
+    for encoding in ENCODINGS:
+        if encoding != 'off' and not available(encoding):
+            print(f"{encoding:>8}  (not installed)")
+            continue
+        app = create_app(temp_config(STORAGE_COMPRESSION=encoding))
+        client = app.test_client()
+        resp, up_cpu = cpu(lambda: client.put('/app.log', data=body))
+        link = link_path(resp)
+        upload_id, filename = link.lstrip('/').split('/')
+        stored = os.path.getsize(os.path.join(upload_dir(app.config['UPLOAD_FOLDER'], upload_id), filename))
+
+        headers = {'User-Agent': 'curl', 'X-Downloads': '2'}
+        resp = client.put('/app.log', data=body, headers=headers)
+        link = link_path(resp)
+        accept = {'User-Agent': 'curl', 'Accept-Encoding': encoding if encoding != 'off' else 'identity'}
+        resp, down_cpu = cpu(lambda: client.get(link, headers=accept).get_data())
+        sent = len(resp)
+        resp, decoded_cpu = cpu(lambda: client.get(link, headers={'User-Agent': 'curl'}).get_data())
+        assert resp == body
+
+        print(f"{encoding:>8}  {stored / 2 ** 20:>9.2f}  {len(body) / stored:>6.1f}  {up_cpu * 1000 / mb:>12.1f}  "
+              f"{sent / 2 ** 20:>7.2f}  {down_cpu * 1000 / mb:>14.1f}  {decoded_cpu * 1000 / mb:>17.1f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,67 @@
+"""Compare DOWNLOAD_MODE=stream vs accel for raw downloads.
+
+For each mode and file size reports:
+  handler ms   time until Flask returns the response object
+  drain MB/s   full-speed throughput of the bytes that pass through the worker
+  py peak MB   tracemalloc peak while serving (Python heap only)
+  busy@2MB/s   seconds a sync worker stays pinned by a 2 MB/s client
+
+    python -m bench.download_modes 1 10 50
+"""
+import sys
+import time
+import tracemalloc
+
+from bench.common import temp_config, link_path, BodyStream
+
+SIZES_MB = [1, 10, 50]
+SLOW_CLIENT_BPS = 2 * 1024 * 1024
+
+
+def measure(mode, size_mb, repeat=3):
+    from app import create_app
+
+    size = size_mb * 1024 * 1024
+    app = create_app(temp_config(DOWNLOAD_MODE=mode, MAX_DOWNLOADS=1000))
+    client = app.test_client()
+    resp = client.put('/blob.bin', input_stream=BodyStream(size),
+                      headers={'Content-Length': str(size), 'X-Downloads': str(repeat)})
+    path = link_path(resp)
+
+    best = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        resp = client.get(path, headers={'User-Agent': 'curl/8'}, buffered=False)
+        handled = time.perf_counter()
+        sent = 0
+        for chunk in resp.response:
+            sent += len(chunk)
+        resp.close()
+        done = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        row = {
+            'handler_ms': (handled - start) * 1000,
+            'drain_mbps': (sent / 1048576) / max(done - handled, 1e-9) if sent else float('inf'),
+            'py_peak_mb': peak / 1048576,
+            'busy_slow_s': (handled - start) + sent / SLOW_CLIENT_BPS,
+        }
+        if best is None or row['handler_ms'] < best['handler_ms']:
+            best = row
+    return best
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or SIZES_MB
+    print(f"{'mode':>7}  {'size MB':>7}  {'handler ms':>10}  {'drain MB/s':>10}  {'py peak MB':>10}  {'busy@2MB/s':>10}")
+    for size_mb in sizes:
+        for mode in ('stream', 'accel'):
+            r = measure(mode, size_mb)
+            drain = 'nginx' if r['drain_mbps'] == float('inf') else f"{r['drain_mbps']:.0f}"
+            print(f"{mode:>7}  {size_mb:>7}  {r['handler_ms']:>10.2f}  {drain:>10}  "
+                  f"{r['py_peak_mb']:>10.2f}  {r['busy_slow_s']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+"""Multi-process stress check for the download budget.
+
+Forks N worker processes (each with its own app instance, like gunicorn -w N)
+that fetch the same X-Downloads: K link at the same instant, and checks that
+exactly K of them get the file. Exits non-zero on failure. tests/test_download_race.py runs
+a smaller version of it under pytest.
+
+    python -m bench.download_race --workers 32 --downloads 5 --rounds 20
+"""
+import argparse
+import multiprocessing
+import sys
+
+from bench.common import temp_config, link_path
+
+
+def fetch(config, path, barrier, results):
+    from app import create_app
+
+    client = create_app(config).test_client()
+    barrier.wait()
+    resp = client.get(path, headers={'User-Agent': 'curl/8'})
+    # In accel mode nginx would send the body; the redirect header is the grant
+    body = resp.get_data() or resp.headers.get('X-Accel-Redirect', '').encode()
+    resp.close()
+    results.put((resp.status_code, body))
+
+
+def run_round(config, workers, downloads):
+    from app import create_app
+
+    client = create_app(config).test_client()
+    resp = client.put('/hot.txt', data=b'payload', headers={'X-Downloads': str(downloads)})
+    path = link_path(resp)
+
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=fetch, args=(config, path, barrier, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    outcomes = [results.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join()
+
+    ok = sum(1 for status, body in outcomes if status == 200 and body)
+    other = sorted({status for status, _ in outcomes if status not in (200, 404)})
+    return ok, other
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--downloads', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--mode', choices=['stream', 'accel'], default='stream')
+    args = parser.parse_args(argv)
+
+    config = temp_config(DOWNLOAD_MODE=args.mode)
+    failures = 0
+    for i in range(args.rounds):
+        ok, other = run_round(config, args.workers, args.downloads)
+        status = 'ok' if ok == args.downloads and not other else 'FAIL'
+        failures += status == 'FAIL'
+        print(f"round {i + 1:>3}: {ok}/{args.workers} served (expected {args.downloads}) "
+              f"unexpected statuses {other or '-'} {status}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+"""Request latency while the log sink is slow: synchronous vs queued (LOG_ASYNC) logging.
+
+    python -m bench.logging_latency
+    python -m bench.logging_latency --seconds 10 --concurrency 16 --sink-kbps 20
+
+Each mode runs in a fresh interpreter against create_app() (test client, rate limits off)
+with LOG_REQUESTS on, so every upload+download cycle logs about six info lines. stdout is
+a pipe drained by a reader thread: 'fast' reads as fast as it can, 'slow' only --sink-kbps
+KB/s, like a Docker log driver whose shipper (promtail) has fallen behind. Once the 64 KB
+pipe buffer is full a synchronous write() blocks until the reader catches up. Reports
+request throughput and p50/p99/max latency, and how many records the queued handler
+sampled away or dropped to keep up.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from bench.common import temp_config, percentiles
+
+CURL = {'User-Agent': 'curl/8.5.0'}
+MODES = [('sync', 'fast'), ('async', 'fast'), ('sync', 'slow'), ('async', 'slow')]
+
+
+def drain_pipe(fd, kbps):
+    # Reads the sink end of stdout, at most kbps KB/s if given
+    block = 1024
+    while True:
+        data = os.read(fd, block)
+        if not data:
+            return
+        if kbps:
+            time.sleep(len(data) / (kbps * 1024))
+
+
+def run_child(mode, sink, seconds, concurrency, kbps, log_format):
+    from app import create_app
+    from prometheus_client import REGISTRY
+
+    read_fd, write_fd = os.pipe()
+    threading.Thread(target=drain_pipe, args=(read_fd, kbps if sink == 'slow' else 0), daemon=True).start()
+    results = sys.stdout
+    sys.stdout = os.fdopen(write_fd, 'w', buffering=1)
+
+    app = create_app(temp_config(CLEANUP_SCHEDULER='off', LOG_ASYNC=mode == 'async',
+                                 LOG_REQUESTS=True, LOG_FORMAT=log_format))
+    client = app.test_client()
+    latencies, lock = [], threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(n):
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = client.put(f'/log-{n}-{i}.txt', data=b'x' * 1024, headers=CURL)
+            path = '/' + response.get_data(as_text=True).split('https://qurl.sh/')[1].split('\n')[0]
+            client.get(path, headers=CURL).close()
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+            i += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    dropped = {}
+    for reason in ('sampled', 'shed', 'full'):
+        value = REGISTRY.get_sample_value('cupload_log_dropped_total', {'level': 'INFO', 'reason': reason})
+        dropped[reason] = int(value or 0)
+    p = percentiles(latencies, (50, 99, 100))
+    results.write(json.dumps({'cycles': len(latencies), 'rate': len(latencies) / elapsed,
+                              'p50': p[50], 'p99': p[99], 'max': p[100], 'dropped': dropped}) + '\n')
+    results.flush()
+    os._exit(0)  # skip the exit-time flush into the slow pipe
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--sink-kbps', type=int, default=50, help='read rate of the slow sink')
+    parser.add_argument('--format', default='json', choices=['json', 'text'])
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(*args.child, args.seconds, args.concurrency, args.sink_kbps, args.format)
+        return
+
+    print(f"{args.concurrency} threads x {args.seconds}s of PUT 1 KB + GET cycles, {args.format} logs; latency per cycle in ms")
+    print(f"{'mode':>6}  {'sink':>5}  {'cycles/s':>9}  {'p50':>8}  {'p99':>8}  {'max':>8}  {'sampled':>8}  {'shed':>6}  {'full':>6}")
+    for mode, sink in MODES:
+        out = subprocess.run([sys.executable, '-m', 'bench.logging_latency', '--child', mode, sink,
+                              '--seconds', str(args.seconds), '--concurrency', str(args.concurrency),
+                              '--sink-kbps', str(args.sink_kbps), '--format', args.format],
+                             check=True, capture_output=True, text=True).stdout
+        row = json.loads(out.strip().splitlines()[-1])
+        d = row['dropped']
+        print(f"{mode:>6}  {sink:>5}  {row['rate']:>9.0f}  {row['p50']:>8.2f}  {row['p99']:>8.2f}  {row['max']:>8.1f}  "
+              f"{d['sampled']:>8}  {d['shed']:>6}  {d['full']:>6}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+"""/pretty latency and web-worker memory: first view vs. cached view, by JSON size.
+
+    python -m bench.pretty_render 1 10 50
+"""
+import io
+import json
+import sys
+import time
+
+from bench.common import temp_config, peak_rss_mb, link_path
+
+SIZES_MB = [1, 10, 50]
+
+
+def json_document(size_mb):
+    row = {'id': 1, 'name': 'cupload', 'tags': ['a', 'b', 'c'], 'nested': {'x': 1.5, 'y': None}}
+    rows = max(1, size_mb * 1024 * 1024 // len(json.dumps(row)))
+    return json.dumps({'rows': [row] * rows}).encode()
+
+
+def main(argv):
+    from app import create_app
+
+    sizes = [int(a) for a in argv] or SIZES_MB
+    app = create_app(temp_config(MAX_CONTENT_LENGTH=128 * 1024 * 1024))  # the 50 MB document is a bit over 50 MB
+    client = app.test_client()
+    print(f"{'size MB':>8}  {'first ms':>9}  {'cached ms':>9}  {'worker RSS MB':>13}  status")
+    for size_mb in sizes:
+        body = json_document(size_mb)
+        resp = client.post('/pretty', data={'file': (io.BytesIO(body), 'doc.json')})
+        path = link_path(resp)
+        del body
+
+        start = time.perf_counter()
+        status = client.get(path).status_code
+        first = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        client.get(path)
+        cached = (time.perf_counter() - start) * 1000
+        # A 500 here is the formatter's time/memory limit doing its job
+        print(f"{size_mb:>8}  {first:>9.1f}  {cached:>9.1f}  {peak_rss_mb():>13.1f}  {status}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
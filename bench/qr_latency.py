@@ -0,0 +1,61 @@
+"""QR endpoint latency: cold render vs. warm cache vs. conditional 304.
+
+    python -m bench.qr_latency 200
+"""
+import os
+import statistics
+import sys
+import time
+
+from bench.common import temp_config, link_path
+
+N = 200
+
+
+def timings(fn, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main(argv):
+    from app import create_app
+    from app import qr_cache
+    from app.storage import upload_dir
+
+    n = int(argv[0]) if argv else N
+    app = create_app(temp_config())
+    client = app.test_client()
+    link = link_path(client.put('/report.txt', data=b'hello'))
+    qr_path = '/qr' + link
+    disk_copy = os.path.join(upload_dir(app.config['UPLOAD_FOLDER'], link.split('/')[1]), '.report.txt.qr.png')
+
+    def cold():
+        qr_cache._cache.clear()
+        if os.path.exists(disk_copy):
+            os.unlink(disk_copy)
+        assert client.get(qr_path).status_code == 200
+
+    def disk():
+        qr_cache._cache.clear()
+        assert client.get(qr_path).status_code == 200
+
+    def warm():
+        assert client.get(qr_path).status_code == 200
+
+    etag = client.get(qr_path).headers['ETag']
+
+    def not_modified():
+        assert client.get(qr_path, headers={'If-None-Match': etag}).status_code == 304
+
+    print(f"{'case':>14}  {'p50 ms':>7}  {'max ms':>7}")
+    for name, fn in [('cold render', cold), ('disk cache', disk), ('memory cache', warm), ('304', not_modified)]:
+        p50, worst = timings(fn, n)
+        print(f"{name:>14}  {p50:>7.2f}  {worst:>7.2f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
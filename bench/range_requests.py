@@ -0,0 +1,113 @@
+"""Range request timings over gunicorn (sendfile path) with the real curl.
+
+    python -m bench.range_requests
+    python -m bench.range_requests --size-mb 512
+
+Starts gunicorn with gunicorn.conf.py and uploads a --size-mb file: a download started with
+`-r 0- -c jar` is interrupted, finished with `curl -C - -b jar` and checked by SHA-256, and the
+time to fetch the last MiB is compared with the whole file. The range and resume rules
+themselves are covered by tests/test_ranges.py.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench.common import temp_config
+
+PORT = 8766
+
+
+def check(name, condition, detail=''):
+    assert condition, f"{name}: {detail}"
+    print(f"  ok  {name}")
+
+
+def gunicorn_app():
+    from app import create_app
+    # gunicorn entry point: rate limits off, PUT limit raised for the --size-mb file
+    return create_app(temp_config(UPLOAD_FOLDER=os.environ['UPLOAD_FOLDER'], CLEANUP_SCHEDULER='off',
+                                  MAX_CONTENT_LENGTH=64 * 2**30))
+
+
+def curl(*args):
+    return subprocess.run(['curl', '-s', '-S', *args], check=True, capture_output=True)
+
+
+def over_gunicorn(size_mb):
+    print(f"gunicorn + curl, {size_mb} MiB file")
+    folder = tempfile.mkdtemp(prefix='cupload-bench-')
+    work = tempfile.mkdtemp(prefix='cupload-bench-client-')
+    env = dict(os.environ, UPLOAD_FOLDER=folder)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{PORT}', '-w', '1',
+         '--log-level', 'warning', 'bench.range_requests:gunicorn_app()'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{PORT}/', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        source = os.path.join(work, 'source.bin')
+        with open(source, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        with open(source, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        base = f'http://127.0.0.1:{PORT}'
+        out = curl('-T', source, '-H', 'X-Downloads: 1', f'{base}/source.bin').stdout.decode()
+        url = base + '/' + out.split('https://qurl.sh/')[1].split('\n')[0]
+
+        # Interrupted after about a third, then resumed
+        target = os.path.join(work, 'target.bin')
+        jar = os.path.join(work, 'jar')
+        subprocess.run(['curl', '-s', '--limit-rate', '50M', '--max-time', str(max(1, size_mb // 150)),
+                        '-r', '0-', '-c', jar, '-o', target, url])
+        partial = os.path.getsize(target)
+        start = time.perf_counter()
+        curl('-C', '-', '-b', jar, '-o', target, url)
+        resumed = time.perf_counter() - start
+        with open(target, 'rb') as f:
+            ok = hashlib.file_digest(f, 'sha256').hexdigest() == digest
+        check(f'curl -C - after {partial / 2**20:.0f} MiB: resumed in {resumed:.2f}s, SHA-256 matches', ok)
+        status = subprocess.run(['curl', '-s', '-o', '/dev/null', '-w', '%{http_code}', url],
+                                capture_output=True).stdout.decode()
+        check(f'the whole file again: {status}', status == '404', status)
+        status = subprocess.run(['curl', '-s', '-r', '0-', '-b', jar, '-o', '/dev/null', '-w', '%{http_code}', url],
+                                capture_output=True).stdout.decode()
+        check(f'bytes=0- again with the session cookie: {status}', status == '404', status)
+
+        out = curl('-T', source, '-H', 'X-Downloads: 100', f'{base}/timing.bin').stdout.decode()
+        url = base + '/' + out.split('https://qurl.sh/')[1].split('\n')[0]
+        start = time.perf_counter()
+        tail = curl('-r', f'{size_mb * 2**20 - 2**20}-', url).stdout
+        tail_s = time.perf_counter() - start
+        start = time.perf_counter()
+        whole = curl(url).stdout
+        whole_s = time.perf_counter() - start
+        check(f'last MiB in {tail_s * 1000:.1f} ms, whole file in {whole_s * 1000:.0f} ms',
+              tail == whole[-2**20:] and len(tail) == 2**20, len(tail))
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(folder, ignore_errors=True)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256, help='file size')
+    args = parser.parse_args(argv)
+    over_gunicorn(args.size_mb)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,45 @@
+"""Limiter check latency: per-process memory:// vs. the shared sqlite:// store.
+
+Times the same `limits` calls Flask-Limiter makes per request (hit + window stats),
+for the fixed-window and sliding-window-counter strategies.
+
+    python -m bench.ratelimit_latency 20000
+"""
+import os
+import sys
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+import app.ratelimit_storage  # noqa: F401  registers sqlite://
+
+N = 20000
+
+
+def per_call_us(limiter, item, n):
+    keys = [f"10.0.{i % 256}.{i % 7}" for i in range(n)]
+    start = time.perf_counter()
+    for key in keys:
+        limiter.hit(item, key)
+        limiter.get_window_stats(item, key)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main(argv):
+    n = int(argv[0]) if argv else N
+    item = parse("1000000 per minute")
+    db = os.path.join(tempfile.mkdtemp(prefix='cupload-bench-'), 'rl.sqlite3')
+    stores = {'memory://': storage_from_string('memory://'),
+              'sqlite://': storage_from_string('sqlite:///' + db)}
+    print(f"{'storage':>10}  {'strategy':>31}  {'us/check':>9}")
+    for name, storage in stores.items():
+        for strategy in (FixedWindowRateLimiter, SlidingWindowCounterRateLimiter):
+            us = per_call_us(strategy(storage), item, n)
+            print(f"{name:>10}  {strategy.__name__:>31}  {us:>9.1f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
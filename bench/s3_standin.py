@@ -0,0 +1,120 @@
+"""Minimal S3-compatible server for exercising STORAGE_BACKEND=s3 without a real bucket.
+
+    python -m bench.s3_standin 9000          # then S3_ENDPOINT=http://127.0.0.1:9000
+                                             #      S3_BUCKET=uploads S3_ACCESS_KEY=test S3_SECRET_KEY=test
+
+Path-style PUT/GET (with Range)/HEAD/DELETE on objects kept in memory. Every request's
+SigV4 signature is recomputed from what arrived on the wire and checked, so signing bugs
+show up as 403s just like against S3 or MinIO. Not a storage server: no listing, no
+multipart, no persistence.
+"""
+import hashlib
+import hmac
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACCESS_KEY = 'test'
+SECRET_KEY = 'test'
+
+AUTH_RE = re.compile(r'AWS4-HMAC-SHA256 Credential=([^/]+)/([^,]+), SignedHeaders=([^,]+), Signature=([0-9a-f]+)')
+
+
+def expected_signature(method, path, headers, signed_headers, scope, secret_key):
+    date, region, service, _ = scope.split('/')
+    canonical_headers = ''.join(f"{name}:{headers[name].strip()}\n" for name in signed_headers.split(';'))
+    canonical_request = '\n'.join([method, path, '', canonical_headers, signed_headers,
+                                   headers.get('x-amz-content-sha256', 'UNSIGNED-PAYLOAD')])
+    string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', headers['x-amz-date'], scope,
+                                hashlib.sha256(canonical_request.encode()).hexdigest()])
+    key = ('AWS4' + secret_key).encode()
+    for part in (date, region, service, 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    objects = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _authorized(self):
+        match = AUTH_RE.fullmatch(self.headers.get('Authorization', ''))
+        if not match or match.group(1) != ACCESS_KEY:
+            return False
+        access_key, scope, signed_headers, signature = match.groups()
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        if any(name not in headers for name in signed_headers.split(';')):
+            return False
+        return hmac.compare_digest(signature, expected_signature(
+            self.command, self.path, headers, signed_headers, scope, SECRET_KEY))
+
+    def _handle(self):
+        if not self._authorized():
+            # Drain the body so the client sees the 403 instead of a reset
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            return self._reply(403, b'SignatureDoesNotMatch')
+        key = self.path
+        if self.command == 'PUT':
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            with self.lock:
+                self.objects[key] = body
+            return self._reply(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+        if self.command == 'DELETE':
+            with self.lock:
+                self.objects.pop(key, None)
+            return self._reply(204)
+        body = self.objects.get(key)
+        if body is None:
+            return self._reply(404, b'NoSuchKey')
+        byte_range = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if byte_range:
+            start = int(byte_range.group(1))
+            if start >= len(body):
+                return self._reply(416)
+            return self._reply(206, body[start:], {'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'})
+        return self._reply(200, body)
+
+    do_PUT = do_GET = do_HEAD = do_DELETE = _handle
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing a download early are normal here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(port=0):
+    # Starts the stand-in on a background thread; returns (server, endpoint URL)
+    server = Server(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main(argv):
+    server, endpoint = serve(int(argv[0]) if argv else 9000)
+    print(f"S3 stand-in on {endpoint} (access key {ACCESS_KEY!r}, secret {SECRET_KEY!r})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
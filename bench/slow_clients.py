@@ -0,0 +1,140 @@
+"""Slow-client load test: latency of fast clients while hundreds of slow ones hold connections.
+
+    python -m bench.slow_clients sync gevent --slow 300 --seconds 20
+
+For each worker class, starts gunicorn with gunicorn.conf.py on a throwaway UPLOAD_FOLDER,
+then opens --slow connections that trickle (half slow downloaders reading a large file
+1 KB at a time, half slow uploaders sending 1 KB at a time) and measures GET / plus a small
+download from a few fast clients. Reports fast-client p50/p95/p99 and errors.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+PORT = 8765
+
+
+def bench_app():
+    # gunicorn entry point: rate limits off, download budget big enough for every slow client
+    from app import create_app
+    from bench.common import temp_config
+    return create_app(temp_config(UPLOAD_FOLDER=os.environ['UPLOAD_FOLDER'], MAX_DOWNLOADS=100000))
+
+
+def start_server(worker_class, upload_folder):
+    env = dict(os.environ, UPLOAD_FOLDER=upload_folder, GUNICORN_WORKER_CLASS=worker_class)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{PORT}',
+         '--log-level', 'warning', 'bench.slow_clients:bench_app()'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{PORT}/', timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def put(path, body, headers=None):
+    req = urllib.request.Request(f'http://127.0.0.1:{PORT}{path}', data=body, method='PUT',
+                                 headers=dict(headers or {}, **{'User-Agent': 'curl'}))
+    text = urllib.request.urlopen(req, timeout=30).read().decode()
+    return '/' + text.split('https://qurl.sh/')[1].split('\n')[0]
+
+
+def slow_connection(request_head, trickle_upload, stop):
+    # Small receive buffer so the server really has to wait for us
+    try:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.settimeout(60)
+        sock.connect(('127.0.0.1', PORT))
+        sock.sendall(request_head)
+        while not stop.is_set():
+            if trickle_upload:
+                sock.sendall(b'x' * 1024)
+            elif not sock.recv(1024):
+                break
+            time.sleep(0.1)
+        sock.close()
+    except OSError:
+        pass
+
+
+def fast_client(paths, samples, errors, stop):
+    while not stop.is_set():
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                req = urllib.request.Request(f'http://127.0.0.1:{PORT}{path}', headers={'User-Agent': 'curl'})
+                urllib.request.urlopen(req, timeout=10).read()
+                samples.append((time.perf_counter() - start) * 1000)
+            except OSError:
+                errors.append(path)
+
+
+def percentile(samples, p):
+    return statistics.quantiles(samples, n=100)[p - 1] if len(samples) > 1 else float('nan')
+
+
+def run(worker_class, slow, seconds, fast):
+    upload_folder = tempfile.mkdtemp(prefix='cupload-bench-')
+    proc = start_server(worker_class, upload_folder)
+    try:
+        big = put('/big.bin', os.urandom(20 * 1024 * 1024), {'X-Downloads': '100000'})
+        small = put('/small.txt', b'hello\n' * 100, {'X-Downloads': '100000'})
+
+        stop = threading.Event()
+        slow_threads = []
+        for i in range(slow):
+            if i % 2:
+                head = f'PUT /slow-{i}.bin HTTP/1.1\r\nHost: x\r\nContent-Length: 10485760\r\n\r\n'.encode()
+            else:
+                head = f'GET {big} HTTP/1.1\r\nHost: x\r\nUser-Agent: curl\r\n\r\n'.encode()
+            t = threading.Thread(target=slow_connection, args=(head, bool(i % 2), stop), daemon=True)
+            t.start()
+            slow_threads.append(t)
+        time.sleep(2)  # let the slow clients settle on their connections
+
+        samples, errors = [], []
+        fast_threads = [threading.Thread(target=fast_client, args=(['/', small], samples, errors, stop), daemon=True)
+                        for _ in range(fast)]
+        for t in fast_threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in fast_threads:
+            t.join()
+
+        print(f"{worker_class:>7}  {slow:>5}  {len(samples):>6}  {len(errors):>6}  "
+              f"{percentile(samples, 50):>8.1f}  {percentile(samples, 95):>8.1f}  {percentile(samples, 99):>8.1f}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('worker_classes', nargs='*', default=['sync', 'gevent'])
+    parser.add_argument('--slow', type=int, default=300)
+    parser.add_argument('--fast', type=int, default=4)
+    parser.add_argument('--seconds', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print(f"{'workers':>7}  {'slow':>5}  {'fast ok':>6}  {'errors':>6}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}")
+    for worker_class in args.worker_classes:
+        run(worker_class, args.slow, args.seconds, args.fast)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,186 @@
+"""Startup cost: import time of the app and per-worker memory under gunicorn, with and without --preload.
+
+    python -m bench.startup
+    python -m bench.startup --workers 4 --worker-class gevent --runs 5
+
+First imports wsgi (create_app included) in fresh interpreters and reports the median
+wall time, the cumulative -X importtime of the heavy dependencies and which of them a
+worker has loaded before serving anything. Then boots gunicorn with --workers on a
+throwaway UPLOAD_FOLDER, once per mode, and reports the time until it answers, plus
+per-worker RSS, PSS (shared pages split between the processes mapping them) and USS
+(private pages only, what each extra worker really costs) from /proc/<pid>/smaps_rollup,
+after booting, after some upload/download traffic and after /qr and /secret requests
+(the features whose dependencies are imported lazily).
+"""
+import argparse
+import http.client
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ['qrcode', 'PIL.Image', 'yaml', 'xml.dom.minidom', 'cryptography.fernet', 'zstandard', 'gevent',
+         'apscheduler.schedulers.background', 'flask_limiter', 'prometheus_client']
+
+IMPORT_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import wsgi
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(m for m in {heavy!r} if m in sys.modules) or '-')
+"""
+
+
+def env(upload_folder, **extra):
+    return dict(os.environ, UPLOAD_FOLDER=upload_folder, PYTHONDONTWRITEBYTECODE='1', **extra)
+
+
+def import_report(runs):
+    upload_folder = tempfile.mkdtemp(prefix='cupload-bench-')
+    walls, loaded, cumulative = [], set(), {name: [] for name in HEAVY}
+    try:
+        for _ in range(runs):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', IMPORT_SNIPPET.format(heavy=HEAVY)],
+                cwd=ROOT, env=env(upload_folder), capture_output=True, text=True, check=True)
+            wall, modules = result.stdout.split()[-2:]
+            walls.append(float(wall))
+            loaded = set(modules.split(','))
+            # "import time: <self us> | <cumulative us> | <indented module name>"
+            for line in result.stderr.splitlines():
+                if not line.startswith('import time:') or 'cumulative' in line:
+                    continue
+                _, cum, name = line.split('|')
+                if name.strip() in cumulative:
+                    cumulative[name.strip()].append(int(cum) / 1000)
+    finally:
+        shutil.rmtree(upload_folder)
+
+    print(f"import wsgi (create_app included): median {statistics.median(walls) * 1000:.0f} ms over {runs} runs")
+    print(f"{'module':>36}  {'cumulative ms':>13}  loaded at boot")
+    for name in HEAVY:
+        samples = cumulative[name]
+        ms = f"{statistics.median(samples):.1f}" if samples else '-'
+        print(f"{name:>36}  {ms:>13}  {'yes' if name in loaded else 'no'}")
+
+
+def smaps(pid):
+    # {'Rss': kB, 'Pss': kB, 'Private': kB} of one process
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    values['Private'] = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request(method, path, body=body, headers=dict({'User-Agent': 'curl/8.5.0'}, **(headers or {})))
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def traffic(port, rounds=20):
+    # Plain uploads and downloads: the common requests, none of the lazily loaded features.
+    # Each round comes from its own client address (ProxyFix trusts X-Forwarded-For) to
+    # stay under the rate limits.
+    for i in range(rounds):
+        client = {'X-Forwarded-For': f'10.0.{i // 250}.{i % 250 + 1}'}
+        status, body = request(port, 'PUT', f'/bench-{i}.txt', body=os.urandom(32 * 1024),
+                               headers=dict(client, **{'X-Downloads': '100'}))
+        if status != 200:
+            raise RuntimeError(f"upload failed: {status} {body[:200]!r}")
+        path = '/' + body.decode().split('https://qurl.sh/')[1].split('\n')[0]
+        request(port, 'GET', path, headers=client)
+    return path
+
+
+def rare_traffic(port, path, rounds=20):
+    # QR codes and secrets, enough of them that every worker has loaded qrcode/PIL and cryptography
+    for i in range(rounds):
+        client = {'X-Forwarded-For': f'10.1.{i // 250}.{i % 250 + 1}'}
+        request(port, 'GET', '/qr' + path, headers=client)
+        status, body = request(port, 'POST', '/secret', body=b'hunter2', headers=client)
+        request(port, 'GET', '/' + body.decode().split('https://qurl.sh/')[1].strip(), headers=client)
+
+
+def report_memory(label, pids):
+    rows = [smaps(pid) for pid in pids]
+    mean = {key: sum(row[key] for row in rows) / len(rows) / 1024 for key in ('Rss', 'Pss', 'Private')}
+    print(f"{label:>30}  {mean['Rss']:>8.1f}  {mean['Pss']:>8.1f}  {mean['Private']:>8.1f}")
+
+
+def run_gunicorn(preload, workers, worker_class, port):
+    upload_folder = tempfile.mkdtemp(prefix='cupload-bench-')
+    args = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+            '--log-level', 'warning']
+    if preload:
+        args.append('--preload')
+    start = time.perf_counter()
+    master = subprocess.Popen(args + ['wsgi:app'], cwd=ROOT,
+                              env=env(upload_folder, GUNICORN_PRELOAD=str(preload).lower(),
+                                      GUNICORN_WORKERS=str(workers), GUNICORN_WORKER_CLASS=worker_class),
+                              stdout=subprocess.DEVNULL)
+    mode = 'preload' if preload else 'no preload'
+    try:
+        while True:
+            if master.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {master.returncode}")
+            try:
+                request(port, 'GET', '/')
+                if len(worker_pids(master.pid)) == workers:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.01)
+        ready = time.perf_counter() - start
+        time.sleep(1)  # let the remaining workers finish booting
+        pids = worker_pids(master.pid)
+        print(f"{mode:>30}  ready in {ready:.2f}s")
+        report_memory(f'{mode}, idle', pids)
+        path = traffic(port)
+        report_memory(f'{mode}, after traffic', pids)
+        rare_traffic(port, path)
+        report_memory(f'{mode}, after /qr, /secret', pids)
+        report_memory(f'{mode}, master', [master.pid])
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+        shutil.rmtree(upload_folder)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters for the import timing')
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args(argv)
+
+    import_report(args.runs)
+    print()
+    print(f"{args.workers} {args.worker_class} workers; per-worker mean in MB")
+    print(f"{'':>30}  {'RSS':>8}  {'PSS':>8}  {'USS':>8}")
+    for preload in (False, True):
+        run_gunicorn(preload, args.workers, args.worker_class, args.port)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
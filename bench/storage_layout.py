@@ -0,0 +1,125 @@
+"""Per-operation storage latency at large entry counts: flat vs sharded layout, and S3.
+
+    python -m bench.storage_layout 200000 --ops 2000
+    python -m bench.storage_layout 1000000 --dir /srv/uploads-bench   # on the production filesystem
+
+Fills a store with N upload directories (one .meta each) in the old flat layout
+(<UPLOAD_FOLDER>/<id>) and in the sharded one (<UPLOAD_FOLDER>/<xx>/<yy>/<id>), then times
+per-op p50/p99 of creating an upload directory, looking one up and reading its .meta, and
+removing one, plus a full walk of all ids (index rebuild / legacy cleanup scan). Finally
+times put/get/delete of 64 KB bodies through S3Backend against bench.s3_standin.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+from bench.common import percentiles
+
+
+def flat_dir(folder, upload_id):
+    return os.path.join(folder, upload_id)
+
+
+def new_ids(count, taken=()):
+    # Random 8-hex ids like the app's, without the birthday collisions of large samples
+    ids = set()
+    while len(ids) < count:
+        upload_id = uuid.uuid4().hex[:8]
+        if upload_id not in taken:
+            ids.add(upload_id)
+    return list(ids)
+
+
+def timed(op, args):
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        op(arg)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentiles(samples)
+
+
+def run_layout(name, folder, dir_for, count, ops):
+    from app.utils import write_meta, read_meta
+    from app.storage import iter_upload_ids
+
+    def create(upload_id):
+        path = dir_for(folder, upload_id)
+        os.makedirs(path)
+        write_meta(os.path.join(path, 'file.txt.meta'), {'expiry_time': 0, 'remaining_downloads': 1})
+
+    ids = new_ids(count)
+    start = time.perf_counter()
+    for upload_id in ids:
+        create(upload_id)
+    fill = time.perf_counter() - start
+
+    results = {
+        'create': timed(create, new_ids(ops, set(ids))),
+        'lookup': timed(lambda i: read_meta(os.path.join(dir_for(folder, i), 'file.txt.meta')), random.sample(ids, ops)),
+        'remove': timed(lambda i: shutil.rmtree(dir_for(folder, i)), random.sample(ids, ops)),
+    }
+    start = time.perf_counter()
+    walked = sum(1 for _ in iter_upload_ids(folder))
+    walk = time.perf_counter() - start
+    for op, p in results.items():
+        print(f"{name:>8}  {op:>7}  {p[50]:>8.1f}  {p[99]:>8.1f}")
+    print(f"{name:>8}  {'walk':>7}  {walk:>8.2f}s for {walked} ids (fill took {fill:.1f}s)")
+
+
+def run_s3(ops):
+    from app.storage import S3Backend
+    from bench.s3_standin import serve, ACCESS_KEY, SECRET_KEY
+
+    server, endpoint = serve()
+    backend = S3Backend(endpoint, 'uploads', ACCESS_KEY, SECRET_KEY)
+    tmp_dir = tempfile.mkdtemp(prefix='cupload-bench-')
+    body = os.urandom(64 * 1024)
+    ids = new_ids(ops)
+
+    def put(upload_id):
+        path = os.path.join(tmp_dir, upload_id)
+        with open(path, 'wb') as f:
+            f.write(body)
+        backend.put(upload_id, 'file.bin', path)
+
+    def get(upload_id):
+        with backend.open(upload_id, 'file.bin') as f:
+            f.read()
+
+    for op, fn in (('put', put), ('get', get), ('delete', lambda i: backend.delete(i, 'file.bin'))):
+        p = timed(fn, ids)
+        print(f"{'s3':>8}  {op:>7}  {p[50]:>8.1f}  {p[99]:>8.1f}")
+    server.shutdown()
+    shutil.rmtree(tmp_dir)
+
+
+def main(argv):
+    from app.storage import upload_dir, ensure_layout
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('count', nargs='?', type=int, default=200000)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--dir', help='parent directory for the test stores (default: system temp)')
+    args = parser.parse_args(argv)
+
+    print(f"{args.count} uploads, {args.ops} ops each; latency in us")
+    print(f"{'layout':>8}  {'op':>7}  {'p50':>8}  {'p99':>8}")
+    for name in ('flat', 'sharded'):
+        folder = tempfile.mkdtemp(prefix=f'cupload-{name}-', dir=args.dir)
+        if name == 'sharded':
+            ensure_layout(folder)
+        try:
+            run_layout(name, folder, flat_dir if name == 'flat' else upload_dir, args.count, args.ops)
+        finally:
+            shutil.rmtree(folder)
+    run_s3(args.ops)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,309 @@
+"""Admission control, client quotas and pressure eviction on a small filesystem.
+
+    python -m bench.storage_pressure                 # 64 MiB tmpfs (needs root), else simulated
+    python -m bench.storage_pressure --dir /mnt/small --fs-mb 128
+
+Runs in-process against create_app() (test client, rate limits off; clients are told apart by
+REMOTE_ADDR) with UPLOAD_FOLDER on a filesystem of --fs-mb: the --dir given, a tmpfs mounted
+for the run, or, if mounting isn't possible, STORAGE_MAX_BYTES standing in for the filesystem.
+Asserts for each scenario:
+  quota       a client over CLIENT_QUOTA_BYTES gets 429, others don't, downloads free it up,
+              addresses of one IPv6 /64 share it, an over-quota chunked tar is cut off
+  eviction    filling the store past the evict watermark evicts the uploads closest to
+              expiry first and leaves the rest, instead of refusing
+  507         with space held by what can't be evicted (another tenant's file, an unfinished
+              chunked upload) uploads past the reject watermark get 507
+  disk full   a body of unknown length running into ENOSPC gets 507, nothing left behind
+  sweep       the cleanup sweep evicts too
+and that the usage table still matches the uploads it accounts for. Ends with the live stats
+and the admission cost per upload (quota + watermarks vs. both off).
+"""
+import argparse
+import io
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from bench.common import temp_config, link_path, BodyStream
+
+CURL = {'User-Agent': 'curl/8.5.0'}
+MB = 1024 * 1024
+
+
+def client_for(app, addr):
+    client = app.test_client()
+    client.environ_base['REMOTE_ADDR'] = addr
+    return client
+
+
+def put(client, name, size, ttl=None, **headers):
+    if ttl:
+        headers['X-TTL'] = ttl
+    return client.put(f'/{name}', input_stream=BodyStream(size, os.urandom(64)),
+                      headers=dict(CURL, **{'Content-Length': str(size)}, **headers))
+
+
+def check(name, condition, detail=''):
+    assert condition, f"{name}: {detail}"
+    print(f"  ok  {name}")
+
+
+def accounting_consistent(index_path):
+    from app.meta_index import get_db
+    conn = get_db(index_path)
+    expected = dict(conn.execute(
+        "SELECT '', COALESCE(SUM(COALESCE(stored_size, size, 0)), 0) FROM uploads"
+    ).fetchall())
+    expected.update(conn.execute(
+        'SELECT client, SUM(COALESCE(stored_size, size, 0)) FROM uploads WHERE client IS NOT NULL GROUP BY client'
+    ).fetchall())
+    actual = dict(conn.execute('SELECT client, bytes FROM usage').fetchall())
+    return expected == actual, (expected, actual)
+
+
+def make_app(folder, simulated_bytes, **overrides):
+    from app import create_app
+    store = os.path.join(folder, f'store-{time.monotonic_ns()}')
+    config = dict(CLEANUP_SCHEDULER='off', UPLOAD_FOLDER=store, DEDUP_UPLOADS=False,
+                  MAX_CONTENT_LENGTH=64 * MB, CLIENT_QUOTA_BYTES=0)
+    if simulated_bytes:
+        config['STORAGE_MAX_BYTES'] = simulated_bytes
+    config.update(overrides)
+    app = create_app(temp_config(**config))
+    app.logger.setLevel(logging.WARNING)
+    return app
+
+
+def level(app):
+    from app.usage import storage_level
+    return storage_level(app.config['UPLOAD_FOLDER'], app.config['META_INDEX_PATH'], app.config['STORAGE_MAX_BYTES'])
+
+
+def quota(folder, fs_bytes, simulated):
+    print("quota")
+    app = make_app(folder, simulated, CLIENT_QUOTA_BYTES=fs_bytes // 8)
+    unit = fs_bytes // 32
+    a, b = client_for(app, '198.51.100.7'), client_for(app, '198.51.100.8')
+    first = link_path(put(a, 'a1.bin', unit * 2))
+    check('under quota', put(a, 'a2.bin', unit * 1).status_code == 200)
+    r = put(a, 'a3.bin', unit * 2)
+    check('over quota: 429', r.status_code == 429, r.status_code)
+    check('other client unaffected', put(b, 'b1.bin', unit * 2).status_code == 200)
+    a.get(first, headers=CURL).close()
+    check('a download frees the quota', put(a, 'a3.bin', unit * 2).status_code == 200)
+
+    v6a, v6b = client_for(app, '2001:db8:1:2::10'), client_for(app, '2001:db8:1:2:ffff::1')
+    check('IPv6 /64 shares one quota', put(v6a, 'v1.bin', unit * 3).status_code == 200
+          and put(v6b, 'v2.bin', unit * 2).status_code == 429)
+
+    tar_buf = io.BytesIO()
+    with tarfile.open(fileobj=tar_buf, mode='w') as tar:
+        for i in range(6):
+            info = tarfile.TarInfo(f'dir/{i}.bin')
+            info.size = unit
+            tar.addfile(info, io.BytesIO(os.urandom(unit)))
+    c = client_for(app, '198.51.100.9')
+    before = accounting_consistent(app.config['META_INDEX_PATH'])
+    tar_buf.seek(0)
+    body = {'wsgi.input': tar_buf, 'wsgi.input_terminated': True}  # chunked: no Content-Length
+    r = c.put('/dir', environ_overrides=body, headers=dict(CURL, **{'X-Extract': 'tar'}))
+    check('chunked tar past the quota: 429', r.status_code == 429, r.status_code)
+    check('nothing of it accounted', before[0] and accounting_consistent(app.config['META_INDEX_PATH'])[0])
+    shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+def eviction(folder, fs_bytes, simulated):
+    print("eviction")
+    app = make_app(folder, simulated, STORAGE_EVICT_WATERMARK=0.6, STORAGE_EVICT_TARGET=0.4,
+                   STORAGE_REJECT_WATERMARK=0.9)
+    from app.meta_index import get_db
+    c = client_for(app, '203.0.113.1')
+    unit = fs_bytes // 20
+    paths = {}
+    # Short TTLs among long ones: these should go first
+    for i in range(10):
+        ttl = '5m' if i % 3 == 0 else '2d'
+        r = put(c, f'fill-{i}.bin', unit, ttl)
+        assert r.status_code == 200, r.status_code
+        paths[link_path(r)] = ttl
+    start = level(app)
+    check(f'filled to {start:.0%}', start < 0.6)
+    statuses = [put(c, f'more-{i}.bin', unit, '1d').status_code for i in range(6)]
+    after = level(app)
+    check(f'uploads past the evict watermark accepted: {statuses}', statuses == [200] * 6)
+    check(f'level back near the target ({after:.0%})', after < 0.6, after)
+    ids = {row[0] for row in get_db(app.config['META_INDEX_PATH']).execute('SELECT id FROM uploads')}
+    gone = {path: ttl for path, ttl in paths.items() if path.split('/')[1] not in ids}
+    check(f'soonest to expire went first ({len(gone)} evicted, TTLs {sorted(set(gone.values()))})',
+          gone and all(ttl == '5m' for ttl in list(gone.values())[:4]) and sum(ttl == '5m' for ttl in gone.values()) == 4,
+          gone)
+    check('evicted links are 404', all(c.get(path, headers=CURL).status_code == 404 for path in gone))
+    ok, detail = accounting_consistent(app.config['META_INDEX_PATH'])
+    check('usage table matches the uploads', ok, detail)
+    shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+def refusal(folder, fs_bytes, simulated):
+    print("507")
+    app = make_app(folder, simulated, STORAGE_EVICT_WATERMARK=0.5, STORAGE_EVICT_TARGET=0.3,
+                   STORAGE_REJECT_WATERMARK=0.8)
+    c = client_for(app, '203.0.113.2')
+    unit = fs_bytes // 10
+    if simulated:
+        # What can't be evicted: the unfinished chunked upload below only
+        filler = None
+    else:
+        # Another tenant of the filesystem
+        filler = os.path.join(app.config['UPLOAD_FOLDER'], '..', 'filler.bin')
+        with open(filler, 'wb') as f:
+            f.write(b'\0' * (unit * 3))
+    session = c.post('/upload/big.bin', headers=CURL).headers['X-Upload-Id']
+    for i in range(3 if filler else 5):
+        assert c.put(f'/upload/{session}/{i}', input_stream=BodyStream(unit),
+                     headers=dict(CURL, **{'Content-Length': str(unit)})).status_code == 201
+    if simulated:
+        # Chunks aren't accounted until complete: make the index see them as stored bytes
+        # held by an upload that isn't finished (size NULL rows are never evicted)
+        from app.meta_index import get_db
+        get_db(app.config['META_INDEX_PATH']).execute(
+            "INSERT INTO uploads (id, filename, expiry_time, stored_size) VALUES ('pinned', 'x', ?, ?)",
+            (time.time() + 3600, unit * 5))
+    r = put(c, 'small.bin', unit // 2)
+    check(f'room left: 200 (level {level(app):.0%})', r.status_code == 200, r.status_code)
+    r = put(c, 'too-big.bin', unit * 4)
+    check('past the reject watermark with nothing to evict: 507', r.status_code == 507, r.status_code)
+    if filler:
+        os.unlink(filler)
+        check('space freed: accepted again', put(c, 'too-big.bin', unit * 4).status_code == 200)
+    shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+def disk_full(folder, fs_bytes, simulated):
+    if simulated:
+        print("disk full: skipped (needs a real small filesystem)")
+        return
+    print("disk full")
+    app = make_app(folder, 0, STORAGE_REJECT_WATERMARK=1.0, STORAGE_EVICT_WATERMARK=1.0,
+                   ARCHIVE_MAX_SIZE=fs_bytes * 4)
+    c = client_for(app, '203.0.113.3')
+    size = fs_bytes * 2
+    tar_buf = tempfile.TemporaryFile()
+    with tarfile.open(fileobj=tar_buf, mode='w') as tar:
+        info = tarfile.TarInfo('huge.bin')
+        info.size = size
+        tar.addfile(info, BodyStream(size))
+    tar_buf.seek(0)
+    body = {'wsgi.input': tar_buf, 'wsgi.input_terminated': True}
+    r = c.put('/huge', environ_overrides=body, headers=dict(CURL, **{'X-Extract': 'tar'}))
+    check('ENOSPC mid-upload: 507', r.status_code == 507, r.status_code)
+    leftovers = [name for _, _, names in os.walk(app.config['UPLOAD_FOLDER']) for name in names if name.startswith('.upload-')]
+    check('no partial files left', not leftovers, leftovers)
+    check('next upload goes through', put(c, 'after.bin', MB).status_code == 200)
+    tar_buf.close()
+    shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+def sweep(folder, fs_bytes, simulated):
+    print("sweep")
+    from app.utils import run_cleanup_sweep
+    app = make_app(folder, simulated)
+    c = client_for(app, '203.0.113.4')
+    unit = fs_bytes // 20
+    for i in range(8):
+        assert put(c, f'fill-{i}.bin', unit).status_code == 200
+    before = level(app)
+    # Simulated, the real filesystem's own level is a floor eviction can't get under
+    disk = shutil.disk_usage(app.config['UPLOAD_FOLDER'])
+    floor = disk.used / (disk.used + disk.free) if simulated else 0
+    target = max(before * 0.5, floor + 0.05)
+    # Tighter watermarks from now on, e.g. after a config change: the next sweep evicts
+    args = list(app.extensions['sweep_args'])
+    args[-1] = dict(args[-1], watermark=before * 0.8, target=target)
+    stats = run_cleanup_sweep(*args)
+    after = level(app)
+    check(f"sweep evicted {stats['evicted']}: {before:.0%} -> {after:.0%}", 0 < stats['evicted'] < 8 and after <= target)
+    shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+def live_stats(folder, fs_bytes, simulated):
+    print("live stats")
+    from app.usage import usage_stats
+    app = make_app(folder, simulated, CLIENT_QUOTA_BYTES=fs_bytes)
+    for i, addr in enumerate(['192.0.2.1', '192.0.2.2', '192.0.2.2']):
+        put(client_for(app, addr), f's{i}.bin', fs_bytes // 16)
+    stats = usage_stats(app.config['UPLOAD_FOLDER'], app.config['META_INDEX_PATH'], app.config['STORAGE_MAX_BYTES'])
+    print(f"  level {stats['level']:.1%}, {stats['bytes']} bytes in {stats['files']} files, {stats['clients']} clients, "
+          f"top {stats['top_clients'][0]}")
+    metrics = client_for(app, '127.0.0.1').get('/metrics').get_data(as_text=True)
+    check('/metrics has the usage gauges', 'cupload_storage_level' in metrics and 'cupload_usage_top_client_bytes' in metrics)
+    shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+def overhead(folder, simulated, count):
+    print(f"admission cost, {count} uploads of 1 KiB")
+    for name, overrides in [('off', dict(CLIENT_QUOTA_BYTES=0, STORAGE_EVICT_WATERMARK=2, STORAGE_REJECT_WATERMARK=2)),
+                            ('on', dict(CLIENT_QUOTA_BYTES=1024 * MB))]:
+        app = make_app(folder, simulated, **overrides)
+        c = client_for(app, '192.0.2.10')
+        start = time.perf_counter()
+        for i in range(count):
+            c.put(f'/o{i}.txt', data=b'x' * 1024, headers=CURL)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:>3}: {elapsed / count * 1e6:8.0f} us per upload")
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+
+def mount_tmpfs(fs_mb):
+    path = tempfile.mkdtemp(prefix='cupload-smallfs-')
+    if os.geteuid() == 0:
+        result = subprocess.run(['mount', '-t', 'tmpfs', '-o', f'size={fs_mb}m', 'tmpfs', path], capture_output=True)
+        if result.returncode == 0:
+            return path, True
+    return path, False
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fs-mb', type=int, default=64)
+    parser.add_argument('--dir', help='an existing (small) filesystem to run on')
+    parser.add_argument('--overhead', type=int, default=500, help='uploads for the admission cost (0: skip)')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    mounted = False
+    if args.dir:
+        folder = tempfile.mkdtemp(prefix='cupload-bench-', dir=args.dir)
+    else:
+        folder, mounted = mount_tmpfs(args.fs_mb)
+    fs_bytes = args.fs_mb * MB
+    simulated = 0
+    if args.dir:
+        disk = shutil.disk_usage(folder)
+        fs_bytes = disk.used + disk.free
+    elif not mounted:
+        simulated = fs_bytes
+    print(f"store on {'a simulated' if simulated else 'a real'} {fs_bytes // MB} MiB filesystem ({folder})")
+    try:
+        quota(folder, fs_bytes, simulated)
+        eviction(folder, fs_bytes, simulated)
+        refusal(folder, fs_bytes, simulated)
+        disk_full(folder, fs_bytes, simulated)
+        sweep(folder, fs_bytes, simulated)
+        live_stats(folder, fs_bytes, simulated)
+        if args.overhead:
+            overhead(folder, simulated, args.overhead)
+    finally:
+        if mounted:
+            subprocess.run(['umount', '-l', folder])  # index connections may still be open
+            os.rmdir(folder)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,287 @@
+"""Benchmark suite: every endpoint under concurrent load, machine-readable results.
+
+    python -m bench.suite --json results.json            # all scenarios
+    python -m bench.suite upload_1mb viewer --seconds 5  # a subset
+    python -m bench.suite --compare base.json results.json --threshold 15
+
+Runs in-process against create_app() on a throwaway UPLOAD_FOLDER (no network, rate limits
+off). Each scenario drives one operation from --concurrency threads for --seconds and
+reports throughput, p50/p95/p99/max latency, errors, RSS and open file descriptors
+(sampled while it runs). --compare exits non-zero if a scenario lost more than
+--threshold percent throughput or gained that much p99 latency.
+"""
+import argparse
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from bench.common import temp_config, link_path, BodyStream, peak_rss_mb, rss_mb, fd_count, percentiles
+
+CURL = {'User-Agent': 'curl/8.5.0'}
+BROWSER = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0'}
+BIG_BUDGET = {'X-Downloads': '1000000'}
+
+
+class Scenarios:
+    # Each method builds one operation: a callable doing one request and returning its status.
+    # Setup (seed uploads etc.) happens here, outside the timed loop.
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+        self.counter = itertools.count()
+
+    def _name(self, ext):
+        return f"bench-{next(self.counter)}{ext}"
+
+    def _upload(self, size, ext='.bin', headers=None):
+        def op(client):
+            return client.put('/' + self._name(ext), input_stream=BodyStream(size, b'cupload '),
+                              headers=dict(headers or {}, **CURL)).status_code
+        return op
+
+    def upload_1kb(self):
+        return self._upload(1024)
+
+    def upload_1mb(self):
+        return self._upload(1024 * 1024)
+
+    def upload_10mb(self):
+        return self._upload(10 * 1024 * 1024)
+
+    def upload_text_1mb(self):
+        # Compressible path (only differs from upload_1mb when STORAGE_COMPRESSION is on)
+        return self._upload(1024 * 1024, '.log')
+
+    def download_single(self):
+        # One-shot links: every fetch consumes and deletes its link; a seeder keeps a stock
+        links = []
+        lock = threading.Lock()
+
+        def op(client):
+            with lock:
+                link = links.pop() if links else None
+            if link is None:
+                link = link_path(client.put('/' + self._name('.bin'), data=b'x' * 64 * 1024, headers=CURL))
+            resp = client.get(link, headers=CURL)
+            resp.get_data()
+            resp.close()
+            return resp.status_code
+        for _ in range(200):
+            links.append(link_path(self.client.put('/' + self._name('.bin'), data=b'x' * 64 * 1024, headers=CURL)))
+        return op
+
+    def download_multi(self):
+        link = link_path(self.client.put('/shared.bin', input_stream=BodyStream(1024 * 1024), headers=dict(BIG_BUDGET, **CURL)))
+
+        def op(client):
+            resp = client.get(link, headers=CURL)
+            resp.get_data()
+            resp.close()
+            return resp.status_code
+        return op
+
+    def viewer(self):
+        source = ''.join(f"def handler_{i}(request):\n    return {i} * 2  # line {i}\n" for i in range(3000))
+        link = link_path(self.client.put('/module.py', data=source.encode(), headers=dict(BIG_BUDGET, **CURL)))
+        return lambda client: client.get(link, headers=BROWSER).status_code
+
+    def _locked_link(self):
+        return link_path(self.client.put('/' + self._name('.txt'), data=b'secret report\n' * 100,
+                                         headers=dict(BIG_BUDGET, **CURL, **{'X-Password': 'hunter2'})))
+
+    def password_unlock(self):
+        # Fresh client every time: the password goes through the KDF on each request
+        link = self._locked_link()
+
+        def op(client):
+            client.cookie_jar.clear()
+            return client.post(link, data={'password': 'hunter2'}, headers=CURL).status_code
+        return op
+
+    def password_download(self):
+        # Repeat fetches of an unlocked link: the access cookie skips the KDF
+        link = self._locked_link()
+        return lambda client: client.post(link, data={'password': 'hunter2'}, headers=CURL).status_code
+
+    def secret_create_burn(self):
+        def op(client):
+            resp = client.post('/secret', data=b'db password: correct horse battery staple', headers=CURL)
+            if resp.status_code != 200:
+                return resp.status_code
+            url = resp.get_data(as_text=True).split('https://qurl.sh')[1].strip()
+            return client.get(url, headers=CURL).status_code
+        return op
+
+    def pretty(self):
+        doc = json.dumps({'items': [{'id': i, 'tags': ['a', 'b'], 'ok': True} for i in range(500)]}).encode()
+
+        def op(client):
+            resp = client.post('/pretty', data={'file': (io.BytesIO(doc), 'doc.json')})
+            if resp.status_code != 200:
+                return resp.status_code
+            return client.get(link_path(resp)).status_code
+        return op
+
+    def qr(self):
+        link = link_path(self.client.put('/qr-target.txt', data=b'hello', headers=dict(BIG_BUDGET, **CURL)))
+        return lambda client: client.get('/qr' + link).status_code
+
+    def mixed(self):
+        # Rough production mix: mostly downloads and views, some uploads, few of the rest
+        weighted = [(self.download_single(), 30), (self.download_multi(), 15), (self.viewer(), 20),
+                    (self.upload_1kb(), 10), (self.upload_1mb(), 5), (self.qr(), 10),
+                    (self.password_download(), 3), (self.password_unlock(), 1), (self.secret_create_burn(), 4), (self.pretty(), 2)]
+        ops = [op for op, weight in weighted for _ in range(weight)]
+        return lambda client: random.choice(ops)(client)
+
+
+SCENARIOS = ['upload_1kb', 'upload_1mb', 'upload_10mb', 'upload_text_1mb', 'download_single',
+             'download_multi', 'viewer', 'password_unlock', 'password_download', 'secret_create_burn', 'pretty', 'qr', 'mixed']
+
+
+def run_scenario(app, op, seconds, concurrency):
+    op(app.test_client())  # warm-up: lazy pools, caches, first-request imports
+    latencies, errors = [], []
+    stop = threading.Event()
+    usage = {'peak_fds': fd_count(), 'peak_rss_mb': rss_mb()}
+
+    def worker():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                status = op(client)
+            except Exception as e:
+                status = repr(e)
+            elapsed = (time.perf_counter() - start) * 1000
+            if isinstance(status, int) and status < 400:
+                latencies.append(elapsed)
+            else:
+                errors.append(status)
+
+    def sampler():
+        while not stop.is_set():
+            usage['peak_fds'] = max(usage['peak_fds'], fd_count())
+            usage['peak_rss_mb'] = max(usage['peak_rss_mb'], rss_mb())
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)] + [threading.Thread(target=sampler)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    p = percentiles(latencies)
+    return {
+        'ops': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted({str(e) for e in errors})[:5],
+        'throughput_ops_s': round(len(latencies) / wall, 2),
+        'p50_ms': round(p[50], 3),
+        'p95_ms': round(p[95], 3),
+        'p99_ms': round(p[99], 3),
+        'max_ms': round(max(latencies), 3) if latencies else None,
+        'rss_mb': round(rss_mb(), 1),
+        'peak_rss_mb': round(usage['peak_rss_mb'], 1),
+        'fds': fd_count(),
+        'peak_fds': usage['peak_fds'],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    from app import create_app
+
+    app = create_app(temp_config(MAX_DOWNLOADS=1000000, MAX_CONTENT_LENGTH=64 * 1024 * 1024))
+    logging.getLogger().setLevel(logging.WARNING)  # per-request INFO lines would dominate the profile
+    scenarios = Scenarios(app)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'cpus': len(os.sched_getaffinity(0)),
+            'seconds': args.seconds,
+            'concurrency': args.concurrency,
+        },
+        'scenarios': {},
+    }
+    print(f"{'scenario':>18}  {'ops/s':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  {'errors':>6}  "
+          f"{'RSS MB':>7}  {'fds':>4}", file=sys.stderr)
+    for name in args.scenarios or SCENARIOS:
+        op = getattr(scenarios, name)()
+        r = run_scenario(app, op, args.seconds, args.concurrency)
+        results['scenarios'][name] = r
+        print(f"{name:>18}  {r['throughput_ops_s']:>8.1f}  {r['p50_ms']:>8.2f}  {r['p95_ms']:>8.2f}  "
+              f"{r['p99_ms']:>8.2f}  {r['errors']:>6}  {r['peak_rss_mb']:>7.1f}  {r['peak_fds']:>4}", file=sys.stderr)
+    results['meta']['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+    output = json.dumps(results, indent=2)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+def compare(base_path, new_path, threshold):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'scenario':>18}  {'ops/s':>18}  {'p99 ms':>18}")
+    regressions = []
+    for name, b in base['scenarios'].items():
+        n = new['scenarios'].get(name)
+        if n is None:
+            continue
+        tput = (n['throughput_ops_s'] - b['throughput_ops_s']) / b['throughput_ops_s'] * 100 if b['throughput_ops_s'] else 0
+        p99 = (n['p99_ms'] - b['p99_ms']) / b['p99_ms'] * 100 if b['p99_ms'] else 0
+        flag = ''
+        if tput < -threshold or p99 > threshold or n['errors'] > b['errors']:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:>18}  {b['throughput_ops_s']:>8.1f} {tput:>+8.1f}%  {b['p99_ms']:>8.2f} {p99:>+8.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=', '.join(SCENARIOS))
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--json', help='write results here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=10, help='percent')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    run(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
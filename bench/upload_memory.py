@@ -0,0 +1,44 @@
+"""Peak RSS of a worker handling a single PUT upload, per upload size.
+
+Each size runs in a fresh interpreter so ru_maxrss reflects only that upload.
+
+    python -m bench.upload_memory 1 10 50 200
+"""
+import json
+import subprocess
+import sys
+
+SIZES_MB = [1, 10, 50, 200]
+
+
+def run_one(size_mb):
+    from bench.common import temp_config, peak_rss_mb, BodyStream
+    from app import create_app
+
+    size = size_mb * 1024 * 1024
+    app = create_app(temp_config(MAX_CONTENT_LENGTH=size + 1))
+    client = app.test_client()
+    before = peak_rss_mb()
+    resp = client.put('/blob.bin', input_stream=BodyStream(size),
+                      headers={'Content-Length': str(size)})
+    assert resp.status_code == 200, resp.data
+    print(json.dumps({'size_mb': size_mb, 'rss_before_mb': round(before, 1),
+                      'rss_peak_mb': round(peak_rss_mb(), 1)}))
+
+
+def main(argv):
+    if argv and argv[0] == '--child':
+        run_one(int(argv[1]))
+        return
+    sizes = [int(a) for a in argv] or SIZES_MB
+    print(f"{'size MB':>8}  {'RSS before':>10}  {'RSS peak':>9}  {'delta':>6}")
+    for size_mb in sizes:
+        out = subprocess.run([sys.executable, '-m', 'bench.upload_memory', '--child', str(size_mb)],
+                             check=True, capture_output=True, text=True).stdout
+        row = json.loads(out.strip().splitlines()[-1])
+        delta = row['rss_peak_mb'] - row['rss_before_mb']
+        print(f"{size_mb:>8}  {row['rss_before_mb']:>10}  {row['rss_peak_mb']:>9}  {delta:>6.1f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
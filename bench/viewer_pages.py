@@ -0,0 +1,50 @@
+"""Code viewer cost for large text uploads: first page render and a follow-up chunk.
+
+Reports wall time and tracemalloc peak (Python heap) per request.
+
+    python -m bench.viewer_pages 1 10 50
+"""
+import re
+import sys
+import time
+import tracemalloc
+
+from bench.common import temp_config, link_path, BodyStream
+
+SIZES_MB = [1, 10, 50]
+LINE = b"2024-01-01T00:00:00Z INFO worker-3 request handled path=/api/v1/items status=200 ms=12\n"
+
+
+def timed(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    resp = fn()
+    body = resp.get_data(as_text=True)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resp, body, elapsed * 1000, peak / 1048576
+
+
+def main(argv):
+    from app import create_app
+
+    sizes = [int(a) for a in argv] or SIZES_MB
+    print(f"{'size MB':>7}  {'page ms':>8}  {'page peak MB':>12}  {'page KB':>8}  {'chunk ms':>8}  {'chunk peak MB':>13}")
+    for size_mb in sizes:
+        size = size_mb * 1024 * 1024
+        app = create_app(temp_config(MAX_CONTENT_LENGTH=size + 1))
+        client = app.test_client()
+        resp = client.put('/app.log', input_stream=BodyStream(size, LINE), headers={'Content-Length': str(size)})
+        path = link_path(resp)
+
+        _, body, page_ms, page_peak = timed(lambda: client.get(path))
+        chunk_url = re.search(r'const chunkUrl = "(.*?)";', body).group(1)
+        offset = re.search(r'let nextOffset = (\d+);', body).group(1)
+        _, _, chunk_ms, chunk_peak = timed(lambda: client.get(f"{chunk_url}&offset={offset}"))
+        print(f"{size_mb:>7}  {page_ms:>8.1f}  {page_peak:>12.2f}  {len(body) // 1024:>8}  "
+              f"{chunk_ms:>8.1f}  {chunk_peak:>13.2f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
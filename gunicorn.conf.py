@@ -0,0 +1,93 @@
+import os
+import math
+import shutil
+
+# Gunicorn settings, loaded with `gunicorn -c gunicorn.conf.py wsgi:app`.
+# Sizes are derived from the CPUs and memory the container may actually use (cgroup limits),
+# every value can be overridden with the GUNICORN_* variables below.
+#
+# GUNICORN_WORKER_CLASS:
+#   'gevent' (default): each worker multiplexes many connections, so slow downloaders and
+#            uploaders only cost a socket and a greenlet instead of a whole process
+#   'sync':  one request per process; needs nginx buffering in front to survive slow clients
+
+def _cpu_count():
+    try:
+        quota, period = open('/sys/fs/cgroup/cpu.max').read().split()
+        if quota != 'max':
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+def _memory_bytes():
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            value = open(path).read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:  # v1 reports "no limit" as a huge number
+            return int(value)
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+
+# GUNICORN_PRELOAD (default true): build the app once in the master and fork the workers
+# from it, so they share its memory copy-on-write and boot in milliseconds. create_app
+# starts no threads (the scheduler starts in post_worker_init below). Code changes then
+# need a full restart; a HUP only recycles the workers.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+if preload_app and worker_class == 'gevent':
+    # The gevent worker patches only after the fork, too late for the preloaded modules.
+    # This is why the worker class must come from GUNICORN_WORKER_CLASS and not -k.
+    from gevent import monkey
+    monkey.patch_all()
+
+cpus = _cpu_count()
+memory_mb = _memory_bytes() // (1024 * 1024)
+# Resident size budgeted per worker, including its share of /pretty formatter processes
+worker_memory_mb = int(os.environ.get('GUNICORN_WORKER_MEMORY_MB', 256))
+max_by_memory = max(1, memory_mb // 2 // worker_memory_mb)  # leave half for page cache and nginx
+
+if worker_class == 'sync':
+    default_workers = 2 * cpus + 1
+else:
+    # Async workers are CPU-bound only; more of them than cores just adds memory
+    default_workers = cpus
+workers = int(os.environ.get('GUNICORN_WORKERS', min(default_workers, max_by_memory)))
+
+# Concurrent connections per async worker. An idle slow client costs its socket buffers
+# plus one UPLOAD_CHUNK_SIZE read buffer, ~256 KB at worst.
+default_connections = min(1000, max(100, memory_mb // 2 // workers * 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', default_connections))
+
+# A sync worker is killed if a request runs longer than this; async workers heartbeat from
+# their own greenlet, so long slow transfers are not cut off.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Per-worker metric files (app/metrics.py): start from an empty directory, and drop the
+# live-gauge samples of workers that exit
+def on_starting(server):
+    if preload_app and worker_class == 'gevent' and server.cfg.worker_class_str != worker_class:
+        # A sync worker in a monkey-patched process hangs on its first request
+        raise RuntimeError(f"set the worker class with GUNICORN_WORKER_CLASS={server.cfg.worker_class_str}, not -k")
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    if server.cfg.preload_app:
+        # The app imports these lazily; loaded here they are shared by every worker
+        from app import preload_modules
+        preload_modules()
+
+def post_worker_init(worker):
+    from app import start_scheduler
+    start_scheduler(worker.wsgi)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,29 @@
+import logging
+
+import pytest
+
+from app.config import Config
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # create_app() on a throwaway UPLOAD_FOLDER: no scheduler, rate limits and upload quotas off
+    from app import create_app
+
+    def make(**overrides):
+        attrs = {
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'CLEANUP_SCHEDULER': 'off',
+            'RATELIMIT_ENABLED': False,
+            'CLIENT_QUOTA_BYTES': 0,
+        }
+        attrs.update(overrides)
+        app = create_app(type('TestConfig', (Config,), attrs))
+        app.logger.setLevel(logging.WARNING)
+        return app
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
@@ -0,0 +1,33 @@
+import os
+
+from app.storage import upload_dir
+from app.utils import read_meta
+
+CURL = {'User-Agent': 'curl/8.5.0'}
+
+
+def client_for(app, addr='10.0.0.1'):
+    client = app.test_client()
+    client.environ_base['REMOTE_ADDR'] = addr
+    return client
+
+
+def upload(client, name, data, downloads=1):
+    # "/<id>/<filename>" of a new link
+    response = client.put(f'/{name}', data=data, headers=dict(CURL, **{'X-Downloads': str(downloads)}))
+    assert response.status_code == 200, response.data
+    return '/' + response.get_data(as_text=True).split('https://qurl.sh/')[1].split('\n')[0]
+
+
+def get(client, path, **headers):
+    return client.get(path, headers=dict(CURL, **headers))
+
+
+def remaining(app, path):
+    # remaining_downloads of a link, None once it is gone
+    random_id, filename = path.strip('/').split('/')
+    meta_path = os.path.join(upload_dir(app.config['UPLOAD_FOLDER'], random_id), filename + '.meta')
+    try:
+        return read_meta(meta_path).get('remaining_downloads')
+    except FileNotFoundError:
+        return None
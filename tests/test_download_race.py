@@ -0,0 +1,52 @@
+import multiprocessing
+
+import pytest
+
+from app.config import Config
+from tests.helpers import CURL, upload
+
+WORKERS = 16
+DOWNLOADS = 5
+ROUNDS = 3
+
+
+def fetch(config, path, barrier, results):
+    # One worker process with its own app instance, like gunicorn -w N
+    from app import create_app
+
+    client = create_app(config).test_client()
+    barrier.wait()
+    response = client.get(path, headers=CURL)
+    # In accel mode nginx would send the body; the redirect header is the grant
+    body = response.get_data() or response.headers.get('X-Accel-Redirect', '').encode()
+    response.close()
+    results.put((response.status_code, body))
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('mode', ['stream', 'accel'])
+def test_exactly_n_of_m_served(tmp_path, mode):
+    from app import create_app
+
+    config = type('TestConfig', (Config,), {
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'CLEANUP_SCHEDULER': 'off',
+        'RATELIMIT_ENABLED': False,
+        'CLIENT_QUOTA_BYTES': 0,
+        'DOWNLOAD_MODE': mode,
+    })
+    client = create_app(config).test_client()
+    ctx = multiprocessing.get_context('fork')
+    for _ in range(ROUNDS):
+        path = upload(client, 'hot.txt', b'payload', downloads=DOWNLOADS)
+        barrier = ctx.Barrier(WORKERS)
+        results = ctx.Queue()
+        procs = [ctx.Process(target=fetch, args=(config, path, barrier, results)) for _ in range(WORKERS)]
+        for p in procs:
+            p.start()
+        outcomes = [results.get(timeout=60) for _ in procs]
+        for p in procs:
+            p.join()
+
+        assert sum(1 for status, body in outcomes if status == 200 and body) == DOWNLOADS
+        assert {status for status, _ in outcomes} <= {200, 404}
@@ -0,0 +1,29 @@
+import logging
+import os
+
+from app.meta_index import ensure_index, rebuild_index, expired_rows
+from app.storage import upload_dir
+from app.utils import write_meta
+
+
+def legacy_upload(upload_folder, upload_id, expiry_time):
+    # An upload written before the index existed: a .meta file and no index row
+    dir_path = upload_dir(upload_folder, upload_id)
+    os.makedirs(dir_path)
+    with open(os.path.join(dir_path, 'old.txt'), 'wb') as f:
+        f.write(b'old')
+    write_meta(os.path.join(dir_path, 'old.txt.meta'), {'expiry_time': expiry_time, 'remaining_downloads': 1})
+
+
+def test_empty_index_next_to_uploads_is_reported(app, caplog):
+    upload_folder, index_path = app.config['UPLOAD_FOLDER'], app.config['META_INDEX_PATH']
+    assert ensure_index(upload_folder, index_path)
+    legacy_upload(upload_folder, 'legacy01', 1)
+    with caplog.at_level(logging.WARNING, logger='app.meta_index'):
+        assert not ensure_index(upload_folder, index_path)
+    assert 'flask rebuild-index' in caplog.text
+    assert expired_rows(index_path, 2, 10) == []
+
+    assert rebuild_index(upload_folder, index_path) == 1
+    assert ensure_index(upload_folder, index_path)
+    assert [upload_id for _, upload_id in expired_rows(index_path, 2, 10)] == ['legacy01']
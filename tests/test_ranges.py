@@ -0,0 +1,179 @@
+import os
+import time
+
+import pytest
+
+from tests.helpers import CURL, client_for, upload, get, remaining
+
+SIZE = 256 * 1024
+
+
+@pytest.fixture
+def data():
+    return os.urandom(SIZE)
+
+
+def parse_byteranges(response):
+    # [(content_range, body)] of a multipart/byteranges response
+    boundary = response.headers['Content-Type'].split('boundary=')[1].encode()
+    parts = []
+    for chunk in response.data.split(b'--' + boundary)[1:]:
+        if chunk.startswith(b'--'):
+            break
+        head, _, body = chunk.lstrip(b'\r\n').partition(b'\r\n\r\n')
+        fields = dict(line.split(': ', 1) for line in head.decode().split('\r\n'))
+        parts.append((fields['Content-Range'], body[:-2] if body.endswith(b'\r\n') else body))
+    return parts
+
+
+def test_single_suffix_and_open_ended_ranges(app, data):
+    a = client_for(app)
+    path = upload(a, 'data.bin', data, downloads=10)
+    r = get(a, path, Range='bytes=100-199')
+    assert r.status_code == 206 and r.data == data[100:200]
+    assert r.headers['Content-Range'] == f'bytes 100-199/{SIZE}' and r.content_length == 100
+    r = get(a, path, Range='bytes=-1000')
+    assert r.status_code == 206 and r.data == data[-1000:]
+    r = get(a, path, Range=f'bytes={SIZE - 10}-')
+    assert r.status_code == 206 and r.data == data[-10:]
+    r = get(a, path, Range=f'bytes={SIZE - 50}-{SIZE * 2}')
+    assert r.status_code == 206 and r.data == data[-50:]
+    assert remaining(app, path) == 9  # one logical download for all of them
+
+
+def test_multipart_byteranges(app, data):
+    a = client_for(app)
+    path = upload(a, 'data.bin', data, downloads=10)
+    r = get(a, path, Range='bytes=0-9,20-29,30-39,-5')
+    assert r.status_code == 206 and r.content_length == len(r.data)
+    assert r.headers['Content-Type'].startswith('multipart/byteranges; boundary=')
+    # Adjacent parts merged
+    assert parse_byteranges(r) == [
+        (f'bytes 0-9/{SIZE}', data[0:10]),
+        (f'bytes 20-39/{SIZE}', data[20:40]),
+        (f'bytes {SIZE - 5}-{SIZE - 1}/{SIZE}', data[-5:]),
+    ]
+
+
+def test_unusable_ranges(app, data):
+    a = client_for(app)
+    path = upload(a, 'data.bin', data, downloads=10)
+    r = get(a, path, Range='bytes=20-29,25-39')
+    assert r.status_code == 200 and r.data == data  # overlapping parts: whole body
+    r = get(a, path, Range='bytes=9-2')
+    assert r.status_code == 200 and r.data == data  # invalid: whole body
+    r = get(a, path, Range=f'bytes={SIZE}-')
+    assert r.status_code == 416 and r.headers['Content-Range'] == f'bytes */{SIZE}'
+
+
+def test_if_range(app, data):
+    a, b = client_for(app, '10.0.0.1'), client_for(app, '10.0.0.2')
+    path = upload(a, 'data.bin', data, downloads=10)
+    etag = get(a, path).headers['ETag']
+    r = get(b, path, Range='bytes=0-99', **{'If-Range': etag})
+    assert r.status_code == 206 and r.data == data[:100]
+    r = get(b, path, Range='bytes=0-99', **{'If-Range': '"stale"'})
+    assert r.status_code == 200 and r.data == data
+    # The fresh range counts once, the stale If-Range is a new download
+    assert remaining(app, path) == 7
+
+
+def test_conditional_requests_use_no_download(app, data):
+    a = client_for(app)
+    path = upload(a, 'data.bin', data, downloads=10)
+    r = get(a, path)
+    etag, last_modified = r.headers['ETag'], r.headers['Last-Modified']
+    assert r.headers['Cache-Control'].startswith('no-store')
+    r = get(a, path, **{'If-None-Match': etag})
+    assert r.status_code == 304 and not r.data and r.headers['ETag'] == etag
+    assert get(a, path, **{'If-Modified-Since': last_modified}).status_code == 304
+    r = a.head(path, headers=CURL)
+    assert r.status_code == 200 and r.content_length == SIZE and r.headers['Accept-Ranges'] == 'bytes'
+    assert remaining(app, path) == 9
+
+
+def test_resume_after_partial_download(app, data):
+    a, b = client_for(app, '10.0.0.1'), client_for(app, '10.0.0.2')
+    path = upload(a, 'resume.bin', data)
+    r = a.get(path, headers=dict(CURL, Range='bytes=0-'), buffered=False)
+    got = b''
+    for chunk in r.response:
+        got += chunk
+        if len(got) >= SIZE // 3:
+            break
+    r.close()  # connection dropped
+    etag = r.headers['ETag']
+    assert remaining(app, path) == 0
+    assert 'download_session=' in r.headers.get('Set-Cookie', '')
+
+    r = get(a, path, Range=f'bytes={len(got)}-', **{'If-Range': etag})
+    assert r.status_code == 206 and got + r.data == data
+    # Up to one more body in all
+    assert get(a, path, Range=f'bytes={SIZE - len(got)}-', **{'If-Range': etag}).status_code == 206
+    assert get(a, path, Range='bytes=0-').status_code == 404
+    assert get(a, path).status_code == 404
+    assert get(b, path).status_code == 404 and get(b, path, Range='bytes=0-').status_code == 404
+
+
+def test_spent_link_cannot_be_fetched_again_with_a_range(app, data):
+    a = client_for(app)
+    path = upload(a, 'once.bin', data)
+    r = get(a, path)
+    r.close()  # as the WSGI server does after the last byte
+    assert r.status_code == 200 and 'Set-Cookie' not in r.headers
+    assert remaining(app, path) is None  # removed at once
+    for _ in range(5):
+        # New clients from the same address (or claiming it via X-Forwarded-For)
+        same_ip = client_for(app, '10.0.0.1')
+        assert get(same_ip, path, Range='bytes=0-').status_code == 404
+        assert get(same_ip, path, Range='bytes=0-', **{'X-Forwarded-For': '10.0.0.1'}).status_code == 404
+
+
+def test_spent_by_a_range_session_holder_only(app, data):
+    a = client_for(app)
+    path = upload(a, 'once.bin', data)
+    assert get(a, path, Range='bytes=0-').status_code == 206
+    assert remaining(app, path) == 0
+    for _ in range(5):
+        assert get(client_for(app, '10.0.0.1'), path, Range='bytes=0-').status_code == 404
+
+
+def test_viewer_seeking_counts_once(app, data):
+    a = client_for(app)
+    path = upload(a, 'doc.pdf', data)
+    for i in range(20):
+        start = (i * 7919) % SIZE
+        r = get(a, path + '?raw=true', Range=f'bytes={start}-{start + 4095}')
+        assert r.status_code == 206 and r.data == data[start:start + 4096]
+    assert remaining(app, path) == 0
+    assert 'Content-Disposition' not in r.headers
+
+
+def test_session_window(make_app, data):
+    app = make_app(RANGE_SESSION_SECONDS=1)
+    a = client_for(app)
+    path = upload(a, 'short.bin', data)
+    assert get(a, path, Range='bytes=0-9').status_code == 206
+    assert get(a, path, Range='bytes=10-19').status_code == 206
+    time.sleep(1.1)
+    assert get(a, path, Range='bytes=20-29').status_code == 404
+
+
+def test_no_session_window_counts_every_range(make_app, data):
+    app = make_app(RANGE_SESSION_SECONDS=0)
+    a = client_for(app)
+    path = upload(a, 'counted.bin', data, downloads=2)
+    assert [get(a, path, Range=f'bytes={i}-{i}').status_code for i in range(3)] == [206, 206, 404]
+
+
+def test_ranges_of_a_compressed_upload(make_app, data):
+    app = make_app(STORAGE_COMPRESSION='gzip')
+    a = client_for(app)
+    text = b''.join(b'line %d of a compressible log\n' % i for i in range(SIZE // 30))
+    path = upload(a, 'app.log', text, downloads=3)
+    r = get(a, path, **{'Accept-Encoding': 'gzip'})
+    assert r.status_code == 200 and r.headers.get('Content-Encoding') == 'gzip'
+    assert r.headers['ETag'].endswith('-gzip"')
+    r = get(a, path, Range='bytes=1000-1999,5000-5099', **{'Accept-Encoding': 'gzip'})
+    assert r.status_code == 206 and 'Content-Encoding' not in r.headers
+    assert [body for _, body in parse_byteranges(r)] == [text[1000:2000], text[5000:5100]]